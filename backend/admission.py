@@ -0,0 +1,168 @@
+"""Per-key rate limiting and load shedding, checked before a request does any work.
+
+`TokenBucketLimiter` keeps one bucket per key, such as a session or a client
+IP. Buckets refill continuously at `rate` tokens per second, up to `burst`.
+Once `max_keys` buckets exist, the least recently used one is dropped, so a
+flood of distinct keys cannot grow memory without bound.
+
+`LoadShedder` tracks in-flight HTTP requests and a time-decayed average of
+their latency to the first response byte. Beyond `max_in_flight`, every new
+request is refused. Above `latency_target`, a share of new requests grows
+with the overshoot and is refused too. Some requests always get through, so
+recovery is noticed.
+"""
+import math
+import random
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from metrics import MetricsRegistry
+
+
+class TokenBucketLimiter:
+    def __init__(self, rate: float, burst: float, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def acquire(self, key: str, now: Optional[float] = None) -> float:
+        """Take a token for `key`; returns 0 when allowed, else seconds until a token is due"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RateLimiter:
+    """Token buckets per session and per client IP for one route"""
+
+    def __init__(self, session_rate: float, session_burst: float, ip_rate: float, ip_burst: float,
+                 max_keys: int = 100_000):
+        self.sessions = TokenBucketLimiter(session_rate, session_burst, max_keys)
+        self.ips = TokenBucketLimiter(ip_rate, ip_burst, max_keys)
+
+    def check(self, session_id: str, client_ip: Optional[str]) -> Tuple[Optional[str], float]:
+        """Which limit refused the request ("session" or "ip") and the wait, or (None, 0)"""
+        wait = self.sessions.acquire(session_id)
+        if wait:
+            return "session", wait
+        if client_ip:
+            wait = self.ips.acquire(client_ip)
+            if wait:
+                return "ip", wait
+        return None, 0.0
+
+    def stats(self) -> Dict[str, int]:
+        """How many session and IP buckets are held, exported as gauges at /api/metrics"""
+        return {"sessions": len(self.sessions), "ips": len(self.ips)}
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+
+class LoadShedder:
+    def __init__(self, max_in_flight: int = 256, latency_target: float = 1.0, window: float = 10.0,
+                 max_shed_fraction: float = 0.9, retry_after: int = 1):
+        self.max_in_flight = max_in_flight
+        self.latency_target = latency_target
+        self.window = window
+        self.max_shed_fraction = max_shed_fraction
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.latency = 0.0
+        self._sampled_at: Optional[float] = None
+
+    def observe(self, seconds: float, now: Optional[float] = None):
+        """Fold one latency into the average; older samples fade over `window` seconds"""
+        now = time.monotonic() if now is None else now
+        if self._sampled_at is None:
+            self.latency = seconds
+        else:
+            weight = 1 - math.exp(-(now - self._sampled_at) / self.window)
+            self.latency += (seconds - self.latency) * max(weight, 0.01)
+        self._sampled_at = now
+
+    def shed_fraction(self, now: Optional[float] = None) -> float:
+        """Share of new requests to refuse for latency; an average with no recent samples is ignored"""
+        if self.latency_target <= 0 or self._sampled_at is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        if now - self._sampled_at > self.window or self.latency <= self.latency_target:
+            return 0.0
+        return min(self.max_shed_fraction, self.latency / self.latency_target - 1)
+
+    def reject_reason(self) -> Optional[str]:
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return "in_flight"
+        fraction = self.shed_fraction()
+        if fraction and random.random() < fraction:
+            return "latency"
+        return None
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "in_flight": self.in_flight,
+            "latency_seconds": round(self.latency, 6),
+            "shed_fraction": round(self.shed_fraction(), 4),
+        }
+
+
+class LoadSheddingMiddleware:
+    """Pure ASGI middleware refusing HTTP requests with 503 while the shedder says so"""
+
+    def __init__(self, app, shedder: LoadShedder, registry: MetricsRegistry, exempt_paths: Iterable[str] = ()):
+        self.app = app
+        self.shedder = shedder
+        self.registry = registry
+        self.exempt_paths = frozenset(exempt_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            return await self.app(scope, receive, send)
+
+        shedder = self.shedder
+        reason = shedder.reject_reason()
+        if reason:
+            self.registry.increment("shed_requests", reason=reason)
+            response = JSONResponse(
+                {"detail": "Server is overloaded, please retry shortly"},
+                status_code=503,
+                headers={"Retry-After": str(shedder.retry_after)},
+            )
+            return await response(scope, receive, send)
+
+        started = time.perf_counter()
+        observed = False
+
+        async def send_with_timing(message):
+            nonlocal observed
+            if message["type"] == "http.response.start" and not observed:
+                observed = True
+                shedder.observe(time.perf_counter() - started)
+            await send(message)
+
+        shedder.in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            shedder.in_flight -= 1
+            if not observed:
+                shedder.observe(time.perf_counter() - started)
@@ -0,0 +1,366 @@
+"""Bucketed chat history for MongoDB.
+
+With `CHAT_STORAGE_MODE=buckets`, messages of one (companion_id, session_id)
+are appended to `chat_buckets` documents of up to `CHAT_BUCKET_SIZE`
+messages each, numbered by `seq`. A history page is one or two sequential
+bucket reads off a single small index instead of a scattered fetch per
+message, and there is one index entry per bucket rather than three per
+message.
+
+Only the newest bucket of a session is ever open (flagged `open`, since a
+larger bucket size would otherwise make older full buckets look open too):
+writes push into it with a count-capped conditional update and start the
+next bucket, closing this one, once it is full.
+Messages are ordered by bucket and position, so history cursors carry
+`seq:index` as their tie-breaker.
+
+Existing per-message documents are moved over, and buckets left under-filled
+by a bucket size change are repacked, with:
+
+    python chat_buckets.py migrate [--companion-id ID] [--delete-source]
+    python chat_buckets.py compact [--companion-id ID]
+
+Run these while the app is stopped or still in document mode; a session being
+rewritten briefly shows both its old and new buckets.
+"""
+import argparse
+import asyncio
+import logging
+import math
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+import conversation_state
+from storage import MongoChatStore
+
+BUCKET_SIZE = int(os.environ.get('CHAT_BUCKET_SIZE', '100'))
+
+
+class BucketKey(NamedTuple):
+    """Position of a message: bucket `seq` and index within the bucket"""
+    bucket: int
+    index: int
+
+    def __str__(self):
+        return f"{self.bucket}:{self.index}"
+
+
+def bucket_entry(message: dict) -> dict:
+    return {
+        "id": message["id"],
+        "message": message["message"],
+        "is_user": message["is_user"],
+        "timestamp": message["timestamp"],
+    }
+
+
+def append_update(entries: List[dict]) -> dict:
+    timestamps = [entry["timestamp"] for entry in entries]
+    return {
+        "$push": {"messages": {"$each": entries}},
+        "$inc": {"count": len(entries)},
+        "$min": {"start": min(timestamps)},
+        "$max": {"end": max(timestamps)},
+    }
+
+
+def new_bucket(companion_id: str, session_id: str, seq: int, entries: List[dict], is_open: bool = True) -> dict:
+    timestamps = [entry["timestamp"] for entry in entries]
+    return {
+        "companion_id": companion_id,
+        "session_id": session_id,
+        "seq": seq,
+        "open": is_open,
+        "count": len(entries),
+        "start": min(timestamps),
+        "end": max(timestamps),
+        "messages": entries,
+    }
+
+
+def message_score(text: str, terms: List[str]) -> float:
+    """Term hits per message, damped for long messages; a word matches a term it starts with"""
+    words = re.findall(r"\w+", text.lower())
+    hits = sum(1 for word in words for term in terms if word.startswith(term))
+    return hits / (1 + len(words) / 50) if hits else 0.0
+
+
+class MongoBucketChatStore(MongoChatStore):
+    def __init__(self, db, bucket_size: int = BUCKET_SIZE):
+        super().__init__(db)
+        self.bucket_size = bucket_size
+
+    def cursor_key(self, value):
+        bucket, _, index = value.partition(":")
+        return BucketKey(int(bucket), int(index))
+
+    async def insert_many(self, messages):
+        sessions: Dict[Tuple[str, str], List[dict]] = {}
+        for message in messages:
+            sessions.setdefault((message["companion_id"], message["session_id"]), []).append(bucket_entry(message))
+        await asyncio.gather(*(
+            self.append(companion_id, session_id, entries) for (companion_id, session_id), entries in sessions.items()
+        ))
+
+    async def append(self, companion_id: str, session_id: str, entries: List[dict]):
+        """Append to the session's open bucket, opening new ones as buckets fill up"""
+        session = {"companion_id": companion_id, "session_id": session_id}
+        while entries:
+            # Usually one round trip: the open bucket still has room for everything
+            result = await self.db.chat_buckets.update_one(
+                {**session, "open": True, "count": {"$lte": self.bucket_size - len(entries)}},
+                append_update(entries),
+            )
+            if result.matched_count:
+                return
+
+            latest = await self.db.chat_buckets.find_one(session, {"seq": 1, "count": 1}, sort=[("seq", -1)])
+            if latest and latest["count"] < self.bucket_size:
+                # Top the open bucket up; the count condition loses cleanly to a concurrent append.
+                # Buckets written before the `open` flag get it here
+                room = self.bucket_size - latest["count"]
+                update = append_update(entries[:room])
+                update["$set"] = {"open": True}
+                result = await self.db.chat_buckets.update_one(
+                    {"_id": latest["_id"], "count": latest["count"]}, update
+                )
+                if result.matched_count:
+                    entries = entries[room:]
+                continue
+
+            seq = latest["seq"] + 1 if latest else 0
+            try:
+                await self.db.chat_buckets.insert_one(
+                    new_bucket(companion_id, session_id, seq, entries[:self.bucket_size])
+                )
+            except DuplicateKeyError:
+                continue  # another writer opened this bucket first
+            if latest:
+                await self.db.chat_buckets.update_one({"_id": latest["_id"]}, {"$set": {"open": False}})
+            entries = entries[self.bucket_size:]
+
+    async def export(self, companion_id=None, session_id=None, batch_size=1000):
+        query = {}
+        if companion_id:
+            query["companion_id"] = companion_id
+        if session_id:
+            query["session_id"] = session_id
+        buckets = self.db.chat_buckets.find(query).sort(
+            [("companion_id", 1), ("session_id", 1), ("seq", 1)]
+        ).batch_size(max(1, batch_size // self.bucket_size))
+        try:
+            async for bucket in buckets:
+                for entry in bucket["messages"]:
+                    yield {"companion_id": bucket["companion_id"], "session_id": bucket["session_id"], **entry}
+        finally:
+            await buckets.close()
+
+    async def history(self, companion_id, session_id, limit, before=None, after=None):
+        query = {"companion_id": companion_id, "session_id": session_id}
+        position = before or after
+        if position:
+            key = position[1]
+            query["seq"] = {"$gte": key.bucket} if after else {"$lte": key.bucket}
+        direction = 1 if after else -1
+
+        messages = []
+        # Enough buckets for a full page in the first batch, give or take a partial bucket at each end
+        buckets = self.db.chat_buckets.find(query).sort("seq", direction).batch_size(
+            limit // self.bucket_size + 2
+        )
+        async for bucket in buckets:
+            entries = [
+                {
+                    "_id": BucketKey(bucket["seq"], index),
+                    "companion_id": companion_id,
+                    "session_id": session_id,
+                    **entry,
+                }
+                for index, entry in enumerate(bucket["messages"])
+            ]
+            if direction == -1:
+                entries.reverse()
+            if position:
+                entries = [e for e in entries if (e["_id"] > key if after else e["_id"] < key)]
+            messages.extend(entries[:limit - len(messages)])
+            if len(messages) >= limit:
+                break
+        await buckets.close()
+        return messages
+
+    async def search(self, companion_id, session_id, terms, limit, offset=0):
+        if not terms:
+            return []
+        # The text index finds the buckets holding a (stemmed) match; messages within them are
+        # ranked here by prefix, so a term must pass both to find a message. Buckets are read
+        # best match first and only until the page is filled, so the cost follows the page
+        # size rather than how often the terms occur in the session
+        wanted = offset + limit
+        score = {"$meta": "textScore"}
+        buckets = self.db.chat_buckets.find(
+            {"companion_id": companion_id, "session_id": session_id, "$text": {"$search": " ".join(terms)}},
+            {"seq": 1, "messages": 1, "score": score},
+        ).sort([("score", score)]).limit(wanted)
+        hits = []
+        try:
+            async for bucket in buckets:
+                for index, entry in enumerate(bucket["messages"]):
+                    message_hit = message_score(entry["message"], terms)
+                    if message_hit:
+                        hits.append({
+                            "_id": BucketKey(bucket["seq"], index),
+                            "companion_id": companion_id,
+                            "session_id": session_id,
+                            **entry,
+                            "score": message_hit,
+                        })
+                if len(hits) >= wanted:
+                    break
+        finally:
+            await buckets.close()
+        hits.sort(key=lambda hit: (hit["score"], hit["timestamp"]), reverse=True)
+        return hits[offset:wanted]
+
+    async def delete_batch(self, companion_id, batch_size):
+        # Whole buckets at a time, roughly `batch_size` messages
+        buckets = await self.db.chat_buckets.find({"companion_id": companion_id}, {"_id": 1, "count": 1}).limit(
+            max(1, batch_size // self.bucket_size)
+        ).to_list(None)
+        if not buckets:
+            return 0
+        await self.db.chat_buckets.delete_many({"_id": {"$in": [b["_id"] for b in buckets]}})
+        return sum(b["count"] for b in buckets)
+
+    async def rebuild_states(self, companion_id=None, session_id=None, max_turns=conversation_state.RECENT_TURNS):
+        match = {}
+        if companion_id:
+            match["companion_id"] = companion_id
+        if session_id:
+            match["session_id"] = session_id
+
+        rebuilt = 0
+        sessions = self.db.chat_buckets.aggregate([
+            {"$match": match},
+            {"$unwind": "$messages"},
+            {"$group": {
+                "_id": {"companion_id": "$companion_id", "session_id": "$session_id"},
+                "message_count": {"$sum": 1},
+                "user_message_count": {"$sum": {"$cond": ["$messages.is_user", 1, 0]}},
+                "started_at": {"$min": "$messages.timestamp"},
+                "last_activity": {"$max": "$messages.timestamp"},
+            }},
+        ])
+        async for session in sessions:
+            key = session["_id"]
+            recent = await self.history(key["companion_id"], key["session_id"], max_turns)
+            recent.reverse()
+            await conversation_state.save_rebuilt_state(self.db.conversation_states, session, recent)
+            rebuilt += 1
+        return rebuilt
+
+
+async def rewrite_session(db, companion_id: str, session_id: str, bucket_size: int,
+                          from_documents: bool = False, delete_source: bool = False) -> int:
+    """Repack a session into full buckets, optionally folding in its per-message documents"""
+    session = {"companion_id": companion_id, "session_id": session_id}
+    old_buckets = await db.chat_buckets.find(session).sort("seq", 1).to_list(None)
+    messages = [entry for bucket in old_buckets for entry in bucket["messages"]]
+    migrated = []
+    if from_documents:
+        seen = {m["id"] for m in messages}
+        documents = await db.chat_messages.find(session).sort([("timestamp", 1), ("_id", 1)]).to_list(None)
+        migrated = [bucket_entry(d) for d in documents if d["id"] not in seen]
+        if not migrated:
+            if delete_source:
+                await db.chat_messages.delete_many(session)
+            return 0
+
+    # Stable sort: ties keep their stored order, and anything appended out of order is put back
+    messages = sorted(messages + migrated, key=lambda m: m["timestamp"])
+    # New buckets are numbered after the old ones, so both never share a seq
+    first_seq = old_buckets[-1]["seq"] + 1 if old_buckets else 0
+    starts = range(0, len(messages), bucket_size)
+    new_buckets = [
+        new_bucket(companion_id, session_id, first_seq + n, messages[start:start + bucket_size],
+                   is_open=n == len(starts) - 1)
+        for n, start in enumerate(starts)
+    ]
+    if new_buckets:
+        await db.chat_buckets.insert_many(new_buckets)
+    if old_buckets:
+        await db.chat_buckets.delete_many({"_id": {"$in": [b["_id"] for b in old_buckets]}})
+    if from_documents and delete_source:
+        await db.chat_messages.delete_many(session)
+    return len(migrated) if from_documents else len(messages)
+
+
+async def migrate(db, bucket_size: int = BUCKET_SIZE, companion_id: Optional[str] = None,
+                  delete_source: bool = False) -> int:
+    """Copy per-message documents into buckets; safe to re-run"""
+    match = {"companion_id": companion_id} if companion_id else {}
+    migrated = 0
+    sessions = db.chat_messages.aggregate([
+        {"$match": match},
+        {"$group": {"_id": {"companion_id": "$companion_id", "session_id": "$session_id"}}},
+    ])
+    async for session in sessions:
+        key = session["_id"]
+        migrated += await rewrite_session(
+            db, key["companion_id"], key["session_id"], bucket_size, from_documents=True, delete_source=delete_source
+        )
+    return migrated
+
+
+async def compact(db, bucket_size: int = BUCKET_SIZE, companion_id: Optional[str] = None) -> int:
+    """Repack sessions holding more buckets than their message count needs"""
+    match = {"companion_id": companion_id} if companion_id else {}
+    compacted = 0
+    sessions = db.chat_buckets.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {"companion_id": "$companion_id", "session_id": "$session_id"},
+            "buckets": {"$sum": 1},
+            "messages": {"$sum": "$count"},
+        }},
+    ])
+    async for session in sessions:
+        if session["buckets"] > math.ceil(session["messages"] / bucket_size):
+            key = session["_id"]
+            await rewrite_session(db, key["companion_id"], key["session_id"], bucket_size)
+            compacted += 1
+    return compacted
+
+
+async def _main(args):
+    from dotenv import load_dotenv
+    from storage import MongoStorage, create_storage
+
+    load_dotenv(Path(__file__).parent / '.env')
+    storage = create_storage()
+    try:
+        if not isinstance(storage, MongoStorage):
+            raise SystemExit("Chat buckets are only used with STORAGE_BACKEND=mongo")
+        await storage.init()
+        if args.command == "migrate":
+            migrated = await migrate(storage.db, args.bucket_size, args.companion_id, args.delete_source)
+            logging.info(f"Migrated {migrated} chat messages into buckets")
+        else:
+            compacted = await compact(storage.db, args.bucket_size, args.companion_id)
+            logging.info(f"Compacted {compacted} sessions")
+    finally:
+        await storage.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move chat history into buckets, or repack existing buckets")
+    parser.add_argument("command", choices=["migrate", "compact"])
+    parser.add_argument("--companion-id")
+    parser.add_argument("--bucket-size", type=int, default=BUCKET_SIZE)
+    parser.add_argument("--delete-source", action="store_true",
+                        help="Remove per-message documents once their session is migrated")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main(parser.parse_args()))
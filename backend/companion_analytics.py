@@ -0,0 +1,233 @@
+"""Per-companion usage analytics, maintained incrementally.
+
+Every chat turn adds its messages to one totals document per companion
+(`companion_stats`) and one rollup document per companion and UTC day
+(`companion_daily_stats`) with `$inc` upserts, so reads cost one document
+per day asked for, however many messages there are. A marker per session
+(`companion_sessions`, holding the last day the session was active) tells a
+new session or a session's first message of the day from the rest in a
+single atomic update, which is what keeps session counts exact under
+concurrent turns.
+
+Rebuild everything from the stored chat history (on whichever STORAGE_BACKEND
+is configured) with:
+
+    python companion_analytics.py [--companion-id ID]
+
+Turns recorded while a rebuild runs may be lost from the rebuilt counts, so
+run it while chat traffic is paused.
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+from itertools import groupby
+from pathlib import Path
+from typing import Dict, List, Optional
+
+TOTALS_FIELDS = {
+    "_id": 0,
+    "companion_id": 1,
+    "message_count": 1,
+    "user_message_count": 1,
+    "companion_message_count": 1,
+    "session_count": 1,
+    "first_message_at": 1,
+    "last_message_at": 1,
+}
+DAILY_FIELDS = {
+    "_id": 0,
+    "day": 1,
+    "message_count": 1,
+    "user_message_count": 1,
+    "companion_message_count": 1,
+    "active_sessions": 1,
+}
+
+
+def day_of(timestamp: datetime) -> datetime:
+    """Midnight (UTC) starting the day of `timestamp`"""
+    return datetime(timestamp.year, timestamp.month, timestamp.day)
+
+
+def message_counts(messages: List[dict]) -> Dict[str, int]:
+    user_count = sum(1 for m in messages if m["is_user"])
+    return {
+        "message_count": len(messages),
+        "user_message_count": user_count,
+        "companion_message_count": len(messages) - user_count,
+    }
+
+
+def by_day(messages: List[dict]):
+    """(day, messages) for each UTC day a batch of one session's messages falls on, oldest first"""
+    return groupby(sorted(messages, key=lambda m: m["timestamp"]), key=lambda m: day_of(m["timestamp"]))
+
+
+async def record_messages(db, messages: List[dict]):
+    """Fold new messages of one session into its companion's totals and daily rollups"""
+    from pymongo import ReturnDocument
+
+    first = messages[0]
+    companion_id, session_id = first["companion_id"], first["session_id"]
+    for day, day_messages in by_day(messages):
+        day_messages = list(day_messages)
+        previous = await db.companion_sessions.find_one_and_update(
+            {"companion_id": companion_id, "session_id": session_id},
+            {"$max": {"last_day": day}},
+            upsert=True,
+            projection={"_id": 0, "last_day": 1},
+            return_document=ReturnDocument.BEFORE,
+        )
+        counts = message_counts(day_messages)
+        await asyncio.gather(
+            db.companion_stats.update_one(
+                {"companion_id": companion_id},
+                {
+                    "$inc": {**counts, "session_count": int(previous is None)},
+                    "$min": {"first_message_at": day_messages[0]["timestamp"]},
+                    "$max": {"last_message_at": day_messages[-1]["timestamp"]},
+                },
+                upsert=True,
+            ),
+            db.companion_daily_stats.update_one(
+                {"companion_id": companion_id, "day": day},
+                {"$inc": {**counts, "active_sessions": int(previous is None or previous["last_day"] < day)}},
+                upsert=True,
+            ),
+        )
+
+
+async def companion_totals(db, limit: int) -> List[dict]:
+    # Soft-deleted companions are few and short-lived, since their deletion jobs sweep them
+    hidden = await db.companions.distinct("id", {"deleted_at": {"$ne": None}})
+    query = {"companion_id": {"$nin": hidden}} if hidden else {}
+    return await db.companion_stats.find(query, TOTALS_FIELDS).sort(
+        [("message_count", -1), ("companion_id", 1)]
+    ).to_list(limit)
+
+
+async def totals(db, companion_id: str) -> Optional[dict]:
+    return await db.companion_stats.find_one({"companion_id": companion_id}, TOTALS_FIELDS)
+
+
+async def daily(db, companion_id: str, query: dict, limit: int) -> List[dict]:
+    return await db.companion_daily_stats.find(
+        {"companion_id": companion_id, **query}, DAILY_FIELDS
+    ).sort("day", 1).to_list(limit)
+
+
+ANALYTICS_COLLECTIONS = ("companion_stats", "companion_daily_stats", "companion_sessions")
+
+
+async def delete(db, companion_id: Optional[str] = None):
+    """Drop one companion's analytics, or everyone's when no id is given"""
+    query = {"companion_id": companion_id} if companion_id else {}
+    await asyncio.gather(*(db[name].delete_many(query) for name in ANALYTICS_COLLECTIONS))
+
+
+async def insert_batches(collection, documents: List[dict], batch_size: int):
+    for start in range(0, len(documents), batch_size):
+        await collection.insert_many(documents[start:start + batch_size])
+
+
+async def rebuild(db, companion_id: Optional[str] = None, buckets: bool = False, batch_size: int = 1000) -> int:
+    """Recompute analytics from `chat_messages` (or `chat_buckets`), returning how many companions were rebuilt"""
+    from pymongo import UpdateOne
+
+    field = "$messages." if buckets else "$"
+    pipeline = [{"$match": {"companion_id": companion_id} if companion_id else {}}]
+    if buckets:
+        pipeline.append({"$unwind": "$messages"})
+    # One group per session and day, sorted so each session's days arrive together and in order
+    pipeline += [
+        {"$group": {
+            "_id": {
+                "companion_id": "$companion_id",
+                "session_id": "$session_id",
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": f"{field}timestamp"}},
+            },
+            "message_count": {"$sum": 1},
+            "user_message_count": {"$sum": {"$cond": [f"{field}is_user", 1, 0]}},
+            "first_message_at": {"$min": f"{field}timestamp"},
+            "last_message_at": {"$max": f"{field}timestamp"},
+        }},
+        {"$sort": {"_id.companion_id": 1, "_id.session_id": 1, "_id.day": 1}},
+    ]
+    source = db.chat_buckets if buckets else db.chat_messages
+
+    await delete(db, companion_id)
+    companions: Dict[str, dict] = {}
+    days: Dict[tuple, dict] = {}
+    markers = []
+    session, last_day = None, None
+    async for group in source.aggregate(pipeline, allowDiskUse=True):
+        key = group["_id"]
+        day = datetime.strptime(key["day"], "%Y-%m-%d")
+        counts = {
+            "message_count": group["message_count"],
+            "user_message_count": group["user_message_count"],
+            "companion_message_count": group["message_count"] - group["user_message_count"],
+        }
+        if (key["companion_id"], key["session_id"]) != session:
+            if session is not None:
+                markers.append(UpdateOne(dict(zip(("companion_id", "session_id"), session)),
+                                         {"$set": {"last_day": last_day}}, upsert=True))
+            session = (key["companion_id"], key["session_id"])
+            new_session = 1
+        else:
+            new_session = 0
+        last_day = day
+        if len(markers) >= batch_size:
+            await db.companion_sessions.bulk_write(markers, ordered=False)
+            markers.clear()
+
+        summary = companions.setdefault(key["companion_id"], {
+            "message_count": 0, "user_message_count": 0, "companion_message_count": 0, "session_count": 0,
+            "first_message_at": group["first_message_at"], "last_message_at": group["last_message_at"],
+        })
+        rollup = days.setdefault((key["companion_id"], day), {
+            "message_count": 0, "user_message_count": 0, "companion_message_count": 0, "active_sessions": 0,
+        })
+        for name, value in counts.items():
+            summary[name] += value
+            rollup[name] += value
+        summary["session_count"] += new_session
+        summary["first_message_at"] = min(summary["first_message_at"], group["first_message_at"])
+        summary["last_message_at"] = max(summary["last_message_at"], group["last_message_at"])
+        rollup["active_sessions"] += 1
+
+    if session is not None:
+        markers.append(UpdateOne(dict(zip(("companion_id", "session_id"), session)),
+                                 {"$set": {"last_day": last_day}}, upsert=True))
+    if markers:
+        await db.companion_sessions.bulk_write(markers, ordered=False)
+    await insert_batches(
+        db.companion_stats, [{"companion_id": cid, **values} for cid, values in companions.items()], batch_size
+    )
+    await insert_batches(
+        db.companion_daily_stats,
+        [{"companion_id": cid, "day": day, **values} for (cid, day), values in days.items()],
+        batch_size,
+    )
+    return len(companions)
+
+
+async def _main(args):
+    from dotenv import load_dotenv
+    from storage import create_storage
+
+    load_dotenv(Path(__file__).parent / '.env')
+    storage = create_storage()
+    try:
+        rebuilt = await storage.analytics.rebuild(args.companion_id)
+        logging.info(f"Rebuilt analytics for {rebuilt} companions")
+    finally:
+        await storage.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild per-companion analytics from the stored chat history")
+    parser.add_argument("--companion-id")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main(parser.parse_args()))
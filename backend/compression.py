@@ -0,0 +1,118 @@
+"""Response compression for large JSON bodies.
+
+Unlike Starlette's GZipMiddleware this only compresses complete JSON responses,
+so SSE streams and websocket traffic pass through unbuffered. Brotli is used
+when the client accepts it and the optional `brotli` package is installed,
+otherwise gzip. Bodies carrying a strong ETag are compressed once per
+encoding and reused, since the tag guarantees identical bytes.
+"""
+import gzip
+import re
+from collections import OrderedDict
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+
+ENCODING_SUFFIX = re.compile(r'-(gzip|br)"$')
+
+
+def strip_encoding_suffix(etag: str) -> str:
+    """Map the ETag of a compressed representation back to the one the app issued"""
+    return ENCODING_SUFFIX.sub('"', etag)
+
+
+def _accepted_encodings(header: str):
+    encodings = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5,
+                 cache_size: int = 256):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.cache_size = cache_size
+        self._compressed: "OrderedDict[tuple, bytes]" = OrderedDict()
+
+    def compress(self, body: bytes, encoding: str, etag: str = None) -> bytes:
+        key = (etag, encoding)
+        if etag and not etag.startswith("W/"):
+            cached = self._compressed.get(key)
+            if cached is not None:
+                self._compressed.move_to_end(key)
+                return cached
+        if encoding == "br":
+            compressed = brotli.compress(body, quality=self.brotli_quality)
+        else:
+            compressed = gzip.compress(body, compresslevel=self.gzip_level)
+        if etag and not etag.startswith("W/"):
+            self._compressed[key] = compressed
+            while len(self._compressed) > self.cache_size:
+                self._compressed.popitem(last=False)
+        return compressed
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        accepted = _accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        if brotli is not None and "br" in accepted:
+            encoding = "br"
+        elif "gzip" in accepted:
+            encoding = "gzip"
+        else:
+            return await self.app(scope, receive, send)
+
+        start_message = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                passthrough = (
+                    "content-encoding" in headers
+                    or not headers.get("content-type", "").startswith("application/json")
+                )
+                if passthrough:
+                    await send(message)
+                else:
+                    start_message = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                return await send(message)
+
+            body = message.get("body", b"")
+            if message.get("more_body", False):
+                # Streamed JSON: leave it alone rather than buffering it
+                passthrough = True
+                await send(start_message)
+                return await send(message)
+
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            if len(body) >= self.minimum_size:
+                etag = headers.get("etag")
+                body = self.compress(body, encoding, etag)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                # Each encoding is a different representation, so it needs its own strong ETag
+                if etag and etag.endswith('"'):
+                    headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
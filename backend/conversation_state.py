@@ -0,0 +1,136 @@
+"""Rolling per-session conversation state.
+
+One small document per (companion_id, session_id) holds the last few turns
+and running aggregates, updated incrementally on every chat turn, so reply
+generation never has to scan `chat_messages`.
+
+Rebuild the state from `chat_messages` (on whichever STORAGE_BACKEND is configured) with:
+
+    python conversation_state.py [--companion-id ID] [--session-id ID]
+"""
+import argparse
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import List, Optional
+
+RECENT_TURNS = int(os.environ.get('CONVERSATION_RECENT_TURNS', '20'))
+
+STATE_FIELDS = {
+    "_id": 0,
+    "recent_turns": 1,
+    "message_count": 1,
+    "user_message_count": 1,
+    "companion_message_count": 1,
+    "started_at": 1,
+    "last_activity": 1,
+    "summary": 1,
+}
+
+
+def as_turn(message: dict) -> dict:
+    return {
+        "id": message["id"],
+        "message": message["message"],
+        "is_user": message["is_user"],
+        "timestamp": message["timestamp"],
+    }
+
+
+async def record_turn(collection, messages: List[dict], max_turns: int = RECENT_TURNS):
+    """Fold new messages of one session into its state document"""
+    first, last = messages[0], messages[-1]
+    user_count = sum(1 for m in messages if m["is_user"])
+    await collection.update_one(
+        {"companion_id": first["companion_id"], "session_id": first["session_id"]},
+        {
+            "$push": {"recent_turns": {"$each": [as_turn(m) for m in messages], "$slice": -max_turns}},
+            "$inc": {
+                "message_count": len(messages),
+                "user_message_count": user_count,
+                "companion_message_count": len(messages) - user_count,
+            },
+            "$max": {"last_activity": last["timestamp"]},
+            "$setOnInsert": {"started_at": first["timestamp"], "summary": None},
+        },
+        upsert=True,
+    )
+
+
+async def load_state(collection, companion_id: str, session_id: str) -> Optional[dict]:
+    return await collection.find_one(
+        {"companion_id": companion_id, "session_id": session_id}, STATE_FIELDS
+    )
+
+
+async def rebuild_states(db, companion_id: Optional[str] = None, session_id: Optional[str] = None,
+                         max_turns: int = RECENT_TURNS) -> int:
+    """Reconstruct state documents from `chat_messages`, keeping any existing summary"""
+    match = {}
+    if companion_id:
+        match["companion_id"] = companion_id
+    if session_id:
+        match["session_id"] = session_id
+
+    rebuilt = 0
+    sessions = db.chat_messages.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {"companion_id": "$companion_id", "session_id": "$session_id"},
+            "message_count": {"$sum": 1},
+            "user_message_count": {"$sum": {"$cond": ["$is_user", 1, 0]}},
+            "started_at": {"$min": "$timestamp"},
+            "last_activity": {"$max": "$timestamp"},
+        }},
+    ])
+    async for session in sessions:
+        key = session["_id"]
+        recent = await db.chat_messages.find(key).sort(
+            [("timestamp", -1), ("_id", -1)]
+        ).limit(max_turns).to_list(max_turns)
+        recent.reverse()
+        await save_rebuilt_state(db.conversation_states, session, recent)
+        rebuilt += 1
+    return rebuilt
+
+
+async def save_rebuilt_state(collection, session: dict, recent: List[dict]):
+    """Overwrite a session's state from aggregated counts (`_id` holds the key) and its latest messages"""
+    await collection.update_one(
+        session["_id"],
+        {
+            "$set": {
+                "recent_turns": [as_turn(m) for m in recent],
+                "message_count": session["message_count"],
+                "user_message_count": session["user_message_count"],
+                "companion_message_count": session["message_count"] - session["user_message_count"],
+                "started_at": session["started_at"],
+                "last_activity": session["last_activity"],
+            },
+            "$setOnInsert": {"summary": None},
+        },
+        upsert=True,
+    )
+
+
+async def _main(args):
+    from dotenv import load_dotenv
+    from storage import create_storage
+
+    load_dotenv(Path(__file__).parent / '.env')
+    storage = create_storage()
+    try:
+        rebuilt = await storage.chats.rebuild_states(args.companion_id, args.session_id, args.max_turns)
+        logging.info(f"Rebuilt conversation state for {rebuilt} sessions")
+    finally:
+        await storage.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild conversation state from chat_messages")
+    parser.add_argument("--companion-id")
+    parser.add_argument("--session-id")
+    parser.add_argument("--max-turns", type=int, default=RECENT_TURNS)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,163 @@
+"""In-process request and MongoDB command metrics, rendered in Prometheus text format.
+
+Recording is a dict lookup, a bisect and a few additions under an uncontended
+lock, so it stays off the hot path's critical cost. Latency labels use the
+route template (`/api/chat/{companion_id}`), not the raw path, to keep
+cardinality bounded.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, Tuple
+
+from pymongo import monitoring
+
+# Seconds; tuned for an API whose calls mostly take single-digit milliseconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{k}="{str(v)}"' for k, v in labels.items())
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.requests: Dict[tuple, int] = {}
+        self.request_latency: Dict[tuple, Histogram] = {}
+        self.mongo_latency: Dict[tuple, Histogram] = {}
+        self.mongo_failures: Dict[tuple, int] = {}
+        self.counters: Dict[str, Dict[tuple, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        with self._lock:
+            key = (method, route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.request_latency.get((method, route))
+            if histogram is None:
+                histogram = self.request_latency[(method, route)] = Histogram()
+            histogram.observe(seconds)
+
+    def observe_command(self, collection: str, command: str, seconds: float, failed: bool = False):
+        with self._lock:
+            histogram = self.mongo_latency.get((collection, command))
+            if histogram is None:
+                histogram = self.mongo_latency[(collection, command)] = Histogram()
+            histogram.observe(seconds)
+            if failed:
+                key = (collection, command)
+                self.mongo_failures[key] = self.mongo_failures.get(key, 0) + 1
+
+    def increment(self, name: str, **labels):
+        """Bump a free-form counter, exported as `throne_<name>_total`"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + 1
+
+    def render(self, gauges: Dict[str, Dict[str, float]] = None) -> str:
+        """Prometheus text exposition; `gauges` adds component stats such as cache counters"""
+        lines = []
+        with self._lock:
+            lines.append("# TYPE throne_http_requests_total counter")
+            for (method, route, status), value in sorted(self.requests.items()):
+                lines.append(f"throne_http_requests_total{{{_labels(method=method, route=route, status=status)}}} {value}")
+            lines.extend(self._render_histograms(
+                "throne_http_request_duration_seconds",
+                ((_labels(method=m, route=r), h) for (m, r), h in sorted(self.request_latency.items())),
+            ))
+            lines.extend(self._render_histograms(
+                "throne_mongo_command_duration_seconds",
+                ((_labels(collection=c, command=cmd), h) for (c, cmd), h in sorted(self.mongo_latency.items())),
+            ))
+            lines.append("# TYPE throne_mongo_command_failures_total counter")
+            for (collection, command), value in sorted(self.mongo_failures.items()):
+                lines.append(f"throne_mongo_command_failures_total{{{_labels(collection=collection, command=command)}}} {value}")
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# TYPE throne_{name}_total counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"throne_{name}_total{{{_labels(**dict(key))}}} {value}")
+        for component, stats in (gauges or {}).items():
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                lines.append(f"# TYPE throne_{component}_{key} gauge")
+                lines.append(f"throne_{component}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histograms(name: str, series: Iterable[Tuple[str, Histogram]]):
+        yield f"# TYPE {name} histogram"
+        for labels, histogram in series:
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+            yield f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}'
+            yield f"{name}_sum{{{labels}}} {histogram.total}"
+            yield f"{name}_count{{{labels}}} {histogram.count}"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording count, status and latency per route template"""
+
+    def __init__(self, app, registry: MetricsRegistry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope on the way in
+            route = scope.get("route")
+            self.registry.observe_request(
+                scope["method"], getattr(route, "path", "unmatched"), status, time.perf_counter() - started
+            )
+
+
+class CommandTimer(monitoring.CommandListener):
+    """pymongo listener recording per-collection, per-command durations"""
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self._collections: Dict[tuple, str] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self._collections[(event.connection_id, event.request_id)] = (
+            collection if isinstance(collection, str) else "-"
+        )
+
+    def succeeded(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "-")
+        self.registry.observe_command(collection, event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "-")
+        self.registry.observe_command(collection, event.command_name, event.duration_micros / 1e6, failed=True)
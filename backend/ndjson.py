@@ -0,0 +1,138 @@
+"""Streaming NDJSON import and export.
+
+Request bodies are split into lines as chunks arrive and written in batches,
+so an import holds one batch and one line at a time however long the body
+is. Exports encode documents as a storage cursor yields them and send them
+out a batch at a time.
+"""
+import json
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+
+async def read_lines(chunks: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """(line number, line) for each non-blank line; the line is None when it is over `max_line_bytes`"""
+    buffer = bytearray()
+    line_number = 0
+    oversized = False
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end == -1:
+                if not oversized:
+                    buffer += chunk[start:]
+                    if len(buffer) > max_line_bytes:
+                        # Drop the rest of this line rather than buffering it
+                        oversized = True
+                        buffer.clear()
+                break
+            line_number += 1
+            if not oversized:
+                buffer += chunk[start:end]
+                oversized = len(buffer) > max_line_bytes
+            if oversized:
+                yield line_number, None
+            elif buffer.strip():
+                yield line_number, bytes(buffer)
+            buffer.clear()
+            oversized = False
+            start = end + 1
+    if oversized or buffer.strip():
+        yield line_number + 1, None if oversized else bytes(buffer)
+
+
+def describe_error(error: Exception) -> str:
+    """One line per problem, without pydantic's multi-line layout"""
+    if hasattr(error, "errors"):
+        return "; ".join(
+            f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" if e["loc"] else e["msg"]
+            for e in error.errors()
+        )
+    return str(error)
+
+
+class ImportReport:
+    def __init__(self, max_errors: int = 100):
+        self.max_errors = max_errors
+        self.received = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+
+    def error(self, line: int, message: str):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "error": message})
+
+    def summary(self) -> dict:
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+async def import_lines(
+    chunks: AsyncIterator[bytes],
+    parse: Callable[[object], Awaitable[dict]],
+    insert_many: Callable[[List[dict]], Awaitable[None]],
+    batch_size: int = 1000,
+    max_line_bytes: int = 1 << 20,
+    max_errors: int = 100,
+) -> ImportReport:
+    """Parse each line with `parse` and write the documents it accepts with `insert_many`, batch by batch.
+
+    `parse` raises ValueError or TypeError to reject a line. Documents an
+    unordered insert_many leaves out (duplicate ids) are reported against
+    their line through the `writeErrors` of the bulk error it raises.
+    """
+    report = ImportReport(max_errors)
+    batch: List[dict] = []
+    batch_lines: List[int] = []
+
+    async def flush():
+        try:
+            await insert_many(batch)
+            report.inserted += len(batch)
+        except Exception as e:
+            details = getattr(e, "details", None)
+            if not isinstance(details, dict) or "writeErrors" not in details:
+                raise
+            report.inserted += details.get("nInserted", 0)
+            for write_error in details["writeErrors"]:
+                report.error(batch_lines[write_error["index"]], write_error.get("errmsg", "not inserted"))
+        batch.clear()
+        batch_lines.clear()
+
+    async for line_number, line in read_lines(chunks, max_line_bytes):
+        report.received += 1
+        if line is None:
+            report.error(line_number, f"line is longer than {max_line_bytes} bytes")
+            continue
+        try:
+            document = await parse(json.loads(line))
+        except (ValueError, TypeError) as e:
+            report.error(line_number, describe_error(e))
+            continue
+        batch.append(document)
+        batch_lines.append(line_number)
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+    return report
+
+
+async def encode_lines(documents: AsyncIterator[dict], encode: Callable[[dict], str],
+                       batch_size: int = 1000) -> AsyncIterator[bytes]:
+    """NDJSON body chunks of up to `batch_size` documents each"""
+    lines = []
+    async for document in documents:
+        lines.append(encode(document))
+        if len(lines) >= batch_size:
+            yield ("\n".join(lines) + "\n").encode()
+            lines.clear()
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
@@ -0,0 +1,298 @@
+import asyncio
+import hashlib
+import importlib
+import inspect
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterator, Optional, Tuple
+
+
+class ResponseEngineBusy(Exception):
+    """Raised when the worker pool and its queue are full"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Response engine is at capacity")
+        self.retry_after = retry_after
+
+
+class ResponseEngine:
+    """Generates companion replies.
+
+    Engines run on worker threads or processes, so `generate` may block. The
+    companion and the session's conversation state (recent turns and running
+    aggregates, or None for a new session) are passed as plain dicts so
+    engines can be pickled into a process pool.
+
+    Engines whose replies ignore the conversation state should set
+    `uses_conversation` to False, so their replies can be shared between
+    sessions by the reply cache. Engines whose replies are the same for
+    messages differing only in case and whitespace can also set
+    `normalises_message`, so those messages share a cached reply. Engines
+    written before conversation state existed, whose methods take only
+    (companion, message), still work and are treated as not using it.
+    """
+
+    uses_conversation = True
+    normalises_message = False
+
+    def generate(self, companion: dict, message: str, conversation: Optional[dict] = None) -> str:
+        raise NotImplementedError
+
+    def stream(self, companion: dict, message: str, conversation: Optional[dict] = None) -> Iterator[str]:
+        """Yield the reply in chunks; engines that produce text incrementally should override this"""
+        reply = self.generate(companion, message, *conversation_args(self.generate, conversation))
+        yield from re.findall(r"\S+\s*", reply)
+
+
+class EchoResponseEngine(ResponseEngine):
+    """Simple echo for now - can be enhanced with AI"""
+
+    uses_conversation = False
+    # The reply quotes the message as typed, so it must not be shared with differently typed ones
+    normalises_message = False
+
+    def generate(self, companion: dict, message: str, conversation: Optional[dict] = None) -> str:
+        return f"Hello! I'm {companion['name']}. {companion['short_bio']} You said: '{message}'. How can I help you today?"
+
+
+def takes_conversation(method) -> bool:
+    """Whether an engine method accepts the conversation argument after (companion, message)"""
+    try:
+        parameters = inspect.signature(method).parameters.values()
+    except (TypeError, ValueError):
+        return True
+    positional = [p for p in parameters if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)]
+    return len(positional) >= 3 or any(p.kind == p.VAR_POSITIONAL for p in parameters)
+
+
+def conversation_args(method, conversation: Optional[dict]) -> tuple:
+    return (conversation,) if takes_conversation(method) else ()
+
+
+def load_engine(path: Optional[str]) -> ResponseEngine:
+    """Instantiate an engine from a `module:ClassName` path, defaulting to the echo engine"""
+    if not path:
+        return EchoResponseEngine()
+    module_name, class_name = path.split(":", 1)
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def normalise_message(message: str) -> str:
+    """Fold case and collapse whitespace, so trivially different prompts share a cache entry"""
+    return " ".join(message.casefold().split())
+
+
+def companion_version(companion: dict) -> str:
+    """Digest of the companion as the engine sees it; any persona change gives a new version"""
+    encoded = json.dumps(companion, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+class ReplyCache:
+    """Bounded LRU cache of generated replies, each kept for at most `ttl` seconds.
+
+    Keys are (companion id, companion version, message), the message
+    normalised only when asked to. Callers must only cache replies that no
+    session state went into; see `ResponseEngine.uses_conversation` and
+    `ResponseEngine.normalises_message`. A `max_size` of 0 turns the cache off.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[float, str]]" = OrderedDict()
+
+    def key(self, companion: dict, message: str, normalise: bool = False) -> Tuple[str, str, str]:
+        return companion["id"], companion_version(companion), normalise_message(message) if normalise else message
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Tuple[str, str, str], reply: str):
+        if not self.max_size:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, reply)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, companion_id: Optional[str] = None):
+        """Drop one companion's replies, or everything when no id is given"""
+        if companion_id is None:
+            self._entries.clear()
+            return
+        for key in [key for key in self._entries if key[0] == companion_id]:
+            del self._entries[key]
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def _generate(engine: ResponseEngine, companion: dict, message: str, *conversation: Optional[dict]) -> str:
+    return engine.generate(companion, message, *conversation)
+
+
+_END = object()
+
+
+class Admission:
+    """A reserved slot in the worker pool; releasing it more than once is a no-op.
+
+    `claimed` turns true once `generate` or `stream` starts with the slot; from
+    then on they release it. Until then, whoever admitted it must.
+    """
+
+    def __init__(self, pool: "ResponseWorkerPool"):
+        self._pool = pool
+        self._released = False
+        self.claimed = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._pool._release()
+
+
+class ResponseWorkerPool:
+    """Runs a ResponseEngine on a bounded thread or process pool.
+
+    At most `max_workers` generations run at once and at most `max_queue` wait
+    behind them. `admit` fails fast with ResponseEngineBusy beyond that, so
+    callers can shed load instead of queueing without bound.
+    """
+
+    def __init__(self, engine: ResponseEngine, max_workers: int = 4, max_queue: int = 64,
+                 use_processes: bool = False, retry_after: int = 1):
+        self.engine = engine
+        # Checked once here rather than on every call
+        self._generate_takes_conversation = takes_conversation(engine.generate)
+        self._stream_takes_conversation = takes_conversation(engine.stream)
+        self.uses_conversation = engine.uses_conversation and self._generate_takes_conversation
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.use_processes = use_processes
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="response-engine")
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def admit(self) -> Admission:
+        with self._lock:
+            if self.in_flight >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise ResponseEngineBusy(self.retry_after)
+            self.in_flight += 1
+        return Admission(self)
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+
+    async def generate(self, admission: Admission, companion: dict, message: str,
+                       conversation: Optional[dict] = None) -> str:
+        admission.claimed = True
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._get_executor(), _generate, self.engine, companion, message,
+                *((conversation,) if self._generate_takes_conversation else ())
+            )
+        finally:
+            admission.release()
+
+    async def stream(self, admission: Admission, companion: dict, message: str,
+                     conversation: Optional[dict] = None) -> AsyncIterator[str]:
+        """Yield reply chunks as the engine produces them.
+
+        Process pools cannot hand back a generator, so there the reply is
+        generated whole and then chunked.
+        """
+        admission.claimed = True
+        if self.use_processes:
+            text = await self.generate(admission, companion, message, conversation)
+            for chunk in re.findall(r"\S+\s*", text):
+                yield chunk
+            return
+
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+
+        args = (companion, message, conversation) if self._stream_takes_conversation else (companion, message)
+
+        def produce():
+            try:
+                for chunk in self.engine.stream(*args):
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+                loop.call_soon_threadsafe(chunks.put_nowait, _END)
+            except Exception as e:
+                loop.call_soon_threadsafe(chunks.put_nowait, e)
+
+        try:
+            future = loop.run_in_executor(self._get_executor(), produce)
+        except BaseException:
+            admission.release()
+            raise
+        # The slot stays taken until the worker finishes, even if the reader goes away
+        future.add_done_callback(lambda _: admission.release())
+
+        while True:
+            item = await chunks.get()
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def stats(self) -> Dict[str, float]:
+        in_flight = self.in_flight
+        busy = min(in_flight, self.max_workers)
+        return {
+            "pool": "process" if self.use_processes else "thread",
+            "workers": self.max_workers,
+            "busy": busy,
+            "utilisation": busy / self.max_workers if self.max_workers else 0.0,
+            "queue_depth": max(0, in_flight - self.max_workers),
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
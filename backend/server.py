@@ -1,22 +1,82 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.requests import HTTPConnection
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from dotenv import load_dotenv
+from starlette.background import BackgroundTask
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from response_engine import Admission, ReplyCache, ResponseEngineBusy, ResponseWorkerPool, load_engine
+from storage import create_storage, search_terms
+from metrics import CommandTimer, MetricsMiddleware, MetricsRegistry
+from compression import CompressionMiddleware, strip_encoding_suffix
+from admission import LoadShedder, LoadSheddingMiddleware, RateLimiter, retry_after_header
+from ndjson import encode_lines, import_lines
+from companion_analytics import day_of
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from collections import OrderedDict, deque
 import uuid
-from datetime import datetime
+import time
+import base64
+import re
+import json
+from datetime import datetime, timedelta
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Request and database command metrics, served at /api/metrics
+metrics = MetricsRegistry()
+
+# Raw status checks expire after this long; per-minute and per-hour rollups are kept separately
+STATUS_CHECK_RETENTION = int(os.environ.get('STATUS_CHECK_RETENTION_DAYS', '7')) * 86400
+STATUS_ROLLUP_RETENTION = {
+    "minute": int(os.environ.get('STATUS_MINUTE_ROLLUP_RETENTION_DAYS', '30')) * 86400,
+    "hour": int(os.environ.get('STATUS_HOUR_ROLLUP_RETENTION_DAYS', '365')) * 86400,
+}
+# Without `since`, rollup queries cover this many seconds up to `until` (or now)
+STATUS_ROLLUP_DEFAULT_WINDOW = {
+    "minute": int(os.environ.get('STATUS_MINUTE_ROLLUP_DEFAULT_MINUTES', '60')) * 60,
+    "hour": int(os.environ.get('STATUS_HOUR_ROLLUP_DEFAULT_HOURS', '168')) * 3600,
+}
+
+# Database: MongoDB by default, or embedded SQLite with STORAGE_BACKEND=sqlite
+storage = create_storage(STATUS_CHECK_RETENTION, event_listeners=[CommandTimer(metrics)])
+
+# Browsers must revalidate the catalogue, which costs a 304 when nothing changed
+COMPANION_CACHE_CONTROL = os.environ.get('COMPANION_CACHE_CONTROL', 'no-cache')
+
+# Replies buffered per websocket connection before the reader stops accepting messages
+WS_SEND_QUEUE_SIZE = int(os.environ.get('WS_SEND_QUEUE_SIZE', '32'))
+
+# Per-route limits as "requests per second,burst", one bucket per session and one per client IP.
+# A rate of 0 turns that limit off.
+def rate_limiter(route: str, session_default: str, ip_default: str) -> RateLimiter:
+    session_rate, session_burst = os.environ.get(f'RATE_LIMIT_{route.upper()}', session_default).split(',')
+    ip_rate, ip_burst = os.environ.get(f'IP_RATE_LIMIT_{route.upper()}', ip_default).split(',')
+    return RateLimiter(float(session_rate), float(session_burst), float(ip_rate), float(ip_burst))
+
+rate_limiters = {
+    "chat": rate_limiter("chat", "1,10", "20,200"),
+    "chat_stream": rate_limiter("chat_stream", "1,10", "20,200"),
+    "chat_ws": rate_limiter("chat_ws", "1,10", "20,200"),
+    "chat_search": rate_limiter("chat_search", "5,20", "50,200"),
+}
+
+# Behind a reverse proxy every request comes from the proxy; trust its X-Forwarded-For instead
+TRUST_PROXY_HEADERS = os.environ.get('TRUST_PROXY_HEADERS', 'false').lower() == 'true'
+
+# Refuse new requests with 503 past this many in flight, or while average latency is over target
+load_shedder = LoadShedder(
+    max_in_flight=int(os.environ.get('SHED_MAX_IN_FLIGHT', '256')),
+    latency_target=float(os.environ.get('SHED_LATENCY_TARGET_MS', '1000')) / 1000,
+    window=float(os.environ.get('SHED_LATENCY_WINDOW_SECONDS', '10')),
+    retry_after=int(os.environ.get('SHED_RETRY_AFTER', '1')),
+)
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -33,6 +93,11 @@ class StatusCheck(BaseModel):
 class StatusCheckCreate(BaseModel):
     client_name: str
 
+class StatusRollup(BaseModel):
+    client_name: str
+    bucket: datetime  # start of the minute or hour
+    count: int
+
 class Companion(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
@@ -68,6 +133,7 @@ class ChatRequest(BaseModel):
     companion_id: str
     message: str
     session_id: str
+    use_cache: bool = True  # False always generates a fresh reply
 
 class ChatResponse(BaseModel):
     id: str
@@ -77,34 +143,558 @@ class ChatResponse(BaseModel):
     is_user: bool
     timestamp: datetime
 
+class ChatHistoryPage(BaseModel):
+    messages: List[ChatResponse]  # newest first
+    has_more: bool
+    before_cursor: Optional[str] = None  # pass as `before` to page towards older messages
+    after_cursor: Optional[str] = None  # pass as `after` to page towards newer messages
+
+class ChatBootstrap(BaseModel):
+    companion: Companion
+    history: ChatHistoryPage
+
+class ChatSearchHit(ChatResponse):
+    score: float  # relative within one result list; higher is better
+
+class ChatSearchPage(BaseModel):
+    hits: List[ChatSearchHit]  # best match first
+    has_more: bool
+    next_offset: Optional[int] = None  # pass as `offset` for the next page
+
+class BulkImportError(BaseModel):
+    line: int
+    error: str
+
+class BulkImportResult(BaseModel):
+    received: int
+    inserted: int
+    failed: int
+    errors: List[BulkImportError]
+    errors_truncated: bool
+
+class CompanionAnalytics(BaseModel):
+    companion_id: str
+    message_count: int = 0
+    user_message_count: int = 0
+    companion_message_count: int = 0
+    session_count: int = 0
+    first_message_at: Optional[datetime] = None
+    last_message_at: Optional[datetime] = None
+
+class DailyCompanionAnalytics(BaseModel):
+    day: datetime  # midnight UTC starting the day
+    message_count: int
+    user_message_count: int
+    companion_message_count: int
+    active_sessions: int
+
+class CompanionAnalyticsDetail(CompanionAnalytics):
+    daily: List[DailyCompanionAnalytics]
+
+class DeletionJob(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    companion_id: str
+    status: str = "pending"  # pending, running, swept (awaiting the grace period), failed or completed
+    deleted_messages: int = 0
+    resweep_at: Optional[datetime] = None
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    completed_at: Optional[datetime] = None
+
+# Fast response mode
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+# Opt-in: skip re-validating documents the database already returns in response shape
+FAST_RESPONSES = os.environ.get('FAST_RESPONSES', 'false').lower() == 'true'
+
+def shape_documents(documents: List[dict], model) -> List[dict]:
+    """Trim stored documents to the response model's fields, in its field order, without validation"""
+    fields = list(model.model_fields)
+    return [{field: document[field] for field in fields} for document in documents]
+
+def fast_response(content) -> Response:
+    if orjson is not None:
+        return ORJSONResponse(content)
+    return JSONResponse(jsonable_encoder(content))
+
+# Companion cache
+class CompanionCache:
+    """Bounded, TTL-backed in-process cache of companions.
+
+    Entries are written through by the companion CRUD endpoints. The TTL bounds
+    how stale a worker can get when another worker changes a companion.
+
+    The cache also remembers the catalogue version (bumped on every companion
+    write) and the serialised response bodies built for that version. Seeing
+    a new version drops everything, so a body is never served under an ETag
+    for data it does not reflect. Entries and the version expire separately,
+    so reloading an entry from the database re-reads the version too; content
+    newer than the cached version can then never go out under the old ETag.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._listing: Optional[tuple] = None
+        self._version: Optional[tuple] = None
+        self._bodies: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, companion_id: str) -> Optional[Companion]:
+        entry = self._entries.get(companion_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[companion_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(companion_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, companion: Companion):
+        self._entries[companion.id] = (time.monotonic() + self.ttl, companion)
+        self._entries.move_to_end(companion.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get_all(self) -> Optional[List[Companion]]:
+        if self._listing is None or self._listing[0] < time.monotonic():
+            self._listing = None
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._listing[1]
+
+    def put_all(self, companions: List[Companion]):
+        # A listing larger than the cache could not be kept consistent with it
+        if len(companions) > self.max_size:
+            return
+        self._listing = (time.monotonic() + self.ttl, companions)
+        for companion in companions:
+            self.put(companion)
+
+    def invalidate(self, companion_id: Optional[str] = None):
+        """Drop one companion (and the listing), or everything when no id is given"""
+        if companion_id is None:
+            self._entries.clear()
+            self._bodies.clear()
+        else:
+            self._entries.pop(companion_id, None)
+            self._bodies.pop(companion_id, None)
+        self._listing = None
+        self._bodies.pop("*", None)
+
+    def get_version(self) -> Optional[int]:
+        if self._version is None or self._version[0] < time.monotonic():
+            return None
+        return self._version[1]
+
+    def set_version(self, version: int):
+        if self._version is not None and self._version[1] != version:
+            self.invalidate()
+        self._version = (time.monotonic() + self.ttl, version)
+
+    def get_body(self, key: str, version: int) -> Optional[bytes]:
+        entry = self._bodies.get(key)
+        if entry is None or entry[0] != version:
+            return None
+        self._bodies.move_to_end(key)
+        return entry[1]
+
+    def put_body(self, key: str, version: int, body: bytes):
+        self._bodies[key] = (version, body)
+        self._bodies.move_to_end(key)
+        while len(self._bodies) > self.max_size + 1:
+            self._bodies.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+companion_cache = CompanionCache(
+    max_size=int(os.environ.get('COMPANION_CACHE_SIZE', '1000')),
+    ttl=float(os.environ.get('COMPANION_CACHE_TTL', '60')),
+)
+
+async def load_companion(companion_id: str) -> Optional[Companion]:
+    """Look up a companion through the cache, falling back to the database"""
+    companion = companion_cache.get(companion_id)
+    if companion is None:
+        doc = await storage.companions.get(companion_id)
+        if not doc:
+            return None
+        companion = Companion(**doc)
+        # Read after the companion, so the version is at least as new as what was loaded
+        companion_cache.set_version(await storage.companions.get_version())
+        companion_cache.put(companion)
+    return companion
+
+async def catalogue_version() -> int:
+    """Current companion catalogue version, re-read from the database once per cache TTL"""
+    version = companion_cache.get_version()
+    if version is None:
+        version = await storage.companions.get_version()
+        companion_cache.set_version(version)
+    return version
+
+async def bump_catalogue_version():
+    companion_cache.set_version(await storage.companions.bump_version())
+
+def matching_etag(request: Request, etag: str) -> Optional[str]:
+    """Weak If-None-Match comparison, ignoring the suffix the compression middleware adds.
+
+    Returns the client's matching tag so a 304 echoes the representation it holds.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    if header.strip() == "*":
+        return etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if strip_encoding_suffix(candidate.removeprefix("W/")) == etag:
+            return candidate
+    return None
+
+async def conditional_companion_response(request: Request, key: str, etag_for: Callable[[int], str],
+                                         load) -> Response:
+    """Answer a companion read with 304, a cached body, or a freshly serialised one"""
+    version = await catalogue_version()
+    etag = etag_for(version)
+    matched = matching_etag(request, etag)
+    if matched:
+        return Response(status_code=304, headers={"ETag": matched, "Cache-Control": COMPANION_CACHE_CONTROL})
+    body = companion_cache.get_body(key, version)
+    if body is None:
+        content = await load()
+        # Loading from the database refreshes the version; tag the body with the one it was read under
+        version = companion_cache.get_version() or version
+        etag = etag_for(version)
+        body = JSONResponse(jsonable_encoder(content)).body
+        companion_cache.put_body(key, version, body)
+    return Response(
+        content=body, media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": COMPANION_CACHE_CONTROL},
+    )
+
+# Chat message write-behind buffer
+class ChatMessageWriter:
+    """Collects chat messages from concurrent requests and writes them in batches.
+
+    Messages are flushed with one unordered `insert_many` once `batch_size`
+    messages are pending or `flush_interval` seconds have passed. In durable
+    mode `write` waits until its batch has been flushed; otherwise it returns
+    as soon as the messages are buffered, unless the buffer is over
+    `max_pending`.
+    """
+
+    def __init__(self, store, batch_size: int = 500, flush_interval: float = 0.05,
+                 durable: bool = False, max_pending: int = 10000):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durable = durable
+        self.max_pending = max_pending
+        self.inserted = 0
+        self.failed = 0
+        self.flushes = 0
+        self.flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self._pending: deque = deque()  # (documents, waiter or None) per write
+        self._pending_count = 0
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._started_at = time.monotonic()
+
+    def start(self):
+        if self._task is None:
+            # Bind the loop primitives to the loop the app is actually running on
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._started_at = time.monotonic()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the background flusher and write out everything still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def write(self, documents: List[dict]):
+        waiter = None
+        if self.durable or self._task is None or self._pending_count >= self.max_pending:
+            waiter = asyncio.get_running_loop().create_future()
+        self._pending.append((documents, waiter))
+        self._pending_count += len(documents)
+        if self._task is None:
+            await self.flush()
+        elif self._pending_count >= self.batch_size:
+            self._wakeup.set()
+        if waiter is not None:
+            await waiter
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._pending:
+                # Whole writes stay in one batch so a user message and its reply land together
+                batch, waiters = [], []
+                while self._pending and len(batch) < self.batch_size:
+                    documents, waiter = self._pending.popleft()
+                    batch.extend(documents)
+                    if waiter is not None:
+                        waiters.append(waiter)
+                self._pending_count -= len(batch)
+
+                started = time.perf_counter()
+                error = None
+                try:
+                    await self.store.insert_many(batch)
+                    self.inserted += len(batch)
+                except Exception as e:
+                    error = e
+                    inserted = getattr(e, "details", {}).get("nInserted", 0)
+                    self.inserted += inserted
+                    self.failed += len(batch) - inserted
+                    logging.error(f"Error flushing {len(batch)} chat messages: {e}")
+                elapsed = time.perf_counter() - started
+                self.flushes += 1
+                self.flush_seconds += elapsed
+                self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+                for waiter in waiters:
+                    if waiter.done():
+                        continue
+                    if error is None:
+                        waiter.set_result(None)
+                    else:
+                        waiter.set_exception(error)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def stats(self) -> Dict[str, float]:
+        uptime = time.monotonic() - self._started_at
+        return {
+            "durable": self.durable,
+            "pending": self._pending_count,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "inserts_per_second": self.inserted / uptime if uptime else 0.0,
+            "avg_flush_ms": self.flush_seconds / self.flushes * 1000 if self.flushes else 0.0,
+            "max_flush_ms": self.max_flush_seconds * 1000,
+        }
+
+chat_writer = ChatMessageWriter(
+    storage.chats,
+    batch_size=int(os.environ.get('CHAT_WRITE_BATCH_SIZE', '500')),
+    flush_interval=float(os.environ.get('CHAT_WRITE_FLUSH_INTERVAL', '0.05')),
+    durable=os.environ.get('CHAT_WRITE_DURABLE', 'false').lower() == 'true',
+    max_pending=int(os.environ.get('CHAT_WRITE_MAX_PENDING', '10000')),
+)
+
+# Background companion deletion
+class CompanionDeleter:
+    """Removes soft-deleted companions' chat history in the background.
+
+    Each job deletes `batch_size` messages at a time, pausing `pause` seconds
+    between batches so the deletion never starves live traffic, and records
+    its progress after every batch. Jobs are persisted, so any left unfinished
+    by a restart are picked up again on startup; batches are idempotent, so a
+    job that runs twice does no harm.
+
+    Chat turns that loaded the companion before it was hidden (or that other
+    workers still serve from their companion caches) may write after the
+    first sweep, so a job sweeps again once `grace` seconds have passed since
+    it was created, and only then drops conversation state and analytics.
+    Meanwhile the job is marked swept, with its `resweep_at` persisted, and
+    the worker moves on to other jobs.
+    """
+
+    def __init__(self, batch_size: int = 1000, pause: float = 0.1, retry_delay: float = 30.0,
+                 grace: float = 0.0):
+        self.batch_size = batch_size
+        self.pause = pause
+        self.retry_delay = retry_delay
+        self.grace = grace
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            for job in await storage.deletion_jobs.unfinished():
+                self._queue.put_nowait(job["id"])
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def enqueue(self, job: DeletionJob):
+        if self._queue is not None:
+            self._queue.put_nowait(job.id)
+
+    def enqueue_later(self, job_id: str, delay: float):
+        if self._queue is not None:
+            asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, job_id)
+
+    async def _run(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self.run_job(job_id)
+            except Exception as e:
+                logging.error(f"Error deleting companion data for job {job_id}: {e}")
+                await storage.deletion_jobs.update(
+                    job_id, {"status": "failed", "error": str(e), "updated_at": datetime.utcnow()}
+                )
+                # Retry later rather than hammering a struggling database
+                self.enqueue_later(job_id, self.retry_delay)
+
+    async def run_job(self, job_id: str):
+        job = await storage.deletion_jobs.get(job_id)
+        if not job or job["status"] == "completed":
+            return
+        companion_id = job["companion_id"]
+        deleted = job["deleted_messages"]
+        resweep_at = job.get("resweep_at")
+        if resweep_at is None:
+            await storage.deletion_jobs.update(
+                job_id, {"status": "running", "error": None, "updated_at": datetime.utcnow()}
+            )
+            deleted = await self.sweep(job_id, companion_id, deleted)
+            resweep_at = job["created_at"] + timedelta(seconds=self.grace)
+            remaining = (resweep_at - datetime.utcnow()).total_seconds()
+            if remaining > 0:
+                await storage.deletion_jobs.update(
+                    job_id, {"status": "swept", "resweep_at": resweep_at, "updated_at": datetime.utcnow()}
+                )
+                self.enqueue_later(job_id, remaining)
+                return
+        else:
+            remaining = (resweep_at - datetime.utcnow()).total_seconds()
+            if remaining > 0:
+                # Resumed (or requeued early) before its grace period is over
+                self.enqueue_later(job_id, remaining)
+                return
+            await storage.deletion_jobs.update(
+                job_id, {"status": "running", "error": None, "updated_at": datetime.utcnow()}
+            )
+            deleted = await self.sweep(job_id, companion_id, deleted)
+        await storage.chats.delete_states(companion_id)
+        await storage.analytics.delete(companion_id)
+        await storage.companions.delete(companion_id)
+        now = datetime.utcnow()
+        await storage.deletion_jobs.update(
+            job_id, {"status": "completed", "deleted_messages": deleted, "updated_at": now, "completed_at": now}
+        )
+        logging.info(f"Deleted companion {companion_id} and {deleted} chat messages")
+
+    async def sweep(self, job_id: str, companion_id: str, deleted: int) -> int:
+        """Delete the companion's messages batch by batch, returning the job's new running total"""
+        # Buffered writes for the companion must land before the sweep, or they would outlive it
+        await chat_writer.flush()
+        while True:
+            removed = await storage.chats.delete_batch(companion_id, self.batch_size)
+            if not removed:
+                return deleted
+            deleted += removed
+            await storage.deletion_jobs.update(
+                job_id, {"deleted_messages": deleted, "updated_at": datetime.utcnow()}
+            )
+            await asyncio.sleep(self.pause)
+
+companion_deleter = CompanionDeleter(
+    batch_size=int(os.environ.get('COMPANION_DELETE_BATCH_SIZE', '1000')),
+    pause=float(os.environ.get('COMPANION_DELETE_PAUSE', '0.1')),
+    # At least the companion cache TTL plus the longest a reply takes to generate
+    grace=float(os.environ.get('COMPANION_DELETE_GRACE_SECONDS', str(companion_cache.ttl + 60))),
+)
+
 # Initialize database indexes
 async def init_db():
     """Initialize database collections and indexes"""
-    try:
-        # Create indexes for companions
-        await db.companions.create_index("id", unique=True)
-        await db.companions.create_index("name")
-        
-        # Create indexes for chat messages
-        await db.chat_messages.create_index("id", unique=True)
-        await db.chat_messages.create_index([("companion_id", 1), ("session_id", 1)])
-        await db.chat_messages.create_index("timestamp")
-        
-        # Create indexes for status checks
-        await db.status_checks.create_index("id", unique=True)
-        
-        logging.info("Database indexes created successfully")
-    except Exception as e:
-        logging.error(f"Error creating database indexes: {e}")
+    created = await storage.init()
+    if created is None:
+        logging.info("Database schema ready")
+    else:
+        logging.info(f"Database indexes ready, {created} created")
+
+# Startup: the database is prepared in the background, so liveness probes are answered meanwhile
+STARTUP_WAIT = float(os.environ.get('STARTUP_WAIT_SECONDS', '10'))
+STARTUP_RETRY_DELAY = float(os.environ.get('STARTUP_RETRY_DELAY', '2'))
+HEALTH_CHECK_TIMEOUT = float(os.environ.get('HEALTH_CHECK_TIMEOUT', '2'))
+# Long enough to seed; a worker that dies mid-seed only blocks others this long
+SEED_LEASE_SECONDS = float(os.environ.get('SEED_LEASE_SECONDS', '60'))
+
+class StartupState:
+    """Whether storage is prepared, and why not yet"""
+
+    def __init__(self):
+        self.ready = False
+        self.error: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+
+startup_state = StartupState()
+
+async def prepare_storage():
+    """Create indexes, seed and resume deletions, retrying until the database is reachable"""
+    while True:
+        try:
+            await init_db()
+            await asyncio.gather(seed_companions(), companion_deleter.start())
+            break
+        except Exception as e:
+            startup_state.error = str(e) or type(e).__name__
+            logging.error(f"Database not ready, retrying in {STARTUP_RETRY_DELAY}s: {e}")
+            await asyncio.sleep(STARTUP_RETRY_DELAY)
+    startup_state.error = None
+    startup_state.ready = True
 
 # Seed data
 async def seed_companions():
-    """Seed initial companion data"""
+    """Seed initial companion data, in whichever worker takes the seeding lease"""
+    # Check if companions already exist
+    if await storage.companions.count() > 0:
+        logging.info("Companions already seeded")
+        return
+    if not await storage.claim("seed_companions", SEED_LEASE_SECONDS):
+        logging.info("Another worker is seeding companions")
+        return
     try:
-        # Check if companions already exist
-        existing_count = await db.companions.count_documents({})
-        if existing_count > 0:
-            logging.info("Companions already seeded")
+        # Re-checked under the lease: a worker may have finished seeding since the first count
+        if await storage.companions.count() > 0:
             return
         
         companions_data = [
@@ -137,36 +727,287 @@ async def seed_companions():
             }
         ]
         
-        result = await db.companions.insert_many(companions_data)
-        logging.info(f"Seeded {len(result.inserted_ids)} companions successfully")
-        
-    except Exception as e:
-        logging.error(f"Error seeding companions: {e}")
+        await storage.companions.insert_many(companions_data)
+        await bump_catalogue_version()
+        logging.info(f"Seeded {len(companions_data)} companions successfully")
+    finally:
+        await storage.release("seed_companions")
 
 # Basic status endpoints
 @api_router.get("/")
 async def root():
     return {"message": "Hello World"}
 
+def rollup_bucket(granularity: str, timestamp: datetime) -> datetime:
+    if granularity == "minute":
+        return timestamp.replace(second=0, microsecond=0)
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+def status_rollup_update(granularity: str, status_obj: StatusCheck):
+    bucket = rollup_bucket(granularity, status_obj.timestamp)
+    return storage.status.increment_rollup(
+        granularity,
+        status_obj.client_name,
+        bucket,
+        bucket + timedelta(seconds=STATUS_ROLLUP_RETENTION[granularity]),
+    )
+
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
-    _ = await db.status_checks.insert_one(status_obj.dict())
+    # Rollups are maintained on insert so dashboards never scan raw checks
+    await asyncio.gather(
+        storage.status.insert(status_obj.dict()),
+        status_rollup_update("minute", status_obj),
+        status_rollup_update("hour", status_obj),
+    )
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
+async def get_status_checks(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    client_name: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Get status checks in a time range, newest first"""
+    status_checks = await storage.status.find(since, until, client_name, limit)
+    if FAST_RESPONSES:
+        return fast_response(shape_documents(status_checks, StatusCheck))
     return [StatusCheck(**status_check) for status_check in status_checks]
 
+@api_router.get("/status/rollups", response_model=List[StatusRollup])
+async def get_status_rollups(
+    granularity: str = Query("hour", pattern="^(minute|hour)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    client_name: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+):
+    """Get per-minute or per-hour status check counts per client, oldest bucket first.
+
+    Without `since` this covers the last STATUS_ROLLUP_DEFAULT_WINDOW before
+    `until` (or now), so dashboards see recent buckets rather than the oldest.
+    """
+    if since is None:
+        window = timedelta(seconds=STATUS_ROLLUP_DEFAULT_WINDOW[granularity])
+        since = rollup_bucket(granularity, (until or datetime.utcnow()) - window)
+    rollups = await storage.status.rollups(granularity, since, until, client_name, limit)
+    if FAST_RESPONSES:
+        return fast_response(shape_documents(rollups, StatusRollup))
+    return [StatusRollup(**rollup) for rollup in rollups]
+
+# Analytics: daily windows default to the last ANALYTICS_DEFAULT_DAYS days
+ANALYTICS_DEFAULT_DAYS = int(os.environ.get('ANALYTICS_DEFAULT_DAYS', '30'))
+
+@api_router.get("/analytics/companions", response_model=List[CompanionAnalytics])
+async def get_companions_analytics(limit: int = Query(100, ge=1, le=1000)):
+    """Get message and session totals per companion, most messages first"""
+    try:
+        totals = await storage.analytics.companions(limit)
+    except Exception as e:
+        logging.error(f"Error getting companion analytics: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve analytics")
+    if FAST_RESPONSES:
+        return fast_response(shape_documents(totals, CompanionAnalytics))
+    return [CompanionAnalytics(**companion_totals) for companion_totals in totals]
+
+@api_router.get("/analytics/companions/{companion_id}", response_model=CompanionAnalyticsDetail)
+async def get_companion_analytics(
+    companion_id: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(366, ge=1, le=3660),
+):
+    """Get a companion's totals and its daily rollups in [since, until), oldest day first"""
+    try:
+        if not await load_companion(companion_id):
+            raise HTTPException(status_code=404, detail="Companion not found")
+        if since is None:
+            # `until` is exclusive, so the last day in the window is the one just before it
+            last_day = day_of(until - timedelta(microseconds=1) if until else datetime.utcnow())
+            since = last_day - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+        totals, daily = await asyncio.gather(
+            storage.analytics.totals(companion_id),
+            storage.analytics.daily(companion_id, since, until, limit),
+        )
+        return CompanionAnalyticsDetail(**(totals or {"companion_id": companion_id}), daily=daily)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error getting analytics for companion {companion_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve analytics")
+
+@api_router.get("/health/live")
+async def health_live():
+    """Liveness: the process is up and its event loop responds"""
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def health_ready():
+    """Readiness: storage is prepared and answers a ping"""
+    if not startup_state.ready:
+        return JSONResponse({"status": "starting", "detail": startup_state.error}, status_code=503)
+    try:
+        await asyncio.wait_for(storage.ping(), HEALTH_CHECK_TIMEOUT)
+    except Exception as e:
+        return JSONResponse({"status": "unavailable", "detail": str(e) or type(e).__name__}, status_code=503)
+    return {"status": "ready", "storage": storage.name}
+
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    """Get hit/miss counters for the in-process caches"""
+    return {"companions": companion_cache.stats(), "replies": reply_cache.stats()}
+
+@api_router.get("/engine/stats")
+async def get_engine_stats():
+    """Get queue depth and utilisation of the response generation pool"""
+    return response_pool.stats()
+
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics: per-route requests and latency, per-collection Mongo command latency,
+    plus gauges such as cache counters, load shedding and how many keys each rate limiter tracks"""
+    return PlainTextResponse(
+        metrics.render({
+            "companion_cache": companion_cache.stats(),
+            "reply_cache": reply_cache.stats(),
+            "chat_writer": chat_writer.stats(),
+            "response_engine": response_pool.stats(),
+            "load_shedder": load_shedder.stats(),
+            **{f"rate_limiter_{route}": limiter.stats() for route, limiter in rate_limiters.items()},
+        }),
+        media_type="text/plain; version=0.0.4",
+    )
+
+@api_router.get("/writer/stats")
+async def get_writer_stats():
+    """Get throughput and flush latency of the chat message write-behind buffer"""
+    return chat_writer.stats()
+
+# Bulk NDJSON import and export: one JSON document per line, streamed both ways
+BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', '1000'))
+BULK_MAX_LINE_BYTES = int(os.environ.get('BULK_MAX_LINE_BYTES', str(1024 * 1024)))
+BULK_MAX_REPORTED_ERRORS = int(os.environ.get('BULK_MAX_REPORTED_ERRORS', '100'))
+
+def ndjson_response(documents, model) -> StreamingResponse:
+    if FAST_RESPONSES and orjson is not None:
+        def encode(doc):
+            return orjson.dumps(shape_documents([doc], model)[0]).decode()
+    else:
+        def encode(doc):
+            return model(**doc).json()
+    return StreamingResponse(
+        encode_lines(documents, encode, BULK_BATCH_SIZE),
+        media_type="application/x-ndjson",
+    )
+
+async def import_ndjson(request: Request, parse, insert_many) -> BulkImportResult:
+    report = await import_lines(
+        request.stream(), parse, insert_many,
+        batch_size=BULK_BATCH_SIZE, max_line_bytes=BULK_MAX_LINE_BYTES, max_errors=BULK_MAX_REPORTED_ERRORS,
+    )
+    return BulkImportResult(**report.summary())
+
+@api_router.post("/companions/bulk", response_model=BulkImportResult)
+async def import_companions(request: Request):
+    """Create companions from an NDJSON body, reporting rejected lines"""
+    async def parse(line) -> dict:
+        return Companion(**line).dict()
+
+    try:
+        result = await import_ndjson(request, parse, storage.companions.insert_many)
+        if result.inserted:
+            await bump_catalogue_version()
+        return result
+    except Exception as e:
+        logging.error(f"Error importing companions: {e}")
+        raise HTTPException(status_code=500, detail="Failed to import companions")
+
+@api_router.get("/companions/bulk")
+async def export_companions():
+    """Stream every companion as NDJSON"""
+    return ndjson_response(storage.companions.export(BULK_BATCH_SIZE), Companion)
+
+async def record_imported_messages(messages: List[dict]):
+    """Fold a batch of newly stored messages into conversation state and analytics, session by session"""
+    sessions: Dict[tuple, List[dict]] = {}
+    for message in sorted(messages, key=lambda m: m["timestamp"]):
+        sessions.setdefault((message["companion_id"], message["session_id"]), []).append(message)
+    await asyncio.gather(*(
+        update(session)
+        for session in sessions.values()
+        for update in (storage.chats.record_turn, storage.analytics.record)
+    ))
+
+@api_router.post("/chat/bulk", response_model=BulkImportResult)
+async def import_chat_messages(request: Request):
+    """Store chat messages from an NDJSON body, reporting rejected lines.
+
+    Each stored batch is folded into its sessions' conversation state and
+    analytics like live turns are, so a session's lines should come oldest
+    first, as GET /chat/bulk exports them; after importing older history into a
+    session that already has newer messages, rebuild its state with
+    `python conversation_state.py`.
+
+    Duplicate message ids are rejected per line, except with
+    CHAT_STORAGE_MODE=buckets, where message ids are not indexed and
+    re-importing a file stores its messages again.
+    """
+    async def parse(line) -> dict:
+        message = ChatMessage(**line)
+        if not await load_companion(message.companion_id):
+            raise ValueError(f"companion {message.companion_id} not found")
+        return message.dict()
+
+    async def insert_many(messages: List[dict]):
+        try:
+            await storage.chats.insert_many(messages)
+        except Exception as e:
+            details = getattr(e, "details", None)
+            if isinstance(details, dict) and "writeErrors" in details:
+                skipped = {write_error["index"] for write_error in details["writeErrors"]}
+                await record_imported_messages([m for i, m in enumerate(messages) if i not in skipped])
+            raise
+        await record_imported_messages(messages)
+
+    try:
+        return await import_ndjson(request, parse, insert_many)
+    except Exception as e:
+        logging.error(f"Error importing chat messages: {e}")
+        raise HTTPException(status_code=500, detail="Failed to import chat messages")
+
+@api_router.get("/chat/bulk")
+async def export_chat_messages(companion_id: Optional[str] = None, session_id: Optional[str] = None):
+    """Stream chat messages as NDJSON, optionally one companion's or one session's"""
+    try:
+        if companion_id and not await load_companion(companion_id):
+            raise HTTPException(status_code=404, detail="Companion not found")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error exporting chat messages: {e}")
+        raise HTTPException(status_code=500, detail="Failed to export chat messages")
+    return ndjson_response(storage.chats.export(companion_id, session_id, BULK_BATCH_SIZE), ChatResponse)
+
 # Companion endpoints
+async def load_companions() -> List[Companion]:
+    companions = companion_cache.get_all()
+    if companions is None:
+        companions = await storage.companions.list(1000)
+        companions = [Companion(**companion) for companion in companions]
+        companion_cache.set_version(await storage.companions.get_version())
+        companion_cache.put_all(companions)
+    return companions
+
 @api_router.get("/companions", response_model=List[Companion])
-async def get_companions():
+async def get_companions(request: Request):
     """Get all companions"""
     try:
-        companions = await db.companions.find().to_list(1000)
-        return [Companion(**companion) for companion in companions]
+        return await conditional_companion_response(
+            request, "*", lambda version: f'"companions-v{version}"', load_companions
+        )
     except Exception as e:
         logging.error(f"Error getting companions: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve companions")
@@ -176,20 +1017,32 @@ async def create_companion(companion_data: CompanionCreate):
     """Create a new companion"""
     try:
         companion = Companion(**companion_data.dict())
-        await db.companions.insert_one(companion.dict())
+        await storage.companions.insert(companion.dict())
+        await bump_catalogue_version()
+        companion_cache.invalidate(companion.id)
+        companion_cache.put(companion)
         return companion
     except Exception as e:
         logging.error(f"Error creating companion: {e}")
         raise HTTPException(status_code=500, detail="Failed to create companion")
 
 @api_router.get("/companions/{companion_id}", response_model=Companion)
-async def get_companion(companion_id: str):
+async def get_companion(companion_id: str, request: Request):
     """Get a specific companion by ID"""
     try:
-        companion = await db.companions.find_one({"id": companion_id})
-        if not companion:
+        if not await load_companion(companion_id):
             raise HTTPException(status_code=404, detail="Companion not found")
-        return Companion(**companion)
+
+        async def load():
+            # Loaded again after the version check, which drops entries older than the version
+            companion = await load_companion(companion_id)
+            if not companion:
+                raise HTTPException(status_code=404, detail="Companion not found")
+            return companion
+
+        return await conditional_companion_response(
+            request, companion_id, lambda version: f'"companion-{companion_id}-v{version}"', load
+        )
     except HTTPException:
         raise
     except Exception as e:
@@ -200,98 +1053,540 @@ async def get_companion(companion_id: str):
 async def update_companion(companion_id: str, update_data: CompanionUpdate):
     """Update a companion"""
     try:
-        # Check if companion exists
-        existing = await db.companions.find_one({"id": companion_id})
-        if not existing:
-            raise HTTPException(status_code=404, detail="Companion not found")
-        
         # Update with only provided fields
         update_dict = {k: v for k, v in update_data.dict().items() if v is not None}
-        if update_dict:
-            await db.companions.update_one({"id": companion_id}, {"$set": update_dict})
+        updated = await storage.companions.update(companion_id, update_dict)
+        if not updated:
+            raise HTTPException(status_code=404, detail="Companion not found")
         
-        # Return updated companion
-        updated_companion = await db.companions.find_one({"id": companion_id})
-        return Companion(**updated_companion)
+        updated_companion = Companion(**updated)
+        if update_dict:
+            await bump_catalogue_version()
+            reply_cache.invalidate(companion_id)
+        companion_cache.invalidate(companion_id)
+        companion_cache.put(updated_companion)
+        return updated_companion
     except HTTPException:
         raise
     except Exception as e:
         logging.error(f"Error updating companion {companion_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to update companion")
 
-@api_router.delete("/companions/{companion_id}")
+@api_router.delete("/companions/{companion_id}", status_code=202)
 async def delete_companion(companion_id: str):
-    """Delete a companion"""
+    """Delete a companion now; its chat history is removed by a background job"""
     try:
-        result = await db.companions.delete_one({"id": companion_id})
-        if result.deleted_count == 0:
+        deleted = await storage.companions.soft_delete(companion_id)
+        companion_cache.invalidate(companion_id)
+        reply_cache.invalidate(companion_id)
+        if not deleted:
             raise HTTPException(status_code=404, detail="Companion not found")
+        await bump_catalogue_version()
         
-        # Also delete associated chat messages
-        await db.chat_messages.delete_many({"companion_id": companion_id})
+        job = DeletionJob(companion_id=companion_id)
+        await storage.deletion_jobs.insert(job.dict())
+        companion_deleter.enqueue(job)
         
-        return {"message": "Companion deleted successfully"}
+        return {"message": "Companion deleted successfully", "job_id": job.id}
     except HTTPException:
         raise
     except Exception as e:
         logging.error(f"Error deleting companion {companion_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to delete companion")
 
+@api_router.get("/jobs/{job_id}", response_model=DeletionJob)
+async def get_deletion_job(job_id: str):
+    """Get the progress of a companion's background deletion"""
+    try:
+        job = await storage.deletion_jobs.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return DeletionJob(**job)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error getting job {job_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve job")
+
+# Reply generation
+response_pool = ResponseWorkerPool(
+    load_engine(os.environ.get('RESPONSE_ENGINE')),
+    max_workers=int(os.environ.get('RESPONSE_WORKERS', '4')),
+    max_queue=int(os.environ.get('RESPONSE_QUEUE_SIZE', '64')),
+    use_processes=os.environ.get('RESPONSE_POOL', 'thread') == 'process',
+    retry_after=int(os.environ.get('RESPONSE_RETRY_AFTER', '1')),
+)
+
+# Replies to repeated prompts, shared between sessions only when no session state went into them
+reply_cache = ReplyCache(
+    max_size=int(os.environ.get('REPLY_CACHE_SIZE', '10000')),
+    ttl=float(os.environ.get('REPLY_CACHE_TTL', '300')),
+)
+
+def reply_cache_key(companion: dict, message: str, conversation: Optional[dict], use_cache: bool):
+    """Cache key for this reply, or None when it must be generated for this session alone"""
+    if not reply_cache.max_size:
+        return None
+    # With no conversation yet, the reply depends only on the companion and the message
+    if not use_cache or (response_pool.uses_conversation and conversation is not None):
+        reply_cache.bypassed += 1
+        return None
+    return reply_cache.key(companion, message, normalise=response_pool.engine.normalises_message)
+
+async def load_conversation(companion_id: str, session_id: str) -> Optional[dict]:
+    """The session's conversation state, or None without a read when the engine ignores it"""
+    if not response_pool.uses_conversation:
+        return None
+    return await storage.chats.load_state(companion_id, session_id)
+
+async def cached_chunks(text: str) -> AsyncIterator[str]:
+    for chunk in re.findall(r"\S+\s*", text):
+        yield chunk
+
+def client_ip(connection: HTTPConnection) -> Optional[str]:
+    if TRUST_PROXY_HEADERS:
+        forwarded = connection.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return connection.client.host if connection.client else None
+
+def rate_limit_wait(route: str, session_id: str, connection: HTTPConnection) -> float:
+    """Seconds the caller must wait before `route` accepts another request, 0 if it may go ahead"""
+    limit, wait = rate_limiters[route].check(session_id, client_ip(connection))
+    if limit:
+        metrics.increment("rate_limited_requests", route=route, limit=limit)
+    return wait
+
+def check_rate_limit(route: str, session_id: str, request: Request):
+    wait = rate_limit_wait(route, session_id, request)
+    if wait:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests, please slow down",
+            headers={"Retry-After": retry_after_header(wait)},
+        )
+
+def engine_busy_error(e: ResponseEngineBusy) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Companion is busy, please retry shortly",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+class ReplyStreamResponse(StreamingResponse):
+    """Streams a reply generated under `admission`.
+
+    If the client goes away before the body is first read, generation never
+    starts and nothing else would return the pool slot, so it is released when
+    the response ends: by the background task normally, or on the way out if
+    sending failed. Once generation has claimed the slot, the worker releases it.
+    """
+
+    def __init__(self, content, admission: Optional[Admission], **kwargs):
+        super().__init__(content, background=BackgroundTask(self.release_unclaimed), **kwargs)
+        self.admission = admission
+
+    def release_unclaimed(self):
+        if self.admission is not None and not self.admission.claimed:
+            self.admission.release()
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release_unclaimed()
+
+def sse_event(event: str, data: str) -> str:
+    """Format one Server-Sent Event frame around an already-encoded JSON payload"""
+    return f"event: {event}\ndata: {data}\n\n"
+
+async def sse_chat_events(
+    chunks: AsyncIterator[str],
+    on_complete: Callable[[str], Awaitable[ChatMessage]],
+) -> AsyncIterator[str]:
+    """Relay reply chunks as SSE frames as they are produced.
+
+    Once the generator is exhausted the full reply is handed to `on_complete`
+    for persistence, and the stored message is sent as the final `done` event.
+    """
+    parts = []
+    try:
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield sse_event("chunk", json.dumps({"text": chunk}))
+        companion_message = await on_complete("".join(parts))
+        yield sse_event("done", ChatResponse(**companion_message.dict()).json())
+    except Exception as e:
+        logging.error(f"Error streaming chat reply: {e}")
+        yield sse_event("error", json.dumps({"detail": "Failed to process chat message"}))
+
+async def process_chat_message(companion: Companion, session_id: str, message: str,
+                               use_cache: bool = True) -> ChatMessage:
+    """Store a user message, generate the companion's reply (or reuse a cached one) and store that too.
+
+    Raises ResponseEngineBusy before anything is stored if generation is at capacity.
+    """
+    user_message = ChatMessage(
+        companion_id=companion.id,
+        session_id=session_id,
+        message=message,
+        is_user=True
+    )
+    
+    companion_doc = companion.dict()
+    conversation = await load_conversation(companion.id, session_id)
+    cache_key = reply_cache_key(companion_doc, message, conversation, use_cache)
+    companion_response_text = reply_cache.get(cache_key) if cache_key else None
+    if companion_response_text is None:
+        admission = response_pool.admit()
+        companion_response_text = await response_pool.generate(
+            admission, companion_doc, message, conversation
+        )
+        if cache_key:
+            reply_cache.put(cache_key, companion_response_text)
+    
+    companion_message = ChatMessage(
+        companion_id=companion.id,
+        session_id=session_id,
+        message=companion_response_text,
+        is_user=False
+    )
+    messages = [user_message.dict(), companion_message.dict()]
+    await asyncio.gather(
+        chat_writer.write(messages),
+        storage.chats.record_turn(messages),
+        storage.analytics.record(messages),
+    )
+    return companion_message
+
 # Chat endpoints
 @api_router.post("/chat", response_model=ChatResponse)
-async def chat_with_companion(chat_request: ChatRequest):
+async def chat_with_companion(chat_request: ChatRequest, request: Request):
     """Send a message to a companion and get a response"""
+    check_rate_limit("chat", chat_request.session_id, request)
     try:
         # Verify companion exists
-        companion = await db.companions.find_one({"id": chat_request.companion_id})
+        companion = await load_companion(chat_request.companion_id)
+        if not companion:
+            raise HTTPException(status_code=404, detail="Companion not found")
+        
+        companion_message = await process_chat_message(
+            companion, chat_request.session_id, chat_request.message, chat_request.use_cache
+        )
+        return ChatResponse(**companion_message.dict())
+        
+    except HTTPException:
+        raise
+    except ResponseEngineBusy as e:
+        raise engine_busy_error(e)
+    except Exception as e:
+        logging.error(f"Error in chat: {e}")
+        raise HTTPException(status_code=500, detail="Failed to process chat message")
+
+def encode_history_cursor(message: dict) -> str:
+    """Build an opaque cursor from a message's timestamp and storage tie-breaker"""
+    raw = f"{message['timestamp'].isoformat()}|{message['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_history_cursor(cursor: str):
+    try:
+        timestamp, key = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(timestamp), storage.chats.cursor_key(key)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid history cursor")
+
+@api_router.post("/chat/stream")
+async def stream_chat_with_companion(chat_request: ChatRequest, request: Request):
+    """Send a message to a companion and stream the response as Server-Sent Events"""
+    check_rate_limit("chat_stream", chat_request.session_id, request)
+    admission = None
+    try:
+        companion = await load_companion(chat_request.companion_id)
         if not companion:
             raise HTTPException(status_code=404, detail="Companion not found")
         
-        # Store user message
+        companion_doc = companion.dict()
+        conversation = await load_conversation(chat_request.companion_id, chat_request.session_id)
+        cache_key = reply_cache_key(companion_doc, chat_request.message, conversation, chat_request.use_cache)
+        cached_reply = reply_cache.get(cache_key) if cache_key else None
+        if cached_reply is None:
+            admission = response_pool.admit()
         user_message = ChatMessage(
             companion_id=chat_request.companion_id,
             session_id=chat_request.session_id,
             message=chat_request.message,
             is_user=True
         )
-        await db.chat_messages.insert_one(user_message.dict())
-        
-        # Generate companion response (simple echo for now - can be enhanced with AI)
-        companion_response_text = f"Hello! I'm {companion['name']}. {companion['short_bio']} You said: '{chat_request.message}'. How can I help you today?"
-        
+        await asyncio.gather(
+            chat_writer.write([user_message.dict()]),
+            storage.chats.record_turn([user_message.dict()]),
+            storage.analytics.record([user_message.dict()]),
+        )
+    except ResponseEngineBusy as e:
+        raise engine_busy_error(e)
+    except Exception as e:
+        if admission is not None:
+            admission.release()
+        if isinstance(e, HTTPException):
+            raise
+        logging.error(f"Error in chat stream: {e}")
+        raise HTTPException(status_code=500, detail="Failed to process chat message")
+
+    async def store_reply(text: str) -> ChatMessage:
+        if cache_key and cached_reply is None:
+            reply_cache.put(cache_key, text)
         companion_message = ChatMessage(
             companion_id=chat_request.companion_id,
             session_id=chat_request.session_id,
-            message=companion_response_text,
+            message=text,
             is_user=False
         )
-        await db.chat_messages.insert_one(companion_message.dict())
-        
-        return ChatResponse(**companion_message.dict())
-        
-    except HTTPException:
-        raise
+        await asyncio.gather(
+            chat_writer.write([companion_message.dict()]),
+            storage.chats.record_turn([companion_message.dict()]),
+            storage.analytics.record([companion_message.dict()]),
+        )
+        return companion_message
+
+    if cached_reply is None:
+        chunks = response_pool.stream(admission, companion_doc, chat_request.message, conversation)
+    else:
+        chunks = cached_chunks(cached_reply)
+    return ReplyStreamResponse(
+        sse_chat_events(chunks, store_reply),
+        admission,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@api_router.websocket("/ws/chat/{companion_id}")
+async def chat_websocket(websocket: WebSocket, companion_id: str, session_id: str = Query(...)):
+    """Persistent chat channel: many messages per connection.
+
+    Clients send `{"message": "..."}` frames (with `"use_cache": false` to skip the
+    reply cache) and receive `{"type": "reply", "message": ...}` or
+    `{"type": "error", "detail": ...}` frames in order. Replies go through a bounded
+    queue, so a client that stops reading stops having its messages processed, and
+    the connection closes with 1011 if sending to it fails. It closes with 4404
+    once the companion is deleted.
+    """
+    await websocket.accept()
+    try:
+        companion = await load_companion(companion_id)
     except Exception as e:
-        logging.error(f"Error in chat: {e}")
-        raise HTTPException(status_code=500, detail="Failed to process chat message")
+        logging.error(f"Error resolving companion {companion_id} for websocket: {e}")
+        await websocket.close(code=1011)
+        return
+    if not companion:
+        await websocket.close(code=4404, reason="Companion not found")
+        return
+
+    send_queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
 
-@api_router.get("/chat/{companion_id}")
-async def get_chat_history(companion_id: str, session_id: str = Query(...)):
-    """Get chat history for a companion and session"""
+    async def sender():
+        while True:
+            await websocket.send_json(await send_queue.get())
+
+    async def reader():
+        try:
+            while True:
+                raw = await websocket.receive_text()
+                try:
+                    payload = json.loads(raw)
+                    message = payload["message"]
+                    use_cache = payload.get("use_cache", True)
+                    if not isinstance(message, str) or not message.strip() or not isinstance(use_cache, bool):
+                        raise ValueError
+                except (ValueError, TypeError, KeyError):
+                    await send_queue.put({"type": "error", "detail": "Expected {\"message\": \"...\"}"})
+                    continue
+
+                wait = rate_limit_wait("chat_ws", session_id, websocket)
+                if wait:
+                    await send_queue.put({
+                        "type": "error",
+                        "detail": "Too many requests, please slow down",
+                        "retry_after": int(retry_after_header(wait)),
+                    })
+                    continue
+
+                try:
+                    # Served from the cache, so this only costs a lookup while the companion exists
+                    companion = await load_companion(companion_id)
+                    if not companion:
+                        await websocket.close(code=4404, reason="Companion not found")
+                        return
+                    companion_message = await process_chat_message(companion, session_id, message, use_cache)
+                except ResponseEngineBusy as e:
+                    await send_queue.put({
+                        "type": "error",
+                        "detail": "Companion is busy, please retry shortly",
+                        "retry_after": e.retry_after,
+                    })
+                    continue
+                except Exception as e:
+                    logging.error(f"Error in websocket chat: {e}")
+                    await send_queue.put({"type": "error", "detail": "Failed to process chat message"})
+                    continue
+                await send_queue.put({
+                    "type": "reply",
+                    "message": jsonable_encoder(ChatResponse(**companion_message.dict())),
+                })
+        except WebSocketDisconnect:
+            pass
+
+    sender_task = asyncio.create_task(sender())
+    reader_task = asyncio.create_task(reader())
     try:
-        messages = await db.chat_messages.find({
-            "companion_id": companion_id,
-            "session_id": session_id
-        }).sort("timestamp", 1).to_list(1000)
-        
-        return [ChatResponse(**message) for message in messages]
+        # A failed send means the client is gone or stuck; the reader could otherwise
+        # block forever on a full send queue
+        done, _ = await asyncio.wait({sender_task, reader_task}, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                logging.error(f"Error in websocket chat: {error!r}")
+        if reader_task not in done:
+            try:
+                await websocket.close(code=1011)
+            except Exception:
+                pass
+    finally:
+        for task in (sender_task, reader_task):
+            task.cancel()
+        await asyncio.gather(sender_task, reader_task, return_exceptions=True)
+
+def history_page(messages: List[dict], has_more: bool, before: Optional[str], after: Optional[str]) -> dict:
+    """ChatHistoryPage fields, with messages trimmed to ChatResponse but not validated"""
+    return {
+        "messages": shape_documents(messages, ChatResponse),
+        "has_more": has_more,
+        "before_cursor": encode_history_cursor(messages[-1]) if messages else before,
+        "after_cursor": encode_history_cursor(messages[0]) if messages else after,
+    }
+
+def history_page_response(messages: List[dict], has_more: bool, before: Optional[str], after: Optional[str]):
+    page = history_page(messages, has_more, before, after)
+    if FAST_RESPONSES:
+        return fast_response(page)
+    return ChatHistoryPage(**page)
+
+@api_router.get("/chat/{companion_id}", response_model=ChatHistoryPage)
+async def get_chat_history(
+    companion_id: str,
+    session_id: str = Query(...),
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+):
+    """Get a page of chat history for a companion and session, newest first"""
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+    try:
+        # A deleted companion's messages linger until its deletion job sweeps them
+        if not await load_companion(companion_id):
+            raise HTTPException(status_code=404, detail="Companion not found")
+
+        messages = await storage.chats.history(
+            companion_id,
+            session_id,
+            limit + 1,
+            before=decode_history_cursor(before) if before else None,
+            after=decode_history_cursor(after) if after else None,
+        )
+
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if after:
+            messages.reverse()
+
+        return history_page_response(messages, has_more, before, after)
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error getting chat history: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve chat history")
 
+@api_router.get("/chat/{companion_id}/bootstrap", response_model=ChatBootstrap)
+async def bootstrap_chat(
+    companion_id: str,
+    session_id: str = Query(...),
+    limit: int = Query(50, ge=1, le=200),
+):
+    """Everything the chat page needs on load: the companion and the newest page of history"""
+    try:
+        # Both reads at once; the history is dropped if the companion turns out not to exist
+        companion, messages = await asyncio.gather(
+            load_companion(companion_id),
+            storage.chats.history(companion_id, session_id, limit + 1),
+        )
+        if not companion:
+            raise HTTPException(status_code=404, detail="Companion not found")
+
+        page = history_page(messages[:limit], len(messages) > limit, None, None)
+        if FAST_RESPONSES:
+            return fast_response({"companion": companion.dict(), "history": page})
+        return ChatBootstrap(companion=companion, history=ChatHistoryPage(**page))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error bootstrapping chat: {e}")
+        raise HTTPException(status_code=500, detail="Failed to load chat")
+
+@api_router.get("/chat/{companion_id}/search", response_model=ChatSearchPage)
+async def search_chat_history(
+    companion_id: str,
+    request: Request,
+    session_id: str = Query(...),
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+):
+    """Search a session's chat history for messages containing any word of `q`, best match first.
+
+    Matching follows the storage backend; see `ChatStore.search`.
+    """
+    check_rate_limit("chat_search", session_id, request)
+    try:
+        if not await load_companion(companion_id):
+            raise HTTPException(status_code=404, detail="Companion not found")
+
+        hits = await storage.chats.search(companion_id, session_id, search_terms(q), limit + 1, offset)
+        has_more = len(hits) > limit
+        hits = hits[:limit]
+        next_offset = offset + limit if has_more else None
+        if FAST_RESPONSES:
+            return fast_response({
+                "hits": shape_documents(hits, ChatSearchHit),
+                "has_more": has_more,
+                "next_offset": next_offset,
+            })
+        return ChatSearchPage(
+            hits=[ChatSearchHit(**hit) for hit in hits], has_more=has_more, next_offset=next_offset
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error searching chat history: {e}")
+        raise HTTPException(status_code=500, detail="Failed to search chat history")
+
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.environ.get('COMPRESSION_MIN_SIZE', '1024')))
+
+# Inside the metrics middleware, so shed requests still show up in request counts.
+# Bulk transfers are exempt: they answer after minutes, which is not a sign of overload.
+app.add_middleware(
+    LoadSheddingMiddleware,
+    shedder=load_shedder,
+    registry=metrics,
+    exempt_paths=[
+        "/api/", "/api/metrics", "/api/health/live", "/api/health/ready", "/api/companions/bulk", "/api/chat/bulk",
+    ],
+)
+
+app.add_middleware(MetricsMiddleware, registry=metrics)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -309,9 +1604,21 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("startup")
 async def startup_event():
-    await init_db()
-    await seed_companions()
+    if FAST_RESPONSES and orjson is None:
+        logging.warning("FAST_RESPONSES is on but orjson is not installed; "
+                        "responses fall back to the standard encoder")
+    chat_writer.start()
+    startup_state.task = asyncio.create_task(prepare_storage())
+    # Usually ready well within this; otherwise retries go on behind a failing readiness probe
+    await asyncio.wait([startup_state.task], timeout=STARTUP_WAIT)
+    if not startup_state.ready:
+        logging.warning("Serving before the database is ready; /api/health/ready reports 503 until it is")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    if startup_state.task is not None and not startup_state.task.done():
+        startup_state.task.cancel()
+    await companion_deleter.close()
+    await chat_writer.close()
+    response_pool.close()
+    await storage.close()
\ No newline at end of file
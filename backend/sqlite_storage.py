@@ -0,0 +1,841 @@
+"""Embedded SQLite storage backend.
+
+Uses the standard library's `sqlite3` in WAL mode, so readers never block the
+writer and a single-node deployment needs no database server. Every statement
+runs on one dedicated thread that owns the connection; the event loop only
+awaits the results. That thread also serialises writes, which is what makes
+the read-modify-write conversation state updates atomic here.
+
+Tables and indexes mirror the Mongo collections and the indexes `MongoStorage.init`
+creates. SQLite has no TTL indexes, so expired status checks and rollups are
+purged by a periodic task instead.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import companion_analytics
+import conversation_state
+from storage import AnalyticsStore, BulkInsertError, ChatStore, CompanionStore, DeletionJobStore, Storage, StatusStore
+
+# Fixed-width, so text order is time order
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+# Midnight of a stored timestamp's day, in the same format
+DAY_SQL = "substr(timestamp, 1, 10) || 'T00:00:00.000000'"
+ANALYTICS_TOTALS_COLUMNS = (
+    "companion_id, message_count, user_message_count, companion_message_count, session_count, "
+    "first_message_at, last_message_at"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS companions (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    doc TEXT NOT NULL,
+    deleted_at TEXT
+);
+CREATE INDEX IF NOT EXISTS companions_name ON companions (name);
+
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS chat_messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    companion_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    message TEXT NOT NULL,
+    is_user INTEGER NOT NULL,
+    timestamp TEXT NOT NULL
+);
+-- Serves history pages in index order; `seq` keeps insertion order on timestamp ties
+CREATE INDEX IF NOT EXISTS chat_messages_history
+    ON chat_messages (companion_id, session_id, timestamp, seq);
+CREATE INDEX IF NOT EXISTS chat_messages_timestamp ON chat_messages (timestamp);
+
+-- Full-text index over messages, kept in step by triggers. `session_key` is
+-- hex("companion_id session_id"), a single token, so a search only reads
+-- postings for one session.
+CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5(message, session_key);
+CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert AFTER INSERT ON chat_messages BEGIN
+    INSERT INTO chat_messages_fts (rowid, message, session_key)
+    VALUES (new.seq, new.message, hex(new.companion_id || ' ' || new.session_id));
+END;
+CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete AFTER DELETE ON chat_messages BEGIN
+    DELETE FROM chat_messages_fts WHERE rowid = old.seq;
+END;
+
+CREATE TABLE IF NOT EXISTS conversation_states (
+    companion_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (companion_id, session_id)
+);
+
+-- Incrementally maintained analytics, see companion_analytics.py
+CREATE TABLE IF NOT EXISTS companion_stats (
+    companion_id TEXT PRIMARY KEY,
+    message_count INTEGER NOT NULL,
+    user_message_count INTEGER NOT NULL,
+    companion_message_count INTEGER NOT NULL,
+    session_count INTEGER NOT NULL,
+    first_message_at TEXT NOT NULL,
+    last_message_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS companion_stats_messages ON companion_stats (message_count DESC, companion_id);
+
+CREATE TABLE IF NOT EXISTS companion_daily_stats (
+    companion_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    message_count INTEGER NOT NULL,
+    user_message_count INTEGER NOT NULL,
+    companion_message_count INTEGER NOT NULL,
+    active_sessions INTEGER NOT NULL,
+    PRIMARY KEY (companion_id, day)
+);
+
+CREATE TABLE IF NOT EXISTS companion_sessions (
+    companion_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    last_day TEXT NOT NULL,
+    PRIMARY KEY (companion_id, session_id)
+);
+
+CREATE TABLE IF NOT EXISTS status_checks (
+    id TEXT PRIMARY KEY,
+    client_name TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS status_checks_timestamp ON status_checks (timestamp);
+CREATE INDEX IF NOT EXISTS status_checks_client ON status_checks (client_name, timestamp DESC);
+
+CREATE TABLE IF NOT EXISTS status_check_rollups (
+    granularity TEXT NOT NULL,
+    client_name TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    expires_at TEXT NOT NULL,
+    PRIMARY KEY (granularity, client_name, bucket)
+);
+CREATE INDEX IF NOT EXISTS status_check_rollups_bucket ON status_check_rollups (granularity, bucket);
+CREATE INDEX IF NOT EXISTS status_check_rollups_expires_at ON status_check_rollups (expires_at);
+
+CREATE TABLE IF NOT EXISTS deletion_jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deletion_jobs_status ON deletion_jobs (status, created_at);
+
+-- Named leases, so one process at a time runs startup chores such as seeding
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    expires_at TEXT NOT NULL
+);
+"""
+
+# Columns added after a table was first created: (table, column, definition)
+MIGRATIONS = [
+    ("companions", "deleted_at", "TEXT"),
+]
+# Recorded in PRAGMA user_version once migrate has run; bump it when adding a migration
+SCHEMA_VERSION = 1
+
+
+def migrate(conn: sqlite3.Connection):
+    """Add columns and search entries that databases created by older versions lack, once"""
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+    for table, column, definition in MIGRATIONS:
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            with conn:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    with conn:
+        # Messages stored before the search index existed; the triggers keep it current from here on
+        conn.execute("DELETE FROM chat_messages_fts")
+        conn.execute(
+            "INSERT INTO chat_messages_fts (rowid, message, session_key) "
+            "SELECT seq, message, hex(companion_id || ' ' || session_id) FROM chat_messages"
+        )
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def insert_unordered(conn: sqlite3.Connection, sql: str, rows: List[tuple]) -> List[int]:
+    """Run an INSERT OR IGNORE over `rows` like Mongo's unordered insert_many.
+
+    Returns the positions of the rows left out. The usual all-new batch is one
+    executemany; only a batch with collisions is replayed row by row to find them.
+    """
+    with conn:
+        # rowcount leaves out the search index rows the triggers add
+        if conn.executemany(sql, rows).rowcount == len(rows):
+            return []
+        conn.rollback()
+        return [index for index, row in enumerate(rows) if not conn.execute(sql, row).rowcount]
+
+
+def insert_error(what: str, rows: List[tuple], skipped: List[int]) -> BulkInsertError:
+    return BulkInsertError(
+        f"{len(skipped)} duplicate {what}",
+        len(rows) - len(skipped),
+        [{"index": index, "errmsg": f"duplicate {what[:-1]} id {rows[index][0]}"} for index in skipped],
+    )
+
+
+def fts_string(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+
+def session_key(companion_id: str, session_id: str) -> str:
+    """Python twin of the triggers' hex(companion_id || ' ' || session_id)"""
+    return f"{companion_id} {session_id}".encode().hex()
+
+
+def format_timestamp(value: datetime) -> str:
+    """Naive UTC text, matching how the app stores datetimes in Mongo"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+def parse_timestamp(value: str) -> datetime:
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def dump_document(document: dict) -> str:
+    return json.dumps(document, default=lambda v: {"$date": format_timestamp(v)})
+
+
+def load_document(raw: str) -> dict:
+    def restore(obj):
+        if obj.keys() == {"$date"}:
+            return parse_timestamp(obj["$date"])
+        return obj
+
+    return json.loads(raw, object_hook=restore)
+
+
+def time_range(column: str, since: Optional[datetime], until: Optional[datetime]):
+    clauses, params = [], []
+    if since:
+        clauses.append(f"{column} >= ?")
+        params.append(format_timestamp(since))
+    if until:
+        clauses.append(f"{column} < ?")
+        params.append(format_timestamp(until))
+    return clauses, params
+
+
+class SQLiteCompanionStore(CompanionStore):
+    def __init__(self, storage: "SQLiteStorage"):
+        self.storage = storage
+
+    async def get(self, companion_id):
+        row = await self.storage.fetchone(
+            "SELECT doc FROM companions WHERE id = ? AND deleted_at IS NULL", (companion_id,)
+        )
+        return load_document(row[0]) if row else None
+
+    async def list(self, limit=1000):
+        rows = await self.storage.fetchall(
+            "SELECT doc FROM companions WHERE deleted_at IS NULL ORDER BY rowid LIMIT ?", (limit,)
+        )
+        return [load_document(row[0]) for row in rows]
+
+    async def count(self):
+        row = await self.storage.fetchone("SELECT COUNT(*) FROM companions WHERE deleted_at IS NULL")
+        return row[0]
+
+    async def insert(self, companion):
+        await self.insert_many([companion])
+
+    async def insert_many(self, companions):
+        rows = [(c["id"], c["name"], dump_document(c)) for c in companions]
+        skipped = await self.storage.run(
+            lambda conn: insert_unordered(conn, "INSERT OR IGNORE INTO companions (id, name, doc) VALUES (?, ?, ?)", rows)
+        )
+        if skipped:
+            raise insert_error("companions", rows, skipped)
+
+    async def export(self, batch_size=1000):
+        last = 0
+        while True:
+            rows = await self.storage.fetchall(
+                "SELECT rowid, doc FROM companions WHERE deleted_at IS NULL AND rowid > ? ORDER BY rowid LIMIT ?",
+                (last, batch_size),
+            )
+            for row in rows:
+                yield load_document(row[1])
+            if len(rows) < batch_size:
+                return
+            last = rows[-1][0]
+
+    async def update(self, companion_id, fields):
+        def update(conn):
+            row = conn.execute(
+                "SELECT doc FROM companions WHERE id = ? AND deleted_at IS NULL", (companion_id,)
+            ).fetchone()
+            if not row:
+                return None
+            doc = {**load_document(row[0]), **fields}
+            if fields:
+                with conn:
+                    conn.execute(
+                        "UPDATE companions SET name = ?, doc = ? WHERE id = ?",
+                        (doc["name"], dump_document(doc), companion_id),
+                    )
+            return doc
+
+        return await self.storage.run(update)
+
+    async def soft_delete(self, companion_id):
+        return await self.storage.execute(
+            "UPDATE companions SET deleted_at = ? WHERE id = ? AND deleted_at IS NULL",
+            (format_timestamp(datetime.utcnow()), companion_id),
+        ) > 0
+
+    async def delete(self, companion_id):
+        return await self.storage.execute("DELETE FROM companions WHERE id = ?", (companion_id,)) > 0
+
+    async def get_version(self):
+        row = await self.storage.fetchone("SELECT value FROM counters WHERE name = 'companions'")
+        return row[0] if row else 0
+
+    async def bump_version(self):
+        def bump(conn):
+            with conn:
+                return conn.execute(
+                    "INSERT INTO counters (name, value) VALUES ('companions', 1) "
+                    "ON CONFLICT (name) DO UPDATE SET value = value + 1 RETURNING value"
+                ).fetchone()[0]
+
+        return await self.storage.run(bump)
+
+
+CHAT_COLUMNS = "seq, id, companion_id, session_id, message, is_user, timestamp"
+CHAT_COLUMN_INDEX = {column: index for index, column in enumerate(CHAT_COLUMNS.split(", "))}
+
+
+def chat_row(row) -> dict:
+    return {
+        "_id": row[0],
+        "id": row[1],
+        "companion_id": row[2],
+        "session_id": row[3],
+        "message": row[4],
+        "is_user": bool(row[5]),
+        "timestamp": parse_timestamp(row[6]),
+    }
+
+
+class SQLiteChatStore(ChatStore):
+    def __init__(self, storage: "SQLiteStorage"):
+        self.storage = storage
+
+    def cursor_key(self, value):
+        return int(value)
+
+    async def insert_many(self, messages):
+        rows = [
+            (m["id"], m["companion_id"], m["session_id"], m["message"], int(m["is_user"]),
+             format_timestamp(m["timestamp"]))
+            for m in messages
+        ]
+
+        skipped = await self.storage.run(lambda conn: insert_unordered(
+            conn,
+            "INSERT OR IGNORE INTO chat_messages "
+            "(id, companion_id, session_id, message, is_user, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        ))
+        if skipped:
+            raise insert_error("chat messages", rows, skipped)
+
+    async def export(self, companion_id=None, session_id=None, batch_size=1000):
+        # Keyset pages: the history index orders one companion's messages, the rowid everything else
+        clauses, params = [], []
+        if companion_id:
+            clauses.append("companion_id = ?")
+            params.append(companion_id)
+            key = ["timestamp", "seq"] if session_id else ["session_id", "timestamp", "seq"]
+        else:
+            key = ["seq"]
+        if session_id:
+            clauses.append("session_id = ?")
+            params.append(session_id)
+        order = ", ".join(key)
+        position = None
+        while True:
+            where = list(clauses)
+            if position:
+                where.append(f"({order}) > ({', '.join('?' * len(key))})")
+            rows = await self.storage.fetchall(
+                f"SELECT {CHAT_COLUMNS} FROM chat_messages {'WHERE ' + ' AND '.join(where) if where else ''} "
+                f"ORDER BY {order} LIMIT ?",
+                (*params, *(position or ()), batch_size),
+            )
+            for row in rows:
+                message = chat_row(row)
+                del message["_id"]
+                yield message
+            if len(rows) < batch_size:
+                return
+            position = [rows[-1][CHAT_COLUMN_INDEX[column]] for column in key]
+
+    async def history(self, companion_id, session_id, limit, before=None, after=None):
+        clauses = ["companion_id = ?", "session_id = ?"]
+        params = [companion_id, session_id]
+        direction = "ASC" if after else "DESC"
+        position = before or after
+        if position:
+            timestamp, seq = position
+            op = ">" if after else "<"
+            clauses.append(f"(timestamp, seq) {op} (?, ?)")
+            params.extend([format_timestamp(timestamp), seq])
+        rows = await self.storage.fetchall(
+            f"SELECT {CHAT_COLUMNS} FROM chat_messages WHERE {' AND '.join(clauses)} "
+            f"ORDER BY timestamp {direction}, seq {direction} LIMIT ?",
+            (*params, limit),
+        )
+        return [chat_row(row) for row in rows]
+
+    async def search(self, companion_id, session_id, terms, limit, offset=0):
+        if not terms:
+            return []
+        # Any term, as a prefix, within the session's postings
+        match = (
+            f"message : ({' OR '.join(fts_string(term) + '*' for term in terms)}) "
+            f"AND session_key : {session_key(companion_id, session_id)}"
+        )
+        columns = ", ".join(f"m.{column}" for column in CHAT_COLUMNS.split(", "))
+        rows = await self.storage.fetchall(
+            f"SELECT {columns}, bm25(chat_messages_fts, 1.0, 0.0) AS rank "
+            "FROM chat_messages_fts JOIN chat_messages m ON m.seq = chat_messages_fts.rowid "
+            "WHERE chat_messages_fts MATCH ? AND m.companion_id = ? AND m.session_id = ? "
+            "ORDER BY rank, m.timestamp DESC LIMIT ? OFFSET ?",
+            (match, companion_id, session_id, limit, offset),
+        )
+        # bm25 is lower-is-better; flip it so every backend reports higher-is-better
+        return [{**chat_row(row), "score": -row[7]} for row in rows]
+
+    async def delete_batch(self, companion_id, batch_size):
+        return await self.storage.execute(
+            "DELETE FROM chat_messages WHERE seq IN "
+            "(SELECT seq FROM chat_messages WHERE companion_id = ? LIMIT ?)",
+            (companion_id, batch_size),
+        )
+
+    async def delete_states(self, companion_id):
+        await self.storage.execute("DELETE FROM conversation_states WHERE companion_id = ?", (companion_id,))
+
+    async def load_state(self, companion_id, session_id):
+        row = await self.storage.fetchone(
+            "SELECT state FROM conversation_states WHERE companion_id = ? AND session_id = ?",
+            (companion_id, session_id),
+        )
+        return load_document(row[0]) if row else None
+
+    async def record_turn(self, messages, max_turns=conversation_state.RECENT_TURNS):
+        first, last = messages[0], messages[-1]
+        key = (first["companion_id"], first["session_id"])
+        user_count = sum(1 for m in messages if m["is_user"])
+
+        def record(conn):
+            row = conn.execute(
+                "SELECT state FROM conversation_states WHERE companion_id = ? AND session_id = ?", key
+            ).fetchone()
+            state = load_document(row[0]) if row else {
+                "recent_turns": [],
+                "message_count": 0,
+                "user_message_count": 0,
+                "companion_message_count": 0,
+                "started_at": first["timestamp"],
+                "last_activity": last["timestamp"],
+                "summary": None,
+            }
+            state["recent_turns"] = (state["recent_turns"] + [conversation_state.as_turn(m) for m in messages])[-max_turns:]
+            state["message_count"] += len(messages)
+            state["user_message_count"] += user_count
+            state["companion_message_count"] += len(messages) - user_count
+            state["last_activity"] = max(state["last_activity"], last["timestamp"])
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO conversation_states (companion_id, session_id, state) VALUES (?, ?, ?)",
+                    (*key, dump_document(state)),
+                )
+
+        await self.storage.run(record)
+
+    async def rebuild_states(self, companion_id=None, session_id=None, max_turns=conversation_state.RECENT_TURNS):
+        clauses, params = [], []
+        if companion_id:
+            clauses.append("companion_id = ?")
+            params.append(companion_id)
+        if session_id:
+            clauses.append("session_id = ?")
+            params.append(session_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        def rebuild(conn):
+            sessions = conn.execute(
+                "SELECT companion_id, session_id, COUNT(*), SUM(is_user), MIN(timestamp), MAX(timestamp) "
+                f"FROM chat_messages {where} GROUP BY companion_id, session_id",
+                params,
+            ).fetchall()
+            with conn:
+                for cid, sid, count, user_count, started_at, last_activity in sessions:
+                    recent = conn.execute(
+                        f"SELECT {CHAT_COLUMNS} FROM chat_messages WHERE companion_id = ? AND session_id = ? "
+                        "ORDER BY timestamp DESC, seq DESC LIMIT ?",
+                        (cid, sid, max_turns),
+                    ).fetchall()
+                    existing = conn.execute(
+                        "SELECT state FROM conversation_states WHERE companion_id = ? AND session_id = ?", (cid, sid)
+                    ).fetchone()
+                    state = {
+                        "recent_turns": [conversation_state.as_turn(chat_row(row)) for row in reversed(recent)],
+                        "message_count": count,
+                        "user_message_count": user_count,
+                        "companion_message_count": count - user_count,
+                        "started_at": parse_timestamp(started_at),
+                        "last_activity": parse_timestamp(last_activity),
+                        "summary": load_document(existing[0]).get("summary") if existing else None,
+                    }
+                    conn.execute(
+                        "INSERT OR REPLACE INTO conversation_states (companion_id, session_id, state) VALUES (?, ?, ?)",
+                        (cid, sid, dump_document(state)),
+                    )
+            return len(sessions)
+
+        return await self.storage.run(rebuild)
+
+
+class SQLiteAnalyticsStore(AnalyticsStore):
+    def __init__(self, storage: "SQLiteStorage"):
+        self.storage = storage
+
+    async def record(self, messages):
+        first = messages[0]
+        key = (first["companion_id"], first["session_id"])
+
+        def record(conn):
+            with conn:
+                for day, day_messages in companion_analytics.by_day(messages):
+                    day_messages = list(day_messages)
+                    day = format_timestamp(day)
+                    previous = conn.execute(
+                        "SELECT last_day FROM companion_sessions WHERE companion_id = ? AND session_id = ?", key
+                    ).fetchone()
+                    conn.execute(
+                        "INSERT INTO companion_sessions (companion_id, session_id, last_day) VALUES (?, ?, ?) "
+                        "ON CONFLICT (companion_id, session_id) DO UPDATE SET last_day = max(last_day, excluded.last_day)",
+                        (*key, day),
+                    )
+                    counts = companion_analytics.message_counts(day_messages)
+                    conn.execute(
+                        f"INSERT INTO companion_stats ({ANALYTICS_TOTALS_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (companion_id) DO UPDATE SET "
+                        "message_count = message_count + excluded.message_count, "
+                        "user_message_count = user_message_count + excluded.user_message_count, "
+                        "companion_message_count = companion_message_count + excluded.companion_message_count, "
+                        "session_count = session_count + excluded.session_count, "
+                        "first_message_at = min(first_message_at, excluded.first_message_at), "
+                        "last_message_at = max(last_message_at, excluded.last_message_at)",
+                        (key[0], counts["message_count"], counts["user_message_count"], counts["companion_message_count"],
+                         int(previous is None), format_timestamp(day_messages[0]["timestamp"]),
+                         format_timestamp(day_messages[-1]["timestamp"])),
+                    )
+                    conn.execute(
+                        "INSERT INTO companion_daily_stats (companion_id, day, message_count, user_message_count, "
+                        "companion_message_count, active_sessions) VALUES (?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (companion_id, day) DO UPDATE SET "
+                        "message_count = message_count + excluded.message_count, "
+                        "user_message_count = user_message_count + excluded.user_message_count, "
+                        "companion_message_count = companion_message_count + excluded.companion_message_count, "
+                        "active_sessions = active_sessions + excluded.active_sessions",
+                        (key[0], day, counts["message_count"], counts["user_message_count"],
+                         counts["companion_message_count"], int(previous is None or previous[0] < day)),
+                    )
+
+        await self.storage.run(record)
+
+    @staticmethod
+    def totals_row(row) -> dict:
+        return {
+            "companion_id": row[0],
+            "message_count": row[1],
+            "user_message_count": row[2],
+            "companion_message_count": row[3],
+            "session_count": row[4],
+            "first_message_at": parse_timestamp(row[5]),
+            "last_message_at": parse_timestamp(row[6]),
+        }
+
+    async def companions(self, limit):
+        rows = await self.storage.fetchall(
+            f"SELECT {ANALYTICS_TOTALS_COLUMNS} FROM companion_stats"
+            " WHERE companion_id NOT IN (SELECT id FROM companions WHERE deleted_at IS NOT NULL)"
+            " ORDER BY message_count DESC, companion_id LIMIT ?",
+            (limit,),
+        )
+        return [self.totals_row(row) for row in rows]
+
+    async def totals(self, companion_id):
+        row = await self.storage.fetchone(
+            f"SELECT {ANALYTICS_TOTALS_COLUMNS} FROM companion_stats WHERE companion_id = ?", (companion_id,)
+        )
+        return self.totals_row(row) if row else None
+
+    async def daily(self, companion_id, since, until, limit):
+        clauses, params = time_range("day", since, until)
+        clauses.insert(0, "companion_id = ?")
+        params.insert(0, companion_id)
+        rows = await self.storage.fetchall(
+            "SELECT day, message_count, user_message_count, companion_message_count, active_sessions "
+            f"FROM companion_daily_stats WHERE {' AND '.join(clauses)} ORDER BY day ASC LIMIT ?",
+            (*params, limit),
+        )
+        return [
+            {
+                "day": parse_timestamp(row[0]),
+                "message_count": row[1],
+                "user_message_count": row[2],
+                "companion_message_count": row[3],
+                "active_sessions": row[4],
+            }
+            for row in rows
+        ]
+
+    async def delete(self, companion_id):
+        def delete(conn):
+            with conn:
+                for table in companion_analytics.ANALYTICS_COLLECTIONS:
+                    conn.execute(f"DELETE FROM {table} WHERE companion_id = ?", (companion_id,))
+
+        await self.storage.run(delete)
+
+    async def rebuild(self, companion_id=None):
+        where, params = ("WHERE companion_id = ?", (companion_id,)) if companion_id else ("", ())
+
+        def rebuild(conn):
+            with conn:
+                for table in companion_analytics.ANALYTICS_COLLECTIONS:
+                    conn.execute(f"DELETE FROM {table} {where}", params)
+                conn.execute(
+                    "INSERT INTO companion_sessions (companion_id, session_id, last_day) "
+                    "SELECT companion_id, session_id, substr(MAX(timestamp), 1, 10) || 'T00:00:00.000000' "
+                    f"FROM chat_messages {where} GROUP BY companion_id, session_id",
+                    params,
+                )
+                conn.execute(
+                    "INSERT INTO companion_daily_stats (companion_id, day, message_count, user_message_count, "
+                    "companion_message_count, active_sessions) "
+                    f"SELECT companion_id, {DAY_SQL}, COUNT(*), SUM(is_user), COUNT(*) - SUM(is_user), "
+                    f"COUNT(DISTINCT session_id) FROM chat_messages {where} GROUP BY companion_id, {DAY_SQL}",
+                    params,
+                )
+                return conn.execute(
+                    f"INSERT INTO companion_stats ({ANALYTICS_TOTALS_COLUMNS}) "
+                    "SELECT companion_id, COUNT(*), SUM(is_user), COUNT(*) - SUM(is_user), "
+                    f"COUNT(DISTINCT session_id), MIN(timestamp), MAX(timestamp) FROM chat_messages {where} "
+                    "GROUP BY companion_id",
+                    params,
+                ).rowcount
+
+        return await self.storage.run(rebuild)
+
+
+class SQLiteStatusStore(StatusStore):
+    def __init__(self, storage: "SQLiteStorage"):
+        self.storage = storage
+
+    async def insert(self, status_check):
+        await self.storage.execute(
+            "INSERT INTO status_checks (id, client_name, timestamp) VALUES (?, ?, ?)",
+            (status_check["id"], status_check["client_name"], format_timestamp(status_check["timestamp"])),
+        )
+
+    async def find(self, since, until, client_name, limit):
+        clauses, params = time_range("timestamp", since, until)
+        if client_name:
+            clauses.append("client_name = ?")
+            params.append(client_name)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = await self.storage.fetchall(
+            f"SELECT id, client_name, timestamp FROM status_checks {where} ORDER BY timestamp DESC LIMIT ?",
+            (*params, limit),
+        )
+        return [{"id": row[0], "client_name": row[1], "timestamp": parse_timestamp(row[2])} for row in rows]
+
+    async def increment_rollup(self, granularity, client_name, bucket, expires_at):
+        await self.storage.execute(
+            "INSERT INTO status_check_rollups (granularity, client_name, bucket, count, expires_at) "
+            "VALUES (?, ?, ?, 1, ?) ON CONFLICT (granularity, client_name, bucket) DO UPDATE SET count = count + 1",
+            (granularity, client_name, format_timestamp(bucket), format_timestamp(expires_at)),
+        )
+
+    async def rollups(self, granularity, since, until, client_name, limit):
+        clauses, params = time_range("bucket", since, until)
+        clauses.insert(0, "granularity = ?")
+        params.insert(0, granularity)
+        if client_name:
+            clauses.append("client_name = ?")
+            params.append(client_name)
+        rows = await self.storage.fetchall(
+            f"SELECT client_name, bucket, count FROM status_check_rollups WHERE {' AND '.join(clauses)} "
+            "ORDER BY bucket ASC LIMIT ?",
+            (*params, limit),
+        )
+        return [{"client_name": row[0], "bucket": parse_timestamp(row[1]), "count": row[2]} for row in rows]
+
+    async def purge_expired(self):
+        now = datetime.utcnow()
+        cutoff = format_timestamp(now - timedelta(seconds=self.storage.status_retention))
+
+        def purge(conn):
+            with conn:
+                checks = conn.execute("DELETE FROM status_checks WHERE timestamp < ?", (cutoff,)).rowcount
+                rollups = conn.execute(
+                    "DELETE FROM status_check_rollups WHERE expires_at < ?", (format_timestamp(now),)
+                ).rowcount
+            return checks + rollups
+
+        return await self.storage.run(purge)
+
+
+class SQLiteDeletionJobStore(DeletionJobStore):
+    def __init__(self, storage: "SQLiteStorage"):
+        self.storage = storage
+
+    async def insert(self, job):
+        await self.storage.execute(
+            "INSERT INTO deletion_jobs (id, status, created_at, doc) VALUES (?, ?, ?, ?)",
+            (job["id"], job["status"], format_timestamp(job["created_at"]), dump_document(job)),
+        )
+
+    async def get(self, job_id):
+        row = await self.storage.fetchone("SELECT doc FROM deletion_jobs WHERE id = ?", (job_id,))
+        return load_document(row[0]) if row else None
+
+    async def update(self, job_id, fields):
+        def update(conn):
+            row = conn.execute("SELECT doc FROM deletion_jobs WHERE id = ?", (job_id,)).fetchone()
+            if not row:
+                return
+            job = {**load_document(row[0]), **fields}
+            with conn:
+                conn.execute(
+                    "UPDATE deletion_jobs SET status = ?, doc = ? WHERE id = ?",
+                    (job["status"], dump_document(job), job_id),
+                )
+
+        await self.storage.run(update)
+
+    async def unfinished(self):
+        rows = await self.storage.fetchall(
+            "SELECT doc FROM deletion_jobs WHERE status != 'completed' ORDER BY created_at"
+        )
+        return [load_document(row[0]) for row in rows]
+
+
+class SQLiteStorage(Storage):
+    name = "sqlite"
+
+    def __init__(self, path: str, status_retention: int, purge_interval: float = 60.0):
+        self.path = path
+        self.status_retention = status_retention
+        self.purge_interval = purge_interval
+        # One thread owns the connection, so statements never interleave
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._purge_task: Optional[asyncio.Task] = None
+        self.companions = SQLiteCompanionStore(self)
+        self.chats = SQLiteChatStore(self)
+        self.analytics = SQLiteAnalyticsStore(self)
+        self.status = SQLiteStatusStore(self)
+        self.deletion_jobs = SQLiteDeletionJobStore(self)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level="DEFERRED")
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Durable at checkpoints rather than on every commit, the usual pairing with WAL
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    async def run(self, fn):
+        """Run `fn(connection)` on the storage thread"""
+        def call():
+            if self._conn is None:
+                self._conn = self._connect()
+            return fn(self._conn)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    async def execute(self, sql: str, params=()) -> int:
+        def execute(conn):
+            with conn:
+                return conn.execute(sql, params).rowcount
+
+        return await self.run(execute)
+
+    async def fetchone(self, sql: str, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def init(self):
+        await self.run(lambda conn: conn.executescript(SCHEMA))
+        await self.run(migrate)
+        if self._purge_task is None and self.purge_interval:
+            self._purge_task = asyncio.create_task(self._purge_expired_periodically())
+
+    async def ping(self):
+        await self.fetchone("SELECT 1")
+
+    async def claim(self, name, ttl):
+        now = datetime.utcnow()
+        # Other processes may share the file; the upsert only takes a lease that has lapsed
+        return await self.execute(
+            "INSERT INTO leases (name, expires_at) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET expires_at = excluded.expires_at WHERE leases.expires_at < ?",
+            (name, format_timestamp(now + timedelta(seconds=ttl)), format_timestamp(now)),
+        ) > 0
+
+    async def release(self, name):
+        await self.execute("DELETE FROM leases WHERE name = ?", (name,))
+
+    async def _purge_expired_periodically(self):
+        while True:
+            try:
+                await self.status.purge_expired()
+            except Exception as e:
+                logging.error(f"Error purging expired status checks: {e}")
+            await asyncio.sleep(self.purge_interval)
+
+    async def close(self):
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            try:
+                await self._purge_task
+            except asyncio.CancelledError:
+                pass
+            self._purge_task = None
+        if self._conn is not None:
+            await self.run(lambda conn: conn.close())
+            self._conn = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
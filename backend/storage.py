@@ -0,0 +1,627 @@
+"""Storage backends.
+
+Handlers talk to stores (companions, chat messages with their conversation
+state, per-companion analytics, status checks and deletion jobs) instead of
+collections. The Mongo
+backend is the default; `STORAGE_BACKEND=sqlite` selects the embedded
+SQLite engine in `sqlite_storage.py` for single-node deployments.
+"""
+import asyncio
+import os
+import re
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional, Tuple
+
+import companion_analytics
+import conversation_state
+
+# A cursor position: (timestamp, backend-specific tie-breaker)
+CursorPosition = Tuple[datetime, object]
+
+
+class BulkInsertError(Exception):
+    """Some documents of a batch were not inserted; `details` mirrors pymongo's BulkWriteError"""
+
+    def __init__(self, message: str, inserted: int, errors: List[dict] = ()):
+        super().__init__(message)
+        # writeErrors: {"index": position in the batch, "errmsg": ...} per document left out
+        self.details = {"nInserted": inserted, "writeErrors": list(errors)}
+
+
+class CompanionStore:
+    """Reads and updates only see companions that have not been soft-deleted"""
+
+    async def get(self, companion_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def list(self, limit: int = 1000) -> List[dict]:
+        raise NotImplementedError
+
+    async def count(self) -> int:
+        raise NotImplementedError
+
+    async def insert(self, companion: dict):
+        raise NotImplementedError
+
+    async def insert_many(self, companions: List[dict]):
+        """Insert every companion whose id is free, then raise for the rest like an unordered insert_many"""
+        raise NotImplementedError
+
+    def export(self, batch_size: int = 1000) -> AsyncIterator[dict]:
+        """Every live companion, fetched `batch_size` at a time"""
+        raise NotImplementedError
+
+    async def update(self, companion_id: str, fields: dict) -> Optional[dict]:
+        """Apply `fields` and return the updated companion, or None if it does not exist"""
+        raise NotImplementedError
+
+    async def soft_delete(self, companion_id: str) -> bool:
+        """Hide a companion right away; False if it does not exist or is already deleted"""
+        raise NotImplementedError
+
+    async def delete(self, companion_id: str) -> bool:
+        """Remove a companion for good, deleted or not"""
+        raise NotImplementedError
+
+    async def get_version(self) -> int:
+        """Catalogue version, bumped on every companion write"""
+        raise NotImplementedError
+
+    async def bump_version(self) -> int:
+        raise NotImplementedError
+
+
+class ChatStore:
+    def cursor_key(self, value: str):
+        """Parse the tie-breaker part of a history cursor; raises ValueError when malformed"""
+        raise NotImplementedError
+
+    async def insert_many(self, messages: List[dict]):
+        raise NotImplementedError
+
+    def export(self, companion_id: Optional[str] = None, session_id: Optional[str] = None,
+               batch_size: int = 1000) -> AsyncIterator[dict]:
+        """Messages shaped like ChatResponse, fetched `batch_size` at a time.
+
+        Filtered by companion, they come session by session, oldest first.
+        """
+        raise NotImplementedError
+
+    async def history(self, companion_id: str, session_id: str, limit: int,
+                      before: Optional[CursorPosition] = None,
+                      after: Optional[CursorPosition] = None) -> List[dict]:
+        """Up to `limit` messages shaped like ChatResponse plus the `_id` tie-breaker.
+
+        Newest first, or oldest first when paging with `after`.
+        """
+        raise NotImplementedError
+
+    async def search(self, companion_id: str, session_id: str, terms: List[str],
+                     limit: int, offset: int = 0) -> List[dict]:
+        """Messages containing any of `terms`, best match first, each with a `score`.
+
+        What counts as containing a term is up to the backend's text index.
+        SQLite matches any word the term starts with. MongoDB's text search
+        matches whole words after English stemming ("hikes" finds "hiking")
+        and ignores stop words such as "the", but does not match prefixes.
+        Bucket mode needs both: the stemmed word to pick a bucket, then a word
+        starting with the term to pick messages within it. Scores are only
+        comparable within one backend.
+        """
+        raise NotImplementedError
+
+    async def delete_batch(self, companion_id: str, batch_size: int) -> int:
+        """Remove up to `batch_size` of a companion's messages, returning how many went"""
+        raise NotImplementedError
+
+    async def delete_states(self, companion_id: str):
+        raise NotImplementedError
+
+    async def load_state(self, companion_id: str, session_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def record_turn(self, messages: List[dict], max_turns: int = conversation_state.RECENT_TURNS):
+        raise NotImplementedError
+
+    async def rebuild_states(self, companion_id: Optional[str] = None, session_id: Optional[str] = None,
+                             max_turns: int = conversation_state.RECENT_TURNS) -> int:
+        raise NotImplementedError
+
+
+class AnalyticsStore:
+    async def record(self, messages: List[dict]):
+        """Count new messages of one session into its companion's totals and daily rollups"""
+        raise NotImplementedError
+
+    async def companions(self, limit: int) -> List[dict]:
+        """Per-companion totals, most messages first, leaving out soft-deleted companions"""
+        raise NotImplementedError
+
+    async def totals(self, companion_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def daily(self, companion_id: str, since: Optional[datetime], until: Optional[datetime],
+                    limit: int) -> List[dict]:
+        """Daily rollups for days in [since, until), oldest first"""
+        raise NotImplementedError
+
+    async def delete(self, companion_id: str):
+        raise NotImplementedError
+
+    async def rebuild(self, companion_id: Optional[str] = None) -> int:
+        """Recompute analytics from the stored messages, returning how many companions have any"""
+        raise NotImplementedError
+
+
+class StatusStore:
+    async def insert(self, status_check: dict):
+        raise NotImplementedError
+
+    async def find(self, since: Optional[datetime], until: Optional[datetime],
+                   client_name: Optional[str], limit: int) -> List[dict]:
+        """Status checks in [since, until), newest first"""
+        raise NotImplementedError
+
+    async def increment_rollup(self, granularity: str, client_name: str, bucket: datetime, expires_at: datetime):
+        raise NotImplementedError
+
+    async def rollups(self, granularity: str, since: Optional[datetime], until: Optional[datetime],
+                      client_name: Optional[str], limit: int) -> List[dict]:
+        """Rollup counts in [since, until), oldest bucket first"""
+        raise NotImplementedError
+
+    async def purge_expired(self):
+        """Drop checks and rollups past their retention, for backends without TTL indexes"""
+
+
+class DeletionJobStore:
+    async def insert(self, job: dict):
+        raise NotImplementedError
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def update(self, job_id: str, fields: dict):
+        raise NotImplementedError
+
+    async def unfinished(self) -> List[dict]:
+        """Jobs still to run, oldest first"""
+        raise NotImplementedError
+
+
+class Storage:
+    name = "base"
+    companions: CompanionStore
+    chats: ChatStore
+    analytics: AnalyticsStore
+    status: StatusStore
+    deletion_jobs: DeletionJobStore
+
+    async def init(self) -> Optional[int]:
+        """Create indexes or schema; returns how many indexes were created, when the backend tracks it"""
+
+    async def ping(self):
+        """Raise if the database cannot be reached"""
+
+    async def claim(self, name: str, ttl: float) -> bool:
+        """Take the named lease unless another process holds it; it lapses after `ttl` seconds"""
+        raise NotImplementedError
+
+    async def release(self, name: str):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+# Fields of the response models, so reads fetch nothing the API does not return
+CHAT_RESPONSE_FIELDS = ["id", "companion_id", "session_id", "message", "is_user", "timestamp"]
+STATUS_CHECK_FIELDS = ["id", "client_name", "timestamp"]
+STATUS_ROLLUP_FIELDS = ["client_name", "bucket", "count"]
+
+
+def projection(fields: List[str], include_id: bool = False) -> dict:
+    return {"_id": int(include_id), **{field: 1 for field in fields}}
+
+
+def search_terms(query: str, max_terms: int = 10) -> List[str]:
+    """Lower-cased words of a search query, so no backend sees query syntax"""
+    terms = []
+    for word in re.findall(r"\w+", query.lower()):
+        if word not in terms:
+            terms.append(word)
+    return terms[:max_terms]
+
+
+def time_range(since: Optional[datetime], until: Optional[datetime]) -> dict:
+    bounds = {}
+    if since:
+        bounds["$gte"] = since
+    if until:
+        bounds["$lt"] = until
+    return bounds
+
+
+# Matches documents where the field is missing too
+LIVE = {"deleted_at": None}
+
+
+class MongoCompanionStore(CompanionStore):
+    def __init__(self, db):
+        self.db = db
+
+    async def get(self, companion_id):
+        return await self.db.companions.find_one({"id": companion_id, **LIVE}, {"_id": 0, "deleted_at": 0})
+
+    async def list(self, limit=1000):
+        return await self.db.companions.find(LIVE, {"_id": 0, "deleted_at": 0}).to_list(limit)
+
+    async def count(self):
+        return await self.db.companions.count_documents(LIVE)
+
+    async def insert(self, companion):
+        await self.db.companions.insert_one(dict(companion))
+
+    async def insert_many(self, companions):
+        await self.db.companions.insert_many([dict(c) for c in companions], ordered=False)
+
+    async def export(self, batch_size=1000):
+        cursor = self.db.companions.find(LIVE, {"_id": 0, "deleted_at": 0}).batch_size(batch_size)
+        try:
+            async for companion in cursor:
+                yield companion
+        finally:
+            await cursor.close()
+
+    async def update(self, companion_id, fields):
+        from pymongo import ReturnDocument
+
+        if not fields:
+            return await self.get(companion_id)
+        return await self.db.companions.find_one_and_update(
+            {"id": companion_id, **LIVE}, {"$set": fields}, {"_id": 0, "deleted_at": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def soft_delete(self, companion_id):
+        result = await self.db.companions.update_one(
+            {"id": companion_id, **LIVE}, {"$set": {"deleted_at": datetime.utcnow()}}
+        )
+        return result.modified_count > 0
+
+    async def delete(self, companion_id):
+        result = await self.db.companions.delete_one({"id": companion_id})
+        return result.deleted_count > 0
+
+    async def get_version(self):
+        doc = await self.db.counters.find_one({"_id": "companions"})
+        return doc["version"] if doc else 0
+
+    async def bump_version(self):
+        from pymongo import ReturnDocument
+
+        doc = await self.db.counters.find_one_and_update(
+            {"_id": "companions"},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc["version"]
+
+
+class MongoChatStore(ChatStore):
+    def __init__(self, db):
+        self.db = db
+
+    def cursor_key(self, value):
+        from bson import ObjectId
+        from bson.errors import InvalidId
+
+        try:
+            return ObjectId(value)
+        except (InvalidId, TypeError) as e:
+            raise ValueError(str(e))
+
+    async def insert_many(self, messages):
+        await self.db.chat_messages.insert_many(messages, ordered=False)
+
+    async def export(self, companion_id=None, session_id=None, batch_size=1000):
+        query = {}
+        if companion_id:
+            query["companion_id"] = companion_id
+        if session_id:
+            query["session_id"] = session_id
+        cursor = self.db.chat_messages.find(query, projection(CHAT_RESPONSE_FIELDS)).batch_size(batch_size)
+        if companion_id:
+            # The history index serves this order
+            cursor = cursor.sort([("companion_id", 1), ("session_id", 1), ("timestamp", 1), ("_id", 1)])
+        try:
+            async for message in cursor:
+                yield message
+        finally:
+            await cursor.close()
+
+    async def history(self, companion_id, session_id, limit, before=None, after=None):
+        query = {"companion_id": companion_id, "session_id": session_id}
+        # Older pages walk the index backwards, newer pages walk it forwards
+        direction = 1 if after else -1
+        position = before or after
+        if position:
+            timestamp, object_id = position
+            op = "$gt" if after else "$lt"
+            query["$or"] = [
+                {"timestamp": {op: timestamp}},
+                {"timestamp": timestamp, "_id": {op: object_id}},
+            ]
+        return await self.db.chat_messages.find(query, projection(CHAT_RESPONSE_FIELDS, include_id=True)).sort(
+            [("timestamp", direction), ("_id", direction)]
+        ).limit(limit).to_list(limit)
+
+    async def search(self, companion_id, session_id, terms, limit, offset=0):
+        if not terms:
+            return []
+        # The text index is prefixed by session, so only this session's postings are read.
+        # $text stems words and drops stop words; it has no prefix match, unlike SQLite
+        query = {"companion_id": companion_id, "session_id": session_id, "$text": {"$search": " ".join(terms)}}
+        score = {"$meta": "textScore"}
+        return await self.db.chat_messages.find(
+            query, {**projection(CHAT_RESPONSE_FIELDS), "score": score}
+        ).sort([("score", score), ("timestamp", -1)]).skip(offset).limit(limit).to_list(limit)
+
+    async def delete_batch(self, companion_id, batch_size):
+        # delete_many has no limit; pick one batch of ids off the history index instead
+        batch = await self.db.chat_messages.find({"companion_id": companion_id}, {"_id": 1}).limit(
+            batch_size
+        ).to_list(batch_size)
+        if not batch:
+            return 0
+        result = await self.db.chat_messages.delete_many({"_id": {"$in": [m["_id"] for m in batch]}})
+        return result.deleted_count
+
+    async def delete_states(self, companion_id):
+        await self.db.conversation_states.delete_many({"companion_id": companion_id})
+
+    async def load_state(self, companion_id, session_id):
+        return await conversation_state.load_state(self.db.conversation_states, companion_id, session_id)
+
+    async def record_turn(self, messages, max_turns=conversation_state.RECENT_TURNS):
+        await conversation_state.record_turn(self.db.conversation_states, messages, max_turns)
+
+    async def rebuild_states(self, companion_id=None, session_id=None, max_turns=conversation_state.RECENT_TURNS):
+        return await conversation_state.rebuild_states(self.db, companion_id, session_id, max_turns)
+
+
+class MongoAnalyticsStore(AnalyticsStore):
+    def __init__(self, db, buckets: bool = False):
+        self.db = db
+        # Where rebuild reads messages from: per-message documents or chat_buckets
+        self.buckets = buckets
+
+    async def record(self, messages):
+        await companion_analytics.record_messages(self.db, messages)
+
+    async def companions(self, limit):
+        return await companion_analytics.companion_totals(self.db, limit)
+
+    async def totals(self, companion_id):
+        return await companion_analytics.totals(self.db, companion_id)
+
+    async def daily(self, companion_id, since, until, limit):
+        query = {"day": time_range(since, until)} if since or until else {}
+        return await companion_analytics.daily(self.db, companion_id, query, limit)
+
+    async def delete(self, companion_id):
+        await companion_analytics.delete(self.db, companion_id)
+
+    async def rebuild(self, companion_id=None):
+        return await companion_analytics.rebuild(self.db, companion_id, self.buckets)
+
+
+class MongoStatusStore(StatusStore):
+    def __init__(self, db):
+        self.db = db
+
+    async def insert(self, status_check):
+        await self.db.status_checks.insert_one(dict(status_check))
+
+    async def find(self, since, until, client_name, limit):
+        query = {}
+        if client_name:
+            query["client_name"] = client_name
+        if since or until:
+            query["timestamp"] = time_range(since, until)
+        return await self.db.status_checks.find(query, projection(STATUS_CHECK_FIELDS)).sort("timestamp", -1).to_list(limit)
+
+    async def increment_rollup(self, granularity, client_name, bucket, expires_at):
+        await self.db.status_check_rollups.update_one(
+            {"granularity": granularity, "client_name": client_name, "bucket": bucket},
+            {"$inc": {"count": 1}, "$setOnInsert": {"expires_at": expires_at}},
+            upsert=True,
+        )
+
+    async def rollups(self, granularity, since, until, client_name, limit):
+        query = {"granularity": granularity}
+        if client_name:
+            query["client_name"] = client_name
+        if since or until:
+            query["bucket"] = time_range(since, until)
+        return await self.db.status_check_rollups.find(query, projection(STATUS_ROLLUP_FIELDS)).sort("bucket", 1).to_list(limit)
+
+
+class MongoDeletionJobStore(DeletionJobStore):
+    def __init__(self, db):
+        self.db = db
+
+    async def insert(self, job):
+        await self.db.deletion_jobs.insert_one(dict(job))
+
+    async def get(self, job_id):
+        return await self.db.deletion_jobs.find_one({"id": job_id}, {"_id": 0})
+
+    async def update(self, job_id, fields):
+        await self.db.deletion_jobs.update_one({"id": job_id}, {"$set": fields})
+
+    async def unfinished(self):
+        return await self.db.deletion_jobs.find(
+            {"status": {"$ne": "completed"}}, {"_id": 0}
+        ).sort("created_at", 1).to_list(None)
+
+
+class MongoStorage(Storage):
+    name = "mongo"
+
+    def __init__(self, mongo_url: str, db_name: str, status_retention: int, event_listeners=(),
+                 chat_bucket_size: Optional[int] = None, client_options: Optional[dict] = None):
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        self.client = AsyncIOMotorClient(mongo_url, event_listeners=list(event_listeners), **(client_options or {}))
+        self.db = self.client[db_name]
+        self.status_retention = status_retention
+        self.companions = MongoCompanionStore(self.db)
+        if chat_bucket_size:
+            from chat_buckets import MongoBucketChatStore
+
+            self.chats = MongoBucketChatStore(self.db, chat_bucket_size)
+        else:
+            self.chats = MongoChatStore(self.db)
+        self.analytics = MongoAnalyticsStore(self.db, buckets=bool(chat_bucket_size))
+        self.status = MongoStatusStore(self.db)
+        self.deletion_jobs = MongoDeletionJobStore(self.db)
+
+    def index_specs(self) -> List[Tuple[str, list, dict]]:
+        """(collection, keys, create_index options) for every index the app relies on"""
+        return [
+            ("companions", [("id", 1)], {"unique": True}),
+            ("companions", [("name", 1)], {}),
+
+            ("chat_messages", [("id", 1)], {"unique": True}),
+            # Serves history pages in index order; `_id` keeps insertion order on timestamp ties
+            ("chat_messages", [("companion_id", 1), ("session_id", 1), ("timestamp", 1), ("_id", 1)], {}),
+            ("chat_messages", [("timestamp", 1)], {}),
+            # Per-session full-text search
+            ("chat_messages", [("companion_id", 1), ("session_id", 1), ("message", "text")],
+             {"name": "chat_messages_search"}),
+            # Bucketed history: one entry per bucket, which also serves deletes by companion
+            ("chat_buckets", [("companion_id", 1), ("session_id", 1), ("seq", 1)], {"unique": True}),
+            ("chat_buckets", [("companion_id", 1), ("session_id", 1), ("messages.message", "text")],
+             {"name": "chat_buckets_search"}),
+
+            # One rolling state document per conversation
+            ("conversation_states", [("companion_id", 1), ("session_id", 1)], {"unique": True}),
+
+            # Incrementally maintained analytics, see companion_analytics.py
+            ("companion_stats", [("companion_id", 1)], {"unique": True}),
+            ("companion_stats", [("message_count", -1), ("companion_id", 1)], {}),
+            ("companion_daily_stats", [("companion_id", 1), ("day", 1)], {"unique": True}),
+            ("companion_sessions", [("companion_id", 1), ("session_id", 1)], {"unique": True}),
+
+            ("status_checks", [("id", 1)], {"unique": True}),
+            ("status_checks", [("timestamp", 1)], {"expireAfterSeconds": self.status_retention}),
+            ("status_checks", [("client_name", 1), ("timestamp", -1)], {}),
+            ("status_check_rollups", [("granularity", 1), ("client_name", 1), ("bucket", 1)], {"unique": True}),
+            ("status_check_rollups", [("granularity", 1), ("bucket", 1)], {}),
+            ("status_check_rollups", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+
+            # Background companion deletions, resumed on startup
+            ("deletion_jobs", [("id", 1)], {"unique": True}),
+            ("deletion_jobs", [("status", 1), ("created_at", 1)], {}),
+        ]
+
+    async def init(self):
+        # One listIndexes per collection, all collections at once; nothing is rebuilt on a warm start
+        by_collection = {}
+        for collection, keys, options in self.index_specs():
+            by_collection.setdefault(collection, []).append((keys, options))
+        created = await asyncio.gather(*(
+            self.ensure_indexes(self.db[name], wanted) for name, wanted in by_collection.items()
+        ))
+        return sum(created)
+
+    async def ensure_indexes(self, collection, wanted: List[Tuple[list, dict]]) -> int:
+        """Create the indexes `collection` lacks and return how many.
+
+        An index already there under the same name and uniqueness is left alone;
+        a TTL that changed is updated in place. Any other difference makes
+        create_indexes fail loudly rather than keep serving off the wrong index.
+        """
+        from pymongo import IndexModel
+
+        existing = await collection.index_information()
+        missing = []
+        for keys, options in wanted:
+            name = options.get("name") or "_".join(f"{field}_{direction}" for field, direction in keys)
+            current = existing.get(name)
+            if current is None or bool(current.get("unique")) != bool(options.get("unique")):
+                missing.append(IndexModel(keys, **options))
+            elif "expireAfterSeconds" in options and current.get("expireAfterSeconds") != options["expireAfterSeconds"]:
+                await self.db.command({
+                    "collMod": collection.name,
+                    "index": {"name": name, "expireAfterSeconds": options["expireAfterSeconds"]},
+                })
+        if missing:
+            await collection.create_indexes(missing)
+        return len(missing)
+
+    async def ping(self):
+        await self.client.admin.command("ping")
+
+    async def claim(self, name, ttl):
+        from pymongo.errors import DuplicateKeyError
+
+        now = datetime.utcnow()
+        try:
+            # Matches only a lapsed lease; when a live one exists the upsert collides on _id
+            await self.db.leases.update_one(
+                {"_id": name, "expires_at": {"$lt": now}},
+                {"$set": {"expires_at": now + timedelta(seconds=ttl)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def release(self, name):
+        await self.db.leases.delete_one({"_id": name})
+
+    async def close(self):
+        self.client.close()
+
+
+def mongo_client_options() -> dict:
+    """Connection pool, timeout and compression settings for the Mongo client"""
+    options = {
+        "maxPoolSize": int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+        "minPoolSize": int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+        "maxIdleTimeMS": int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '0')) or None,
+        "waitQueueTimeoutMS": int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '0')) or None,
+        "connectTimeoutMS": int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '20000')),
+        "socketTimeoutMS": int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '0')) or None,
+        "serverSelectionTimeoutMS": int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '30000')),
+    }
+    # e.g. "zstd,snappy,zlib"; zstd and snappy need their optional packages installed
+    compressors = os.environ.get('MONGO_COMPRESSORS', '')
+    if compressors:
+        options["compressors"] = compressors
+    return options
+
+
+def create_storage(status_retention: int = 7 * 86400, event_listeners=()) -> Storage:
+    """Build the backend named by STORAGE_BACKEND (`mongo` or `sqlite`)"""
+    backend = os.environ.get('STORAGE_BACKEND', 'mongo')
+    if backend == "sqlite":
+        from sqlite_storage import SQLiteStorage
+
+        path = os.environ.get('SQLITE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'throne.db'))
+        return SQLiteStorage(path, status_retention)
+    if backend == "mongo":
+        # `buckets` stores chat history as fixed-size per-session buckets, see chat_buckets.py
+        buckets = os.environ.get('CHAT_STORAGE_MODE', 'documents') == 'buckets'
+        return MongoStorage(
+            os.environ['MONGO_URL'],
+            os.environ['DB_NAME'],
+            status_retention,
+            event_listeners=event_listeners,
+            chat_bucket_size=int(os.environ.get('CHAT_BUCKET_SIZE', '100')) if buckets else None,
+            client_options=mongo_client_options(),
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
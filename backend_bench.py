@@ -0,0 +1,618 @@
+"""Offline load test for the Throne Companions API.
+
+Runs `server.app` in-process and drives it with concurrent async clients, so
+results do not depend on network conditions. The database is either a local
+mongod (`--mongo-url mongodb://...`), an in-memory stand-in (the default,
+`--mongo-url memory`, needs `mongomock-motor`) or the embedded SQLite backend
+(`--storage sqlite`). Clients use httpx's ASGI transport.
+
+    python backend_bench.py --duration 10 --concurrency 16
+    python backend_bench.py --mongo-url mongodb://localhost:27017 --rate 200
+    python backend_bench.py --baseline bench_results/previous.json
+    python backend_bench.py --scenario serialisation --messages 200
+    python backend_bench.py --storage sqlite --routes chat history
+    python backend_bench.py --scenario storage --mongo-url mongodb://localhost:27017
+    python backend_bench.py --scenario search --history-sizes 1000 10000 100000
+    python backend_bench.py --scenario bulk --storage sqlite --bulk-lines 2000000
+    python backend_bench.py --scenario startup --mongo-url mongodb://localhost:27017 --startup-runs 5
+
+Results are printed per route (requests/sec, p50/p95/p99 latency) and saved
+as JSON so runs can be compared between commits.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+ROUTES = ["companions", "chat", "history"]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def load_app(mongo_url, db_name, storage_backend="mongo"):
+    """Import the server against the chosen database"""
+    os.environ["STORAGE_BACKEND"] = storage_backend
+    if storage_backend == "sqlite":
+        # The startup scenario points every child process at one file, so later starts are warm
+        os.environ["SQLITE_PATH"] = os.environ.get("BENCH_SQLITE_PATH") or os.path.join(
+            tempfile.mkdtemp(prefix="throne-bench-"), "bench.db"
+        )
+    if mongo_url == "memory":
+        from mongomock_motor import AsyncMongoMockClient
+        import motor.motor_asyncio
+        # server.py builds its client at import time, so swap the class it will use
+        motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+        mongo_url = "mongodb://localhost:27017"
+    os.environ["MONGO_URL"] = mongo_url
+    os.environ["DB_NAME"] = db_name
+    # A handful of bench sessions on one client address would just measure the rate limiter
+    for route in ("CHAT", "CHAT_STREAM", "CHAT_WS", "CHAT_SEARCH"):
+        os.environ.setdefault(f"RATE_LIMIT_{route}", "0,0")
+        os.environ.setdefault(f"IP_RATE_LIMIT_{route}", "0,0")
+    sys.path.insert(0, str(ROOT_DIR / "backend"))
+    import server
+    return server
+
+
+class RouteStats:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+
+    def record(self, latency, status):
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def summary(self, duration):
+        latencies = sorted(self.latencies)
+        ok = sum(count for status, count in self.statuses.items() if 200 <= status < 300)
+        return {
+            "requests": len(latencies),
+            "ok": ok,
+            "errors": self.errors + len(latencies) - ok,
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+            "rps": len(latencies) / duration if duration else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+        }
+
+
+class LoadTest:
+    def __init__(self, http, companion_ids, sessions):
+        self.http = http
+        self.companion_ids = companion_ids
+        self.sessions = [f"bench_{uuid.uuid4().hex[:8]}" for _ in range(sessions)]
+        self.stats = {route: RouteStats() for route in ROUTES}
+
+    def request_for(self, route):
+        companion_id = random.choice(self.companion_ids)
+        session_id = random.choice(self.sessions)
+        if route == "companions":
+            return "GET", "/api/companions", None, None
+        if route == "chat":
+            body = {"companion_id": companion_id, "session_id": session_id, "message": "Hello there, how are you?"}
+            return "POST", "/api/chat", body, None
+        return "GET", f"/api/chat/{companion_id}", None, {"session_id": session_id}
+
+    async def worker(self, route, deadline, interval):
+        stats = self.stats[route]
+        next_at = time.perf_counter()
+        while True:
+            if interval:
+                # Open-loop pacing: fire on schedule, regardless of how long the last call took
+                next_at += interval
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if time.perf_counter() >= deadline:
+                return
+            method, path, body, params = self.request_for(route)
+            started = time.perf_counter()
+            try:
+                response = await self.http.request(method, path, json=body, params=params)
+            except Exception:
+                stats.errors += 1
+                continue
+            stats.record(time.perf_counter() - started, response.status_code)
+            # In-process calls to cached routes never suspend; let the other workers run
+            await asyncio.sleep(0)
+
+    async def run(self, routes, duration, concurrency, rate):
+        deadline = time.perf_counter() + duration
+        # `rate` is the target requests/sec per route, spread across its workers
+        interval = concurrency / rate if rate else 0.0
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            self.worker(route, deadline, interval) for route in routes for _ in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+        return {route: self.stats[route].summary(elapsed) for route in routes}
+
+
+async def run_load_test(server, args):
+    import httpx
+
+    await server.app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30) as http:
+            companions = (await http.get("/api/companions")).json()
+            load_test = LoadTest(http, [c["id"] for c in companions], args.sessions)
+            if args.warmup:
+                await load_test.run(args.routes, args.warmup, args.concurrency, args.rate)
+                load_test.stats = {route: RouteStats() for route in ROUTES}
+            return await load_test.run(args.routes, args.duration, args.concurrency, args.rate)
+    finally:
+        await server.app.router.shutdown()
+
+
+def synthetic_history(server, count, companion_id="bench-companion", session_id="bench-session"):
+    """Stored chat documents shaped like what the history query returns"""
+    from bson import ObjectId
+
+    started = datetime.utcnow()
+    messages = []
+    for i in range(count):
+        message = server.ChatMessage(
+            companion_id=companion_id,
+            session_id=session_id,
+            message=f"Synthetic message {i} " + "lorem ipsum " * 10,
+            is_user=i % 2 == 0,
+        ).dict()
+        # Mongo stores datetimes with millisecond precision
+        message["timestamp"] = (started - timedelta(seconds=count - i)).replace(microsecond=(i % 1000) * 1000)
+        message["_id"] = ObjectId()
+        messages.append(message)
+    return messages
+
+
+async def run_serialisation_bench(server, args):
+    """Time building one history page response, standard path vs fast path"""
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+
+    route = next(r for r in server.app.routes if getattr(r, "path", None) == "/api/chat/{companion_id}")
+    page = list(reversed(synthetic_history(server, args.messages)))
+
+    async def standard():
+        # What FastAPI does with the model: validate against response_model, encode, dump
+        server.FAST_RESPONSES = False
+        content = await serialize_response(
+            field=route.response_field, response_content=server.history_page_response(page, True, None, None)
+        )
+        return JSONResponse(content).body
+
+    async def fast():
+        server.FAST_RESPONSES = True
+        return server.history_page_response(page, True, None, None).body
+
+    assert json.loads(await standard()) == json.loads(await fast()), "fast path changed the response shape"
+
+    results = {}
+    for name, build in (("history_page_standard", standard), ("history_page_fast", fast)):
+        stats = RouteStats()
+        deadline = time.perf_counter() + args.duration
+        started = time.perf_counter()
+        while time.perf_counter() < deadline:
+            call_started = time.perf_counter()
+            await build()
+            stats.record(time.perf_counter() - call_started, 200)
+        results[name] = stats.summary(time.perf_counter() - started)
+    speedup = results["history_page_standard"]["p50_ms"] / results["history_page_fast"]["p50_ms"]
+    print(f"\n⚡ Fast path builds a {args.messages}-message page {speedup:.1f}x faster (p50)")
+    return results
+
+
+async def time_operation(stats, operation, deadline):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await operation()
+        stats.record(time.perf_counter() - started, 200)
+
+
+async def run_storage_bench(server, args):
+    """Time the hot store operations on Mongo (per-message and bucketed history) and embedded SQLite"""
+    import storage
+    from sqlite_storage import SQLiteStorage
+
+    backends = {
+        "mongo": lambda: storage.MongoStorage(os.environ["MONGO_URL"], args.db_name, server.STATUS_CHECK_RETENTION),
+        "mongo-buckets": lambda: storage.MongoStorage(
+            os.environ["MONGO_URL"], f"{args.db_name}_buckets", server.STATUS_CHECK_RETENTION, chat_bucket_size=100
+        ),
+        "sqlite": lambda: SQLiteStorage(
+            os.path.join(tempfile.mkdtemp(prefix="throne-bench-"), "bench.db"), server.STATUS_CHECK_RETENTION
+        ),
+    }
+    results = {}
+    for name, make in backends.items():
+        store = make()
+        await store.init()
+        try:
+            companion = server.Companion(
+                name="Bench", short_bio="", long_backstory="", traits=[], avatar_path=""
+            ).dict()
+            await store.companions.insert(companion)
+            history = synthetic_history(server, args.messages, companion_id=companion["id"])
+            for message in history:
+                message.pop("_id")
+            await store.chats.insert_many(history)
+            await store.chats.record_turn(history)
+
+            async def insert_turn():
+                turn = [server.ChatMessage(companion_id=companion["id"], session_id="bench-session",
+                                           message="Hello", is_user=is_user).dict() for is_user in (True, False)]
+                await asyncio.gather(store.chats.insert_many(turn), store.chats.record_turn(turn))
+
+            operations = {
+                "companion_get": lambda: store.companions.get(companion["id"]),
+                "history_page": lambda: store.chats.history(companion["id"], "bench-session", 50),
+                "state_load": lambda: store.chats.load_state(companion["id"], "bench-session"),
+                "chat_turn_write": insert_turn,
+            }
+            for operation_name, operation in operations.items():
+                stats = RouteStats()
+                started = time.perf_counter()
+                await time_operation(stats, operation, started + args.duration / len(operations))
+                results[f"{name}:{operation_name}"] = stats.summary(time.perf_counter() - started)
+        finally:
+            await store.close()
+    return results
+
+
+SEARCH_VOCABULARY = [
+    "hiking", "music", "philosophy", "garden", "coffee", "travel", "dream", "ocean", "stars", "poetry",
+    "work", "family", "weekend", "book", "movie", "rain", "memory", "future", "friend", "question",
+]
+
+
+def synthetic_search_history(server, count, companion_id, session_id):
+    rng = random.Random(count)
+    started = datetime.utcnow() - timedelta(seconds=count)
+    return [
+        server.ChatMessage(
+            companion_id=companion_id,
+            session_id=session_id,
+            message=" ".join(rng.choice(SEARCH_VOCABULARY) for _ in range(12)) + (" zephyr" if i % 500 == 0 else ""),
+            is_user=i % 2 == 0,
+            timestamp=started + timedelta(seconds=i),
+        ).dict()
+        for i in range(count)
+    ]
+
+
+async def run_search_bench(server, args):
+    """Search latency as one session's history grows, indexed search vs scanning the history"""
+    import storage
+    from sqlite_storage import SQLiteStorage
+
+    backends = {
+        "sqlite": lambda: SQLiteStorage(
+            os.path.join(tempfile.mkdtemp(prefix="throne-bench-"), "bench.db"), server.STATUS_CHECK_RETENTION
+        ),
+    }
+    if args.mongo_url != "memory":  # the in-memory stand-in has no text search
+        backends["mongo"] = lambda: storage.MongoStorage(
+            os.environ["MONGO_URL"], args.db_name, server.STATUS_CHECK_RETENTION
+        )
+
+    results = {}
+    for name, make in backends.items():
+        store = make()
+        await store.init()
+        try:
+            for size in args.history_sizes:
+                session_id = f"search-{size}"
+                history = synthetic_search_history(server, size, "bench-companion", session_id)
+                for start in range(0, size, 5000):
+                    await store.chats.insert_many(history[start:start + 5000])
+
+                async def rare():
+                    return await store.chats.search("bench-companion", session_id, ["zephyr"], 20)
+
+                async def common():
+                    return await store.chats.search("bench-companion", session_id, ["hiking", "ocean"], 20)
+
+                async def scan():
+                    # What a client without search does: fetch everything, filter locally
+                    messages = await store.chats.history("bench-companion", session_id, size)
+                    return [m for m in messages if "zephyr" in m["message"]]
+
+                operations = {"search_rare": rare, "search_common": common}
+                if name == "sqlite":
+                    operations["scan_rare"] = scan
+                for operation_name, operation in operations.items():
+                    stats = RouteStats()
+                    started = time.perf_counter()
+                    await time_operation(stats, operation, started + args.duration / len(operations))
+                    results[f"{name}:{operation_name}:{size}"] = stats.summary(time.perf_counter() - started)
+        finally:
+            await store.close()
+    return results
+
+
+def rss_mb():
+    """Current resident set size; falls back to the peak where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def call_asgi(app, method, path, query_string=b"", body=None, on_chunk=None):
+    """Drive the app without a client, streaming the request body in and the response body out.
+
+    httpx's ASGI transport buffers whole responses, which would hide what an export holds in memory.
+    """
+    status = None
+    body = body.__aiter__() if body is not None else None
+
+    body_done = body is None
+
+    async def receive():
+        nonlocal body_done
+        if body_done:
+            # Nothing more to send; the client stays connected until the response ends
+            await asyncio.Event().wait()
+        try:
+            return {"type": "http.request", "body": await body.__anext__(), "more_body": True}
+        except StopAsyncIteration:
+            body_done = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and on_chunk:
+            on_chunk(message.get("body", b""))
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": query_string, "root_path": "",
+        "headers": [(b"content-type", b"application/x-ndjson")], "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+    await app(scope, receive, send)
+    return status
+
+
+class MemoryTrace:
+    """RSS at fixed fractions of a run, to show whether memory tracks the line count"""
+
+    def __init__(self, total):
+        self.total = total
+        self.samples = {}
+
+    def sample(self, done):
+        for pct in (10, 25, 50, 75, 100):
+            if pct not in self.samples and done >= self.total * pct / 100:
+                self.samples[pct] = round(rss_mb(), 1)
+
+
+async def run_bulk_bench(server, args):
+    """Import and export a multi-million-line NDJSON file through the bulk endpoints, tracking memory"""
+    if server.storage.name == "mongo" and args.mongo_url == "memory":
+        raise SystemExit("The in-memory Mongo stand-in keeps every document in RAM; "
+                         "use --storage sqlite or a real --mongo-url")
+
+    await server.app.router.startup()
+    try:
+        companion = server.Companion(name="Bulk", short_bio="", long_backstory="", traits=[], avatar_path="").dict()
+        await server.storage.companions.insert(companion)
+        started_at = datetime.utcnow() - timedelta(seconds=args.bulk_lines)
+        lines_per_chunk = 500
+        results = {}
+
+        import_stats, import_memory = RouteStats(), MemoryTrace(args.bulk_lines)
+
+        async def ndjson_body():
+            # Generated as it is sent, so the file itself never sits in memory
+            last = time.perf_counter()
+            for start in range(0, args.bulk_lines, lines_per_chunk):
+                lines = []
+                for i in range(start, min(start + lines_per_chunk, args.bulk_lines)):
+                    timestamp = (started_at + timedelta(seconds=i)).isoformat()
+                    # Two turns per session, so distinct sessions grow with the file as real exports do
+                    lines.append(
+                        f'{{"id": "bulk-{i}", "companion_id": "{companion["id"]}", "session_id": "s{i // 4}", '
+                        f'"message": "Imported message {i} about hiking and the ocean", '
+                        f'"is_user": {"true" if i % 2 == 0 else "false"}, "timestamp": "{timestamp}"}}'
+                    )
+                yield ("\n".join(lines) + "\n").encode()
+                now = time.perf_counter()
+                import_stats.record(now - last, 200)
+                last = now
+                import_memory.sample(start + len(lines))
+
+        before = rss_mb()
+        started = time.perf_counter()
+        report = []
+        status = await call_asgi(server.app, "POST", "/api/chat/bulk", body=ndjson_body(), on_chunk=report.append)
+        elapsed = time.perf_counter() - started
+        summary = json.loads(b"".join(report))
+        assert status == 200 and summary["inserted"] == args.bulk_lines, summary
+        results["chat_import"] = {
+            **import_stats.summary(elapsed), "requests": args.bulk_lines, "rps": args.bulk_lines / elapsed,
+            "rss_mb": {"before": round(before, 1), **{f"{pct}%": mb for pct, mb in import_memory.samples.items()}},
+        }
+
+        export_stats, export_memory = RouteStats(), MemoryTrace(args.bulk_lines)
+        exported = 0
+        last = time.perf_counter()
+
+        def on_chunk(chunk):
+            nonlocal exported, last
+            exported += chunk.count(b"\n")
+            now = time.perf_counter()
+            export_stats.record(now - last, 200)
+            last = now
+            export_memory.sample(exported)
+
+        before = rss_mb()
+        started = time.perf_counter()
+        status = await call_asgi(server.app, "GET", "/api/chat/bulk",
+                                 query_string=f"companion_id={companion['id']}".encode(), on_chunk=on_chunk)
+        elapsed = time.perf_counter() - started
+        assert status == 200 and exported == args.bulk_lines, (status, exported)
+        results["chat_export"] = {
+            **export_stats.summary(elapsed), "requests": exported, "rps": exported / elapsed,
+            "rss_mb": {"before": round(before, 1), **{f"{pct}%": mb for pct, mb in export_memory.samples.items()}},
+        }
+    finally:
+        await server.app.router.shutdown()
+
+    for name, result in results.items():
+        memory = ", ".join(f"{point} {mb} MB" for point, mb in result["rss_mb"].items())
+        print(f"\n🧠 {name}: {result['requests']} lines, RSS {memory}")
+    return results
+
+
+async def startup_child(args):
+    """One process start: import the server, run startup until storage is ready, report the timings"""
+    started = time.perf_counter()
+    server = load_app(args.mongo_url, args.db_name, args.storage)
+    imported = time.perf_counter()
+    await server.app.router.startup()
+    ready = time.perf_counter()
+    if not server.startup_state.ready:
+        raise SystemExit(f"storage not ready: {server.startup_state.error}")
+    await server.app.router.shutdown()
+    print(json.dumps({"import": imported - started, "startup": ready - imported, "total": ready - started}))
+
+
+async def run_startup_bench(server, args):
+    """Process start to ready, in child processes: the first against an empty database, then warm restarts"""
+    env = dict(os.environ, BENCH_SQLITE_PATH=os.path.join(tempfile.mkdtemp(prefix="throne-bench-"), "bench.db"))
+    command = [sys.executable, __file__, "--startup-child", "--mongo-url", args.mongo_url,
+               "--storage", args.storage, "--db-name", f"{args.db_name}_startup"]
+    # The in-memory stand-in starts empty in every process, so there is no warm start to measure
+    always_cold = args.mongo_url == "memory" and args.storage == "mongo"
+    stats = {f"{kind}_{phase}": RouteStats() for kind in ("cold", "warm") for phase in ("import", "startup", "total")}
+    for run in range(args.startup_runs):
+        started = time.perf_counter()
+        child = await asyncio.create_subprocess_exec(
+            *command, env=env, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+        stdout, _ = await child.communicate()
+        if child.returncode != 0:
+            raise SystemExit(f"startup child failed with exit code {child.returncode}")
+        timings = json.loads(stdout.decode().strip().splitlines()[-1])
+        kind = "cold" if run == 0 or always_cold else "warm"
+        for phase in ("import", "startup", "total"):
+            stats[f"{kind}_{phase}"].record(timings[phase], 200)
+        print(f"  start {run + 1}: import {timings['import'] * 1000:.0f} ms, "
+              f"startup {timings['startup'] * 1000:.0f} ms, process {(time.perf_counter() - started) * 1000:.0f} ms")
+    return {name: stat.summary(0) for name, stat in stats.items() if stat.latencies}
+
+
+SCENARIOS = {
+    "load": run_load_test,
+    "serialisation": run_serialisation_bench,
+    "storage": run_storage_bench,
+    "search": run_search_bench,
+    "bulk": run_bulk_bench,
+    "startup": run_startup_bench,
+}
+
+
+def print_results(results, baseline=None):
+    width = max(12, *(len(route) for route in results))
+    print(f"\n{'route':<{width}} {'reqs':>8} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    print("-" * (width + 54))
+    for route, r in results.items():
+        print(f"{route:<{width}} {r['requests']:>8} {r['errors']:>7} {r['rps']:>9.1f} "
+              f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+        if baseline and route in baseline:
+            b = baseline[route]
+            deltas = [
+                f"{key} {(r[key] - b[key]) / b[key] * 100:+.1f}%"
+                for key in ("rps", "p50_ms", "p95_ms", "p99_ms") if b.get(key)
+            ]
+            print(f"{'':<{width}} vs baseline: {', '.join(deltas)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=SCENARIOS, default="load",
+                        help="load: concurrent HTTP clients; serialisation: history page encoding, standard vs fast; "
+                             "storage: store operation latency, Mongo vs Mongo buckets vs SQLite; "
+                             "search: history search latency by history size; "
+                             "bulk: NDJSON chat import and export, lines/sec and memory; "
+                             "startup: process start to ready, cold and warm")
+    parser.add_argument("--mongo-url", default="memory", help="MongoDB URL, or 'memory' for an in-memory stand-in")
+    parser.add_argument("--storage", choices=["mongo", "sqlite"], default="mongo",
+                        help="Storage backend the server runs on for the load scenario")
+    parser.add_argument("--db-name", default=f"bench_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--routes", nargs="+", choices=ROUTES, default=ROUTES)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to measure")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Seconds to run before measuring")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients per route")
+    parser.add_argument("--rate", type=float, default=0.0, help="Target requests/sec per route (0 = as fast as possible)")
+    parser.add_argument("--sessions", type=int, default=50, help="Distinct chat sessions to spread load over")
+    parser.add_argument("--messages", type=int, default=200, help="Messages per page for the serialisation scenario")
+    parser.add_argument("--history-sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Session history sizes for the search scenario")
+    parser.add_argument("--bulk-lines", type=int, default=2_000_000, help="NDJSON lines for the bulk scenario")
+    parser.add_argument("--startup-runs", type=int, default=5, help="Process starts for the startup scenario")
+    parser.add_argument("--startup-child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="Where to save JSON results (default: bench_results/<commit>-<time>.json)")
+    parser.add_argument("--baseline", help="Previous JSON results to compare against")
+    args = parser.parse_args()
+    if args.startup_child:
+        asyncio.run(startup_child(args))
+        return 0
+
+    server = load_app(args.mongo_url, args.db_name, args.storage)
+    results = asyncio.run(SCENARIOS[args.scenario](server, args))
+
+    baseline = None
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())["routes"]
+    print_results(results, baseline)
+
+    commit = git_commit()
+    output = Path(args.output) if args.output else (
+        ROOT_DIR / "bench_results" / f"{commit}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "commit": commit,
+        "timestamp": datetime.utcnow().isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "routes": results,
+    }, indent=2))
+    print(f"\n📁 Results saved to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
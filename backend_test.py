@@ -2,6 +2,7 @@ import requests
 import sys
 from datetime import datetime
 import json
+import time
 import uuid
 
 class ThroneCompanionsAPITester:
@@ -84,6 +85,13 @@ class ThroneCompanionsAPITester:
         }
         return self.run_test("Create Status Check", "POST", "status", 200, test_data)
 
+    def test_status_rollups(self):
+        """Test reading pre-aggregated status check counts"""
+        success, data = self.run_test("Get Status Rollups", "GET", "status/rollups", 200, params={"granularity": "minute"})
+        if success and isinstance(data, list):
+            print(f"   Found {len(data)} minute buckets")
+        return success, data
+
     def test_get_companions(self):
         """Test getting all companions"""
         success, data = self.run_test("Get All Companions", "GET", "companions", 200)
@@ -140,6 +148,47 @@ class ThroneCompanionsAPITester:
         }
         return self.run_test("Send Chat Message", "POST", "chat", 200, chat_data)
 
+    def test_chat_stream(self):
+        """Test streaming a chat reply over Server-Sent Events"""
+        if not self.created_companion_id:
+            print("❌ Skipping - No companion ID available")
+            return False, {}
+        
+        url = f"{self.api_url}/chat/stream"
+        chat_data = {
+            "companion_id": self.created_companion_id,
+            "message": "Hello! This is a streaming test message.",
+            "session_id": self.session_id
+        }
+        self.tests_run += 1
+        print(f"\n🔍 Testing Stream Chat Message...")
+        print(f"   URL: {url}")
+        
+        try:
+            started = time.perf_counter()
+            first_chunk_at = None
+            events = []
+            with requests.post(url, json=chat_data, stream=True, timeout=15) as response:
+                print(f"   Response Status: {response.status_code}")
+                if response.status_code != 200:
+                    print(f"❌ Failed - Expected 200, got {response.status_code}")
+                    return False, {}
+                for line in response.iter_lines(decode_unicode=True):
+                    if line.startswith("event: "):
+                        events.append(line[len("event: "):])
+                        if first_chunk_at is None:
+                            first_chunk_at = time.perf_counter() - started
+            
+            if events and events[-1] == "done" and "chunk" in events:
+                self.tests_passed += 1
+                print(f"✅ Passed - {events.count('chunk')} chunks, first after {first_chunk_at * 1000:.0f}ms")
+                return True, events
+            print(f"❌ Failed - Unexpected event sequence: {events}")
+            return False, events
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False, {}
+
     def test_get_chat_history(self):
         """Test getting chat history for a companion"""
         if not self.created_companion_id:
@@ -148,8 +197,60 @@ class ThroneCompanionsAPITester:
         
         params = {"session_id": self.session_id}
         success, data = self.run_test("Get Chat History", "GET", f"chat/{self.created_companion_id}", 200, params=params)
-        if success and isinstance(data, list):
-            print(f"   Found {len(data)} messages in chat history")
+        if success and isinstance(data, dict):
+            print(f"   Found {len(data.get('messages', []))} messages in chat history (has_more: {data.get('has_more')})")
+        return success, data
+
+    def test_chat_history_pagination(self):
+        """Test paging through chat history with cursors"""
+        if not self.created_companion_id:
+            print("❌ Skipping - No companion ID available")
+            return False, {}
+        
+        params = {"session_id": self.session_id, "limit": 1}
+        success, first_page = self.run_test("Get Chat History Page", "GET", f"chat/{self.created_companion_id}", 200, params=params)
+        if not success or not first_page.get('before_cursor'):
+            return success, first_page
+        
+        params["before"] = first_page['before_cursor']
+        success, older_page = self.run_test("Get Older Chat History Page", "GET", f"chat/{self.created_companion_id}", 200, params=params)
+        if success:
+            newest_ids = {m.get('id') for m in first_page.get('messages', [])}
+            overlap = [m for m in older_page.get('messages', []) if m.get('id') in newest_ids]
+            if overlap:
+                print(f"❌ Pages overlap on {len(overlap)} message(s)")
+                return False, older_page
+        return success, older_page
+
+    def test_chat_bootstrap(self):
+        """Test loading the companion and its newest history page in one request"""
+        if not self.created_companion_id:
+            print("❌ Skipping - No companion ID available")
+            return False, {}
+        
+        params = {"session_id": self.session_id}
+        success, data = self.run_test("Bootstrap Chat", "GET", f"chat/{self.created_companion_id}/bootstrap", 200, params=params)
+        if success and isinstance(data, dict):
+            print(f"   {data.get('companion', {}).get('name')} with {len(data.get('history', {}).get('messages', []))} messages")
+        return success, data
+
+    def test_companion_analytics(self):
+        """Test per-companion totals and daily rollups"""
+        success, data = self.run_test("Companion Analytics", "GET", "analytics/companions", 200)
+        if not success or not self.created_companion_id:
+            return success, data
+        
+        success, data = self.run_test("Companion Analytics Detail", "GET", f"analytics/companions/{self.created_companion_id}", 200)
+        if success and isinstance(data, dict):
+            print(f"   {data.get('message_count')} messages in {data.get('session_count')} sessions over {len(data.get('daily', []))} days")
+        return success, data
+
+    def test_cache_stats(self):
+        """Test the in-process cache counters"""
+        success, data = self.run_test("Get Cache Stats", "GET", "cache/stats", 200)
+        if success and isinstance(data, dict):
+            stats = data.get('companions', {})
+            print(f"   Companion cache: {stats.get('hits')} hits / {stats.get('misses')} misses")
         return success, data
 
     def test_delete_companion(self):
@@ -158,7 +259,21 @@ class ThroneCompanionsAPITester:
             print("❌ Skipping - No companion ID available")
             return False, {}
         
-        return self.run_test("Delete Companion", "DELETE", f"companions/{self.created_companion_id}", 200)
+        success, data = self.run_test("Delete Companion", "DELETE", f"companions/{self.created_companion_id}", 202)
+        if not success:
+            return False, {}
+        
+        # Chat history is removed by a background job; wait for its first sweep. The final
+        # sweep only follows the grace period (COMPANION_DELETE_GRACE_SECONDS)
+        done = ('swept', 'completed')
+        job = {}
+        for _ in range(20):
+            success, job = self.run_test("Get Deletion Job", "GET", f"jobs/{data.get('job_id')}", 200)
+            if not success or job.get('status') in done:
+                break
+            time.sleep(0.5)
+        print(f"   Deletion job: {job.get('status')}, {job.get('deleted_messages')} messages removed")
+        return success and job.get('status') in done, job
 
     def test_seeded_companions(self):
         """Test that seeded companions exist and are accessible"""
@@ -207,6 +322,7 @@ def main():
     tester.test_root_endpoint()
     tester.test_status_get()
     tester.test_status_post()
+    tester.test_status_rollups()
     
     # Test companion functionality
     print("\n👥 COMPANION API TESTS")
@@ -220,7 +336,12 @@ def main():
     print("\n💬 CHAT API TESTS")
     print("-" * 30)
     tester.test_chat_with_companion()
+    tester.test_chat_stream()
     tester.test_get_chat_history()
+    tester.test_chat_history_pagination()
+    tester.test_chat_bootstrap()
+    tester.test_companion_analytics()
+    tester.test_cache_stats()
     
     # Cleanup - delete test companion
     print("\n🧹 CLEANUP TESTS")
@@ -1,10 +1,11 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import "./App.css";
 import { BrowserRouter, Routes, Route, useNavigate, useParams, Link } from "react-router-dom";
 import axios from "axios";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+const WS_API = `${BACKEND_URL.replace(/^http/, 'ws')}/api`;
 
 // Generate a session ID for guest users
 const getGuestSessionId = () => {
@@ -302,18 +303,24 @@ const ChatPage = () => {
   const [loading, setLoading] = useState(true);
   const [sending, setSending] = useState(false);
   const [typing, setTyping] = useState(false);
+  const [olderCursor, setOlderCursor] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
+  const socketRef = useRef(null);
+  // The user message shown before the socket confirms it, withdrawn if the server refuses it
+  const pendingRef = useRef(null);
   const sessionId = getGuestSessionId();
 
   useEffect(() => {
     const fetchCompanionAndMessages = async () => {
       try {
-        // Fetch companion details
-        const companionResponse = await axios.get(`${API}/companions/${id}`);
-        setCompanion(companionResponse.data);
-
-        // Fetch chat history
-        const messagesResponse = await axios.get(`${API}/chat/${id}?session_id=${sessionId}`);
-        setMessages(messagesResponse.data);
+        // Companion details and the most recent page of chat history (newest first) in one round trip
+        const response = await axios.get(`${API}/chat/${id}/bootstrap`, {
+          params: { session_id: sessionId }
+        });
+        const { companion, history } = response.data;
+        setCompanion(companion);
+        setMessages([...history.messages].reverse());
+        setOlderCursor(history.has_more ? history.before_cursor : null);
       } catch (error) {
         console.error('Error fetching data:', error);
       } finally {
@@ -324,12 +331,81 @@ const ChatPage = () => {
     fetchCompanionAndMessages();
   }, [id, sessionId]);
 
+  // One persistent channel per chat page; sendMessage falls back to HTTP while it is down
+  useEffect(() => {
+    const socket = new WebSocket(`${WS_API}/ws/chat/${id}?session_id=${encodeURIComponent(sessionId)}`);
+
+    socket.onmessage = (event) => {
+      const data = JSON.parse(event.data);
+      const pending = pendingRef.current;
+      pendingRef.current = null;
+      if (data.type === 'reply') {
+        setMessages(prev => [...prev, data.message]);
+      } else {
+        console.error('Error sending message:', data.detail);
+        // As with the HTTP path, nothing stays in the list and the text goes back in the input
+        if (pending) {
+          setMessages(prev => prev.filter(message => message !== pending));
+          setNewMessage(current => current || pending.message);
+        }
+      }
+      setSending(false);
+      setTyping(false);
+    };
+    socket.onclose = () => {
+      if (socketRef.current === socket) {
+        socketRef.current = null;
+        // A reply still owed on this socket will never arrive
+        setSending(false);
+        setTyping(false);
+      }
+    };
+    socketRef.current = socket;
+
+    return () => {
+      socketRef.current = null;
+      socket.close();
+    };
+  }, [id, sessionId]);
+
+  const loadOlderMessages = async () => {
+    if (!olderCursor || loadingOlder) return;
+
+    setLoadingOlder(true);
+    try {
+      const response = await axios.get(`${API}/chat/${id}`, {
+        params: { session_id: sessionId, before: olderCursor }
+      });
+      setMessages(prev => [...[...response.data.messages].reverse(), ...prev]);
+      setOlderCursor(response.data.has_more ? response.data.before_cursor : null);
+    } catch (error) {
+      console.error('Error loading older messages:', error);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   const sendMessage = async () => {
     if (!newMessage.trim() || sending) return;
 
     setSending(true);
     setTyping(true);
 
+    const socket = socketRef.current;
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      const userMessage = {
+        id: Date.now().toString(),
+        message: newMessage,
+        is_user: true,
+        timestamp: new Date().toISOString()
+      };
+      pendingRef.current = userMessage;
+      setMessages(prev => [...prev, userMessage]);
+      socket.send(JSON.stringify({ message: newMessage }));
+      setNewMessage('');
+      return;
+    }
+
     try {
       const response = await axios.post(`${API}/chat`, {
         companion_id: id,
@@ -407,6 +483,17 @@ const ChatPage = () => {
       {/* Messages */}
       <div className="flex-1 overflow-y-auto px-6 py-4">
         <div className="max-w-4xl mx-auto space-y-4">
+          {olderCursor && (
+            <div className="flex justify-center">
+              <button
+                onClick={loadOlderMessages}
+                disabled={loadingOlder}
+                className="text-sm text-purple-400 hover:text-purple-300 disabled:opacity-50"
+              >
+                {loadingOlder ? 'Loading...' : 'Load earlier messages'}
+              </button>
+            </div>
+          )}
           {messages.map((message, index) => (
             <div key={message.id || index} className={`flex ${message.is_user ? 'justify-end' : 'justify-start'}`}>
               <div className={`max-w-xs lg:max-w-md px-4 py-2 rounded-lg ${
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from admission import LoadShedder, LoadSheddingMiddleware, RateLimiter, TokenBucketLimiter
+from metrics import MetricsRegistry
+
+
+def test_token_bucket_allows_a_burst_then_refills():
+    limiter = TokenBucketLimiter(rate=2, burst=3)
+
+    assert [limiter.acquire("s1", now=0) for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire("s1", now=0) == 0.5
+    assert limiter.acquire("s2", now=0) == 0
+    assert limiter.acquire("s1", now=0.5) == 0
+    # Idle time refills only up to the burst
+    assert [limiter.acquire("s1", now=100) for _ in range(4)][-1] == 0.5
+
+
+def test_token_bucket_drops_least_recently_used_keys():
+    limiter = TokenBucketLimiter(rate=1, burst=1, max_keys=2)
+    for key in ("a", "b", "a", "c"):
+        limiter.acquire(key, now=0)
+
+    assert len(limiter) == 2
+    # "b" was forgotten, so it starts again with a full bucket
+    assert limiter.acquire("b", now=0) == 0
+    assert limiter.acquire("c", now=0) > 0
+
+
+def test_rate_limiter_checks_session_then_ip():
+    limiter = RateLimiter(session_rate=1, session_burst=1, ip_rate=1, ip_burst=2)
+
+    assert limiter.check("s1", "10.0.0.1") == (None, 0)
+    assert limiter.check("s1", "10.0.0.1")[0] == "session"
+    assert limiter.check("s2", "10.0.0.1") == (None, 0)
+    assert limiter.check("s3", "10.0.0.1")[0] == "ip"
+    assert limiter.check("s4", None) == (None, 0)
+
+
+def test_shed_fraction_follows_recent_latency():
+    shedder = LoadShedder(latency_target=0.1, window=10, max_shed_fraction=0.9)
+    assert shedder.shed_fraction(now=0) == 0
+
+    shedder.observe(0.15, now=0)
+    assert shedder.shed_fraction(now=1) == pytest.approx(0.5)
+    shedder.observe(1.0, now=20)
+    assert shedder.shed_fraction(now=20) == 0.9
+    # No samples for a whole window: the average no longer describes the server
+    assert shedder.shed_fraction(now=31) == 0
+
+
+def test_middleware_refuses_requests_past_max_in_flight():
+    registry = MetricsRegistry()
+    shedder = LoadShedder(max_in_flight=1, latency_target=0)
+    release = asyncio.Event()
+    statuses = []
+
+    async def app(scope, receive, send):
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    middleware = LoadSheddingMiddleware(app, shedder, registry, exempt_paths=["/api/metrics"])
+
+    async def request(path):
+        async def send(message):
+            if message["type"] == "http.response.start":
+                statuses.append((path, message["status"]))
+        await middleware({"type": "http", "method": "GET", "path": path, "headers": []}, None, send)
+
+    async def run():
+        first = asyncio.create_task(request("/api/companions"))
+        await asyncio.sleep(0)
+        assert shedder.in_flight == 1
+        await request("/api/companions")
+        exempt = asyncio.create_task(request("/api/metrics"))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(first, exempt)
+
+    asyncio.run(run())
+    assert statuses == [("/api/companions", 503), ("/api/companions", 200), ("/api/metrics", 200)]
+    assert shedder.in_flight == 0
+    assert registry.counters["shed_requests"] == {(("reason", "in_flight"),): 1}
+
+
+def test_chat_is_rate_limited_before_the_companion_is_loaded(monkeypatch):
+    monkeypatch.setitem(server.rate_limiters, "chat", RateLimiter(0.001, 1, 0, 0))
+    loads = []
+
+    async def load_companion(companion_id):
+        loads.append(companion_id)
+        return None
+
+    monkeypatch.setattr(server, "load_companion", load_companion)
+    client = TestClient(server.app)
+    body = {"companion_id": "c1", "session_id": "s1", "message": "hi"}
+
+    assert client.post("/api/chat", json=body).status_code == 404
+    limited = client.post("/api/chat", json=body)
+    assert limited.status_code == 429
+    assert int(limited.headers["retry-after"]) > 0
+    assert client.post("/api/chat", json={**body, "session_id": "s2"}).status_code == 404
+    assert loads == ["c1", "c1"]
+    assert 'throne_rate_limited_requests_total{limit="session",route="chat"} 1' in server.metrics.render()
+
+
+def test_rate_limiter_key_counts_are_exported_as_metrics(monkeypatch):
+    limiter = RateLimiter(1, 10, 20, 200)
+    limiter.check("s1", "10.0.0.1")
+    limiter.check("s2", "10.0.0.1")
+    monkeypatch.setitem(server.rate_limiters, "chat_search", limiter)
+
+    body = TestClient(server.app).get("/api/metrics").text
+
+    assert "throne_rate_limiter_chat_search_sessions 2" in body
+    assert "throne_rate_limiter_chat_search_ips 1" in body
+    assert "# TYPE throne_rate_limiter_chat_sessions gauge" in body
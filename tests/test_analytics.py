@@ -0,0 +1,94 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+
+import server
+from sqlite_storage import SQLiteStorage
+
+
+def test_companion_analytics_endpoints(monkeypatch):
+    totals = [{
+        "companion_id": "c1",
+        "message_count": 4,
+        "user_message_count": 2,
+        "companion_message_count": 2,
+        "session_count": 1,
+        "first_message_at": datetime(2025, 1, 1, 12, 0, 0),
+        "last_message_at": datetime(2025, 1, 2, 9, 30, 0),
+    }]
+    windows = []
+
+    async def load_companion(companion_id):
+        return object() if companion_id in ("c1", "c2") else None
+
+    async def companions(limit):
+        return totals[:limit]
+
+    async def companion_totals(companion_id):
+        return totals[0] if companion_id == "c1" else None
+
+    async def daily(companion_id, since, until, limit):
+        windows.append((since, until))
+        return []
+
+    monkeypatch.setattr(server, "load_companion", load_companion)
+    monkeypatch.setattr(server.storage.analytics, "companions", companions)
+    monkeypatch.setattr(server.storage.analytics, "totals", companion_totals)
+    monkeypatch.setattr(server.storage.analytics, "daily", daily)
+    client = TestClient(server.app)
+
+    listings = {}
+    for fast in (False, True):
+        monkeypatch.setattr(server, "FAST_RESPONSES", fast)
+        listings[fast] = client.get("/api/analytics/companions").json()
+    assert listings[True] == listings[False] == jsonable_encoder(totals)
+
+    detail = client.get("/api/analytics/companions/c1", params={"until": "2025-02-01T00:00:00"}).json()
+    assert detail["message_count"] == 4 and detail["daily"] == []
+    # `until` is exclusive, so the window is the ANALYTICS_DEFAULT_DAYS days before it
+    assert windows[-1] == (datetime(2025, 2, 1) - timedelta(days=server.ANALYTICS_DEFAULT_DAYS), datetime(2025, 2, 1))
+    client.get("/api/analytics/companions/c1", params={"until": "2025-02-01T12:00:00"})
+    assert windows[-1][0] == datetime(2025, 2, 1) - timedelta(days=server.ANALYTICS_DEFAULT_DAYS - 1)
+    assert client.get("/api/analytics/companions/c2").json()["session_count"] == 0
+    assert client.get("/api/analytics/companions/missing").status_code == 404
+
+
+def test_imported_messages_are_added_to_live_analytics(tmp_path, monkeypatch):
+    store = SQLiteStorage(str(tmp_path / "analytics.db"), status_retention=86400, purge_interval=0)
+    asyncio.run(store.init())
+    monkeypatch.setattr(server, "storage", store)
+    monkeypatch.setattr(server, "BULK_BATCH_SIZE", 2)
+
+    async def load_companion(companion_id):
+        return object()
+
+    monkeypatch.setattr(server, "load_companion", load_companion)
+    start = datetime(2025, 1, 1, 12, 0, 0)
+
+    async def live_turns():
+        # Counted live; the rebuild the import used to run would have wiped these
+        for i in range(3):
+            turn = [
+                {"id": f"live-{i}-{n}", "companion_id": "c1", "session_id": "live", "message": "hi",
+                 "is_user": n == 0, "timestamp": start + timedelta(minutes=i, seconds=n)}
+                for n in range(2)
+            ]
+            await store.analytics.record(turn)
+
+    asyncio.run(live_turns())
+    lines = [
+        json.dumps({"id": f"m{i}", "companion_id": "c1", "session_id": f"s{i // 2}", "message": "hello",
+                    "is_user": i % 2 == 0, "timestamp": f"2025-01-02T12:00:0{i}"})
+        for i in range(5)
+    ]
+    client = TestClient(server.app)
+    assert client.post("/api/chat/bulk", content="\n".join([*lines, lines[0]]).encode()).json()["inserted"] == 5
+
+    totals = asyncio.run(store.analytics.totals("c1"))
+    asyncio.run(store.close())
+    assert totals["message_count"] == 11
+    assert totals["session_count"] == 4
+    assert totals["last_message_at"] == datetime(2025, 1, 2, 12, 0, 4)
@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+import server
+
+
+def stored_message(i, timestamp):
+    return {
+        "_id": ObjectId(),
+        "id": f"message-{i}",
+        "companion_id": "c1",
+        "session_id": "s1",
+        "message": f"héllo {i} \"quoted\"",
+        "is_user": i % 2 == 0,
+        "timestamp": timestamp,
+    }
+
+
+def test_bootstrap_returns_companion_and_history_in_both_paths(monkeypatch):
+    companion = server.Companion(id="c1", name="Ada", short_bio="", long_backstory="", traits=[], avatar_path="")
+    messages = [stored_message(i, datetime(2025, 1, 1, 12, 0, i)) for i in (2, 1, 0)]
+    calls = []
+
+    async def load_companion(companion_id):
+        calls.append(("companion", companion_id))
+        return companion if companion_id == "c1" else None
+
+    async def history(companion_id, session_id, limit, before=None, after=None):
+        calls.append(("history", limit))
+        return messages[:limit]
+
+    monkeypatch.setattr(server, "load_companion", load_companion)
+    monkeypatch.setattr(server.storage.chats, "history", history)
+    client = TestClient(server.app)
+
+    pages = {}
+    for fast in (False, True):
+        monkeypatch.setattr(server, "FAST_RESPONSES", fast)
+        pages[fast] = client.get("/api/chat/c1/bootstrap", params={"session_id": "s1", "limit": 2}).json()
+
+    assert pages[True] == pages[False]
+    assert pages[False]["companion"]["name"] == "Ada"
+    assert [m["id"] for m in pages[False]["history"]["messages"]] == ["message-2", "message-1"]
+    assert pages[False]["history"]["has_more"] is True
+    assert calls[:2] == [("companion", "c1"), ("history", 3)]
+    assert client.get("/api/chat/missing/bootstrap", params={"session_id": "s1"}).status_code == 404
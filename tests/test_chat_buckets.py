@@ -0,0 +1,182 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+import chat_buckets  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+START = datetime(2025, 1, 1, 12, 0, 0)
+
+
+def message(i, session_id="s1"):
+    return {
+        "id": f"m{i}",
+        "companion_id": "c1",
+        "session_id": session_id,
+        "message": f"message {i}",
+        "is_user": i % 2 == 0,
+        "timestamp": START + timedelta(seconds=i),
+    }
+
+
+def run(scenario):
+    async def main():
+        db = AsyncMongoMockClient()["test_chat_buckets"]
+        await db.chat_buckets.create_index([("companion_id", 1), ("session_id", 1), ("seq", 1)], unique=True)
+        return await scenario(db)
+
+    return asyncio.run(main())
+
+
+def test_appends_fill_each_bucket_before_opening_the_next():
+    async def scenario(db):
+        store = chat_buckets.MongoBucketChatStore(db, bucket_size=4)
+        await store.insert_many([message(0), message(1), message(2)])
+        await store.insert_many([message(3), message(4), message(100, session_id="s2")])
+        await asyncio.gather(*(store.insert_many([message(i)]) for i in range(5, 11)))
+        return await db.chat_buckets.find({"session_id": "s1"}).sort("seq", 1).to_list(None)
+
+    buckets = run(scenario)
+    assert [b["count"] for b in buckets] == [4, 4, 3]
+    assert [len(b["messages"]) for b in buckets] == [4, 4, 3]
+    assert buckets[0]["start"] == START
+    assert [m["id"] for m in buckets[0]["messages"]] == ["m0", "m1", "m2", "m3"]
+
+
+def test_history_reads_across_buckets():
+    async def scenario(db):
+        store = chat_buckets.MongoBucketChatStore(db, bucket_size=4)
+        await store.insert_many([message(i) for i in range(10)])
+        page = await store.history("c1", "s1", 6)
+        older = await store.history("c1", "s1", 6, before=(None, page[-1]["_id"]))
+        newer = await store.history("c1", "s1", 3, after=(None, older[-1]["_id"]))
+        return page, older, newer
+
+    page, older, newer = run(scenario)
+    assert [m["id"] for m in page] == [f"m{i}" for i in range(9, 3, -1)]
+    assert str(page[0]["_id"]) == "2:1"
+    assert [m["id"] for m in older] == ["m3", "m2", "m1", "m0"]
+    assert [m["id"] for m in newer] == ["m1", "m2", "m3"]
+
+
+def test_raising_the_bucket_size_keeps_appending_to_the_newest_bucket():
+    async def scenario(db):
+        small = chat_buckets.MongoBucketChatStore(db, bucket_size=4)
+        await small.insert_many([message(i) for i in range(10)])
+        # Buckets 0 and 1 hold 4 messages each, which is no longer full at size 8
+        store = chat_buckets.MongoBucketChatStore(db, bucket_size=8)
+        await store.insert_many([message(10)])
+        await store.insert_many([message(11)])
+        buckets = await db.chat_buckets.find().sort("seq", 1).to_list(None)
+        return buckets, await store.history("c1", "s1", 3)
+
+    buckets, page = run(scenario)
+    assert [[m["id"] for m in b["messages"]] for b in buckets][-1] == ["m8", "m9", "m10", "m11"]
+    assert [b["open"] for b in buckets] == [False, False, True]
+    assert [m["id"] for m in page] == ["m11", "m10", "m9"]
+
+
+def test_migrate_is_idempotent_and_merges_with_existing_buckets():
+    async def scenario(db):
+        await db.chat_messages.insert_many([message(i) for i in range(5)])
+        # Written after switching to buckets, before the migration ran
+        store = chat_buckets.MongoBucketChatStore(db, bucket_size=4)
+        await store.insert_many([message(5), message(6)])
+
+        assert await chat_buckets.migrate(db, bucket_size=4) == 5
+        assert await chat_buckets.migrate(db, bucket_size=4, delete_source=True) == 0
+        history = await store.history("c1", "s1", 10)
+        return history, await db.chat_messages.count_documents({}), await db.chat_buckets.count_documents({})
+
+    history, documents_left, bucket_count = run(scenario)
+    assert [m["id"] for m in reversed(history)] == [f"m{i}" for i in range(7)]
+    assert documents_left == 0
+    assert bucket_count == 2
+
+
+def test_compact_repacks_under_filled_buckets():
+    async def scenario(db):
+        small = chat_buckets.MongoBucketChatStore(db, bucket_size=2)
+        await small.insert_many([message(i) for i in range(5)])
+        assert await db.chat_buckets.count_documents({}) == 3
+
+        assert await chat_buckets.compact(db, bucket_size=4) == 1
+        assert await chat_buckets.compact(db, bucket_size=4) == 0
+        store = chat_buckets.MongoBucketChatStore(db, bucket_size=4)
+        await store.insert_many([message(5)])
+        buckets = await db.chat_buckets.find().sort("seq", 1).to_list(None)
+        return buckets, await store.history("c1", "s1", 10)
+
+    buckets, history = run(scenario)
+    assert [b["count"] for b in buckets] == [4, 2]
+    assert [b["open"] for b in buckets] == [False, True]
+    assert [m["id"] for m in reversed(history)] == [f"m{i}" for i in range(6)]
+
+
+def test_message_score_counts_prefix_hits():
+    assert chat_buckets.message_score("Hiking, hiking and hikes", ["hik"]) > chat_buckets.message_score("hiking", ["hik"])
+    assert chat_buckets.message_score("nothing to see", ["hik"]) == 0.0
+
+
+def test_compact_puts_messages_appended_out_of_order_back_in_order():
+    async def scenario(db):
+        await db.chat_buckets.insert_many([
+            chat_buckets.new_bucket("c1", "s1", 0, [chat_buckets.bucket_entry(message(i)) for i in (0, 1, 4)], False),
+            chat_buckets.new_bucket("c1", "s1", 1, [chat_buckets.bucket_entry(message(i)) for i in (2, 3)]),
+        ])
+        assert await chat_buckets.compact(db, bucket_size=8) == 1
+        return await chat_buckets.MongoBucketChatStore(db, bucket_size=8).history("c1", "s1", 10)
+
+    assert [m["id"] for m in reversed(run(scenario))] == [f"m{i}" for i in range(5)]
+
+
+class TextSearchCursor:
+    """Stands in for a $text query, which mongomock does not implement"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.read = 0
+        self.limit_to = None
+
+    def sort(self, keys):
+        return self
+
+    def limit(self, count):
+        self.limit_to = count
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.read >= min(len(self.buckets), self.limit_to):
+            raise StopAsyncIteration
+        self.read += 1
+        return self.buckets[self.read - 1]
+
+    async def close(self):
+        pass
+
+
+def test_bucket_search_reads_only_enough_buckets_for_the_page():
+    buckets = [
+        {"seq": seq, "messages": [chat_buckets.bucket_entry({**message(seq * 4 + i), "message": "hiking again"})
+                                  for i in range(4)]}
+        for seq in range(50)
+    ]
+    cursor = TextSearchCursor(buckets)
+
+    class Collection:
+        def find(self, query, projection):
+            return cursor
+
+    store = chat_buckets.MongoBucketChatStore(SimpleNamespace(chat_buckets=Collection()), bucket_size=4)
+    hits = asyncio.run(store.search("c1", "s1", ["hiking"], 5, offset=2))
+
+    assert len(hits) == 5
+    assert cursor.limit_to == 7
+    assert cursor.read == 2
@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from sqlite_storage import SQLiteStorage
+
+START = datetime(2025, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """History endpoint over SQLite with seven messages in session s1, two sharing a timestamp"""
+    store = SQLiteStorage(str(tmp_path / "history.db"), status_retention=86400, purge_interval=0)
+
+    async def seed():
+        await store.init()
+        await store.chats.insert_many([
+            {"id": f"m{i}", "companion_id": "c1", "session_id": "s1", "message": f"message {i}",
+             "is_user": i % 2 == 0, "timestamp": START + timedelta(seconds=min(i, 5))}
+            for i in range(7)
+        ])
+
+    async def load_companion(companion_id):
+        return object() if companion_id == "c1" else None
+
+    asyncio.run(seed())
+    monkeypatch.setattr(server, "storage", store)
+    monkeypatch.setattr(server, "load_companion", load_companion)
+    yield TestClient(server.app)
+    asyncio.run(store.close())
+
+
+def test_following_cursors_walks_the_whole_history_once(client):
+    seen, params = [], {"session_id": "s1", "limit": 3}
+    while True:
+        page = client.get("/api/chat/c1", params=params).json()
+        seen.extend(m["id"] for m in page["messages"])
+        if not page["has_more"]:
+            break
+        params = {**params, "before": page["before_cursor"]}
+
+    assert seen == [f"m{i}" for i in range(6, -1, -1)]
+    last = client.get("/api/chat/c1", params={**params, "before": page["before_cursor"]}).json()
+    assert last["messages"] == [] and last["has_more"] is False
+
+    # And back towards the newest from the oldest page
+    newer = client.get("/api/chat/c1", params={"session_id": "s1", "limit": 3,
+                                               "after": page["before_cursor"]}).json()
+    assert [m["id"] for m in newer["messages"]] == ["m3", "m2", "m1"]
+
+
+def test_before_and_after_together_are_rejected(client):
+    cursor = client.get("/api/chat/c1", params={"session_id": "s1", "limit": 1}).json()["before_cursor"]
+    response = client.get("/api/chat/c1", params={"session_id": "s1", "before": cursor, "after": cursor})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "bm90IGEgY3Vyc29y", "MjAyNS0wMS0wMVQxMjowMDowMHx4"])
+def test_malformed_cursors_are_rejected(client, cursor):
+    response = client.get("/api/chat/c1", params={"session_id": "s1", "before": cursor})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid history cursor"
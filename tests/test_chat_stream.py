@@ -0,0 +1,120 @@
+import asyncio
+import json
+import time
+
+import server
+from response_engine import EchoResponseEngine, ResponseWorkerPool
+
+
+CHUNK_DELAY = 0.05
+
+
+async def fake_generator(chunks):
+    """Stand-in for a slow generator: yields each chunk after a delay"""
+    for chunk in chunks:
+        await asyncio.sleep(CHUNK_DELAY)
+        yield chunk
+
+
+def parse_event(frame):
+    lines = dict(line.split(": ", 1) for line in frame.strip().split("\n"))
+    return lines["event"], json.loads(lines["data"])
+
+
+def test_stream_sends_first_chunk_before_generation_finishes():
+    chunks = ["Hello! ", "I'm ", "Sophia. ", "How ", "can ", "I ", "help?"]
+    stored = []
+
+    async def store_reply(text):
+        stored.append(text)
+        return server.ChatMessage(companion_id="c1", session_id="s1", message=text, is_user=False)
+
+    async def consume():
+        started = time.perf_counter()
+        arrivals = []
+        async for frame in server.sse_chat_events(fake_generator(chunks), store_reply):
+            arrivals.append((time.perf_counter() - started, parse_event(frame)))
+        return arrivals
+
+    arrivals = asyncio.run(consume())
+
+    time_to_first_chunk, (event, data) = arrivals[0]
+    total_time = arrivals[-1][0]
+
+    assert event == "chunk" and data == {"text": "Hello! "}
+    assert time_to_first_chunk < CHUNK_DELAY * 2
+    assert total_time >= CHUNK_DELAY * len(chunks)
+
+    assert [data["text"] for event, data in (a[1] for a in arrivals) if event == "chunk"] == chunks
+    assert stored == ["".join(chunks)]
+    event, data = arrivals[-1][1]
+    assert event == "done" and data["message"] == "".join(chunks) and data["is_user"] is False
+
+
+def test_stream_reports_generator_failure_without_persisting():
+    stored = []
+
+    async def failing_generator():
+        yield "Hello"
+        raise RuntimeError("generator crashed")
+
+    async def store_reply(text):
+        stored.append(text)
+
+    async def consume():
+        return [parse_event(frame) async for frame in server.sse_chat_events(failing_generator(), store_reply)]
+
+    events = asyncio.run(consume())
+
+    assert [event for event, _ in events] == ["chunk", "error"]
+    assert stored == []
+
+
+def test_client_dropping_before_the_first_chunk_frees_the_pool_slot(monkeypatch):
+    async def load_companion(companion_id):
+        return server.Companion(id=companion_id, name="Ada", short_bio="", long_backstory="", traits=[],
+                                avatar_path="")
+
+    async def no_state(*args):
+        return None
+
+    pool = ResponseWorkerPool(EchoResponseEngine(), max_workers=1, max_queue=1)
+    monkeypatch.setattr(server, "response_pool", pool)
+    monkeypatch.setattr(server, "load_companion", load_companion)
+    monkeypatch.setattr(server.storage.chats, "load_state", no_state)
+    monkeypatch.setattr(server.storage.chats, "record_turn", no_state)
+    monkeypatch.setattr(server.storage.analytics, "record", no_state)
+    monkeypatch.setattr(server.chat_writer, "write", no_state)
+    monkeypatch.setattr(server, "rate_limit_wait", lambda route, session_id, connection: 0)
+    body = json.dumps({"companion_id": "c1", "session_id": "s1", "message": "hi", "use_cache": False}).encode()
+
+    async def aborted_request():
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        statuses = []
+
+        async def receive():
+            # The client hangs up as soon as the request is read
+            return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": "/api/chat/stream", "raw_path": b"/api/chat/stream", "query_string": b"",
+            "root_path": "", "headers": [(b"content-type", b"application/json")], "client": ("127.0.0.1", 1),
+            "server": ("test", 80),
+        }
+        await server.app(scope, receive, send)
+        return statuses
+
+    async def run():
+        statuses = [await aborted_request() for _ in range(3)]
+        await asyncio.sleep(0.1)
+        return statuses
+
+    statuses = asyncio.run(run())
+    assert all(status in ([], [200]) for status in statuses)
+    assert pool.in_flight == 0
+    pool.close()
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import server
+
+COMPANION = server.Companion(id="c1", name="Ada", short_bio="", long_backstory="", traits=[], avatar_path="")
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    """Websocket chat with a companion "c1" whose replies echo the message"""
+    companions = {"c1": COMPANION}
+    processed = []
+
+    async def load_companion(companion_id):
+        return companions.get(companion_id)
+
+    async def process_chat_message(companion, session_id, message, use_cache=True):
+        processed.append((session_id, message, use_cache))
+        return server.ChatMessage(companion_id=companion.id, session_id=session_id, message=f"re: {message}",
+                                  is_user=False)
+
+    monkeypatch.setattr(server, "load_companion", load_companion)
+    monkeypatch.setattr(server, "process_chat_message", process_chat_message)
+    monkeypatch.setattr(server, "rate_limit_wait", lambda route, session_id, connection: 0)
+    return companions, processed
+
+
+def test_replies_and_errors_arrive_in_order(chat):
+    companions, processed = chat
+    client = TestClient(server.app)
+
+    with client.websocket_connect("/api/ws/chat/c1?session_id=s1") as ws:
+        ws.send_text("not json")
+        ws.send_json({"message": "hello"})
+        ws.send_json({"message": "again", "use_cache": False})
+
+        assert ws.receive_json()["type"] == "error"
+        assert ws.receive_json()["message"]["message"] == "re: hello"
+        assert ws.receive_json()["message"]["message"] == "re: again"
+
+        del companions["c1"]
+        ws.send_json({"message": "still there?"})
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+        assert closed.value.code == 4404
+
+    assert processed == [("s1", "hello", True), ("s1", "again", False)]
+
+
+def test_unknown_companion_is_refused(chat):
+    client = TestClient(server.app)
+    with client.websocket_connect("/api/ws/chat/missing?session_id=s1") as ws:
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+    assert closed.value.code == 4404
+
+
+class StuckClient:
+    """Keeps sending messages but cannot be written to, like a dropped slow client"""
+
+    def __init__(self):
+        self.closed_with = None
+        self.client = None
+        self.headers = {}
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self):
+        await asyncio.sleep(0)
+        return '{"message": "hi"}'
+
+    async def send_json(self, data):
+        raise RuntimeError("Cannot call send once a close message has been sent")
+
+    async def close(self, code=1000, reason=None):
+        self.closed_with = code
+
+
+def test_failed_send_closes_the_connection_instead_of_blocking_the_reader(chat, monkeypatch):
+    monkeypatch.setattr(server, "WS_SEND_QUEUE_SIZE", 1)
+    websocket = StuckClient()
+
+    asyncio.run(asyncio.wait_for(server.chat_websocket(websocket, "c1", session_id="s1"), timeout=2))
+    assert websocket.closed_with == 1011
@@ -0,0 +1,102 @@
+import asyncio
+
+import server
+
+
+class RecordingStore:
+    """Chat store double that records each insert_many batch"""
+
+    def __init__(self, delay=0.0, error=None):
+        self.batches = []
+        self.delay = delay
+        self.error = error
+
+    async def insert_many(self, documents):
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        self.batches.append(list(documents))
+
+
+def message(i):
+    return {"id": str(i), "message": f"message {i}"}
+
+
+def test_concurrent_writes_are_batched():
+    store = RecordingStore()
+
+    async def run():
+        writer = server.ChatMessageWriter(store, batch_size=100, flush_interval=0.01)
+        writer.start()
+        await asyncio.gather(*(writer.write([message(2 * i), message(2 * i + 1)]) for i in range(50)))
+        assert store.batches == []
+        await asyncio.sleep(0.05)
+        await writer.close()
+        return writer
+
+    writer = asyncio.run(run())
+
+    assert len(store.batches) == 1
+    assert [m["id"] for m in store.batches[0]] == [str(i) for i in range(100)]
+    assert writer.stats()["inserted"] == 100
+
+
+def test_size_threshold_flushes_before_interval():
+    store = RecordingStore()
+
+    async def run():
+        writer = server.ChatMessageWriter(store, batch_size=4, flush_interval=60)
+        writer.start()
+        for i in range(4):
+            await writer.write([message(i)])
+        await asyncio.sleep(0.01)
+        flushed = len(store.batches)
+        await writer.close()
+        return flushed
+
+    assert asyncio.run(run()) == 1
+
+
+def test_durable_write_waits_for_flush():
+    store = RecordingStore(delay=0.01)
+
+    async def run():
+        writer = server.ChatMessageWriter(store, flush_interval=0.01, durable=True)
+        writer.start()
+        await writer.write([message(1), message(2)])
+        flushed = sum(len(batch) for batch in store.batches)
+        await writer.close()
+        return flushed
+
+    assert asyncio.run(run()) == 2
+
+
+def test_durable_write_surfaces_flush_errors():
+    store = RecordingStore(error=RuntimeError("mongo down"))
+
+    async def run():
+        writer = server.ChatMessageWriter(store, flush_interval=0.01, durable=True)
+        writer.start()
+        try:
+            await writer.write([message(1)])
+        except RuntimeError as e:
+            return str(e), writer.stats()["failed"]
+        finally:
+            await writer.close()
+
+    assert asyncio.run(run()) == ("mongo down", 1)
+
+
+def test_close_drains_pending_messages():
+    store = RecordingStore()
+
+    async def run():
+        writer = server.ChatMessageWriter(store, flush_interval=60)
+        writer.start()
+        await writer.write([message(1)])
+        await writer.write([message(2)])
+        await writer.close()
+
+    asyncio.run(run())
+
+    assert [m["id"] for batch in store.batches for m in batch] == ["1", "2"]
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from sqlite_storage import SQLiteStorage
+
+
+def companion(companion_id, name="Ada"):
+    return server.Companion(id=companion_id, name=name, short_bio="", long_backstory="", traits=[], avatar_path="")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = server.CompanionCache(max_size=10, ttl=60)
+    cache.put(companion("c1"))
+
+    clock[0] = 59
+    assert cache.get("c1").id == "c1"
+    clock[0] = 61
+    assert cache.get("c1") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_entry_is_dropped_past_max_size(clock):
+    cache = server.CompanionCache(max_size=2, ttl=60)
+    cache.put(companion("c1"))
+    cache.put(companion("c2"))
+    cache.get("c1")
+    cache.put(companion("c3"))
+
+    assert cache.get("c2") is None
+    assert cache.get("c1") is not None and cache.get("c3") is not None
+
+
+def test_listing_is_dropped_by_any_invalidation_and_too_large_listings_are_not_kept(clock):
+    cache = server.CompanionCache(max_size=2, ttl=60)
+    cache.put_all([companion("c1"), companion("c2")])
+    assert [c.id for c in cache.get_all()] == ["c1", "c2"]
+
+    cache.invalidate("c2")
+    assert cache.get_all() is None
+    assert cache.get("c1") is not None and cache.get("c2") is None
+
+    cache.put_all([companion(f"c{i}") for i in range(3)])
+    assert cache.get_all() is None
+
+
+def test_new_catalogue_version_drops_entries_and_bodies(clock):
+    cache = server.CompanionCache(max_size=10, ttl=60)
+    cache.set_version(1)
+    cache.put(companion("c1"))
+    cache.put_body("c1", 1, b"{}")
+    assert cache.get_body("c1", 1) == b"{}"
+    assert cache.get_body("c1", 2) is None
+
+    cache.set_version(2)
+    assert cache.get("c1") is None
+    assert cache.get_body("c1", 1) is None
+    clock[0] = 61
+    assert cache.get_version() is None
+
+
+def test_crud_endpoints_write_through_the_cache(tmp_path, monkeypatch):
+    store = SQLiteStorage(str(tmp_path / "cache.db"), status_retention=86400, purge_interval=0)
+    cache = server.CompanionCache(max_size=10, ttl=60)
+    monkeypatch.setattr(server, "storage", store)
+    monkeypatch.setattr(server, "companion_cache", cache)
+    monkeypatch.setattr(server.companion_deleter, "enqueue", lambda job: None)
+
+    async def scenario():
+        await store.init()
+        try:
+            created = await server.create_companion(server.CompanionCreate(
+                name="Ada", short_bio="", long_backstory="", traits=[]
+            ))
+            # Served from the cache without a database read
+            reads = []
+            original_get = store.companions.get
+
+            async def get(companion_id):
+                reads.append(companion_id)
+                return await original_get(companion_id)
+
+            monkeypatch.setattr(store.companions, "get", get)
+            assert (await server.load_companion(created.id)).name == "Ada"
+
+            await server.update_companion(created.id, server.CompanionUpdate(name="Grace"))
+            assert (await server.load_companion(created.id)).name == "Grace"
+            assert reads == []
+
+            await server.delete_companion(created.id)
+            assert await server.load_companion(created.id) is None
+            assert reads == [created.id]
+        finally:
+            await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_reloaded_entries_never_go_out_under_an_older_etag(tmp_path, monkeypatch, clock):
+    store = SQLiteStorage(str(tmp_path / "etag.db"), status_retention=86400, purge_interval=0)
+    cache = server.CompanionCache(max_size=10, ttl=60)
+    monkeypatch.setattr(server, "storage", store)
+    monkeypatch.setattr(server, "companion_cache", cache)
+    asyncio.run(store.init())
+    client = TestClient(server.app)
+
+    created = asyncio.run(server.create_companion(server.CompanionCreate(
+        name="Ada", short_bio="", long_backstory="", traits=[]
+    )))
+    # The version is re-read later than the entry was cached, so it outlives it
+    clock[0] = 30
+    cache.set_version(asyncio.run(store.companions.get_version()))
+    first = client.get(f"/api/companions/{created.id}")
+
+    # Another worker renames the companion
+    asyncio.run(store.companions.update(created.id, {"name": "Grace"}))
+    asyncio.run(store.companions.bump_version())
+
+    clock[0] = 65
+    again = client.get(f"/api/companions/{created.id}", headers={"If-None-Match": first.headers["etag"]})
+    asyncio.run(store.close())
+    assert again.status_code == 200
+    assert again.json()["name"] == "Grace"
+    assert again.headers["etag"] != first.headers["etag"]
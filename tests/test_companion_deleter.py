@@ -0,0 +1,163 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import server
+from sqlite_storage import SQLiteStorage
+
+
+def seed(store, messages):
+    async def run():
+        await store.companions.insert({"id": "c1", "name": "Ada", "created_at": datetime(2025, 1, 1)})
+        start = datetime(2025, 1, 1)
+        await store.chats.insert_many([
+            {"id": f"m{i}", "companion_id": "c1", "session_id": "s1", "message": "hi",
+             "is_user": True, "timestamp": start + timedelta(seconds=i)}
+            for i in range(messages)
+        ])
+        await store.companions.soft_delete("c1")
+        job = server.DeletionJob(companion_id="c1")
+        await store.deletion_jobs.insert(job.dict())
+        return job
+
+    return run()
+
+
+def test_job_deletes_in_batches_and_records_progress(tmp_path, monkeypatch):
+    store = SQLiteStorage(str(tmp_path / "test.db"), status_retention=86400, purge_interval=0)
+    monkeypatch.setattr(server, "storage", store)
+
+    async def run():
+        await store.init()
+        job = await seed(store, 25)
+        batches = []
+        delete_batch = store.chats.delete_batch
+
+        async def recording_delete_batch(companion_id, batch_size):
+            batches.append(await delete_batch(companion_id, batch_size))
+            return batches[-1]
+
+        monkeypatch.setattr(store.chats, "delete_batch", recording_delete_batch)
+        await server.CompanionDeleter(batch_size=10, pause=0).run_job(job.id)
+        result = await store.deletion_jobs.get(job.id), await store.companions.delete("c1")
+        await store.close()
+        return batches, result
+
+    batches, (job, companion_left) = asyncio.run(run())
+    assert batches == [10, 10, 5, 0]
+    assert job["status"] == "completed"
+    assert job["deleted_messages"] == 25
+    assert job["completed_at"] is not None
+    assert companion_left is False
+
+
+def test_unfinished_jobs_resume_on_start(tmp_path, monkeypatch):
+    path = str(tmp_path / "test.db")
+    store = SQLiteStorage(path, status_retention=86400, purge_interval=0)
+    monkeypatch.setattr(server, "storage", store)
+
+    async def interrupted():
+        await store.init()
+        job = await seed(store, 5)
+        # A restart in the middle of a job leaves it marked running
+        await store.deletion_jobs.update(job.id, {"status": "running"})
+        await store.close()
+        return job
+
+    job = asyncio.run(interrupted())
+
+    async def restarted():
+        deleter = server.CompanionDeleter(batch_size=2, pause=0)
+        await store.init()
+        await deleter.start()
+        for _ in range(100):
+            if (await store.deletion_jobs.get(job.id))["status"] == "completed":
+                break
+            await asyncio.sleep(0.01)
+        await deleter.close()
+        result = await store.deletion_jobs.get(job.id), await store.chats.history("c1", "s1", 10)
+        await store.close()
+        return result
+
+    resumed, history = asyncio.run(restarted())
+    assert resumed["status"] == "completed"
+    assert resumed["deleted_messages"] == 5
+    assert history == []
+
+
+def test_turns_that_finish_after_the_first_sweep_are_swept_after_the_grace_period(tmp_path, monkeypatch):
+    store = SQLiteStorage(str(tmp_path / "test.db"), status_retention=86400, purge_interval=0)
+    monkeypatch.setattr(server, "storage", store)
+
+    async def run():
+        await store.init()
+        job = await seed(store, 3)
+        delete_batch = store.chats.delete_batch
+        late_turn = [
+            {"id": f"late{i}", "companion_id": "c1", "session_id": "s2", "message": "hi",
+             "is_user": i == 0, "timestamp": datetime.utcnow()}
+            for i in range(2)
+        ]
+
+        async def delete_batch_then_late_turn(companion_id, batch_size):
+            removed = await delete_batch(companion_id, batch_size)
+            # A turn that loaded the companion before it was hidden lands after the first sweep
+            if not removed and late_turn:
+                await store.chats.insert_many(late_turn)
+                await store.chats.record_turn(late_turn)
+                await store.analytics.record(late_turn)
+                late_turn.clear()
+            return removed
+
+        monkeypatch.setattr(store.chats, "delete_batch", delete_batch_then_late_turn)
+        deleter = server.CompanionDeleter(batch_size=10, pause=0, grace=0.3)
+        await deleter.start()
+        statuses = []
+        for _ in range(100):
+            statuses.append((await store.deletion_jobs.get(job.id))["status"])
+            if statuses[-1] == "completed":
+                break
+            await asyncio.sleep(0.01)
+        await deleter.close()
+        result = (
+            statuses,
+            await store.deletion_jobs.get(job.id),
+            await store.chats.history("c1", "s2", 10),
+            await store.chats.load_state("c1", "s2"),
+            await store.analytics.companions(10),
+        )
+        await store.close()
+        return result
+
+    statuses, job, history, state, analytics = asyncio.run(run())
+    # The worker is free while the job waits out its grace period
+    assert "swept" in statuses and job["resweep_at"] is not None
+    assert job["status"] == "completed"
+    assert job["deleted_messages"] == 5
+    assert history == [] and state is None and analytics == []
+
+
+def test_resumed_jobs_wait_for_their_persisted_resweep_time(tmp_path, monkeypatch):
+    store = SQLiteStorage(str(tmp_path / "test.db"), status_retention=86400, purge_interval=0)
+    monkeypatch.setattr(server, "storage", store)
+
+    async def run():
+        await store.init()
+        job = await seed(store, 2)
+        resweep_at = datetime.utcnow() + timedelta(seconds=0.2)
+        await store.deletion_jobs.update(job.id, {"status": "swept", "resweep_at": resweep_at})
+        deleter = server.CompanionDeleter(batch_size=10, pause=0, grace=0)
+        await deleter.start()
+        await asyncio.sleep(0.05)
+        early = (await store.deletion_jobs.get(job.id))["status"]
+        for _ in range(100):
+            if (await store.deletion_jobs.get(job.id))["status"] == "completed":
+                break
+            await asyncio.sleep(0.01)
+        await deleter.close()
+        done = await store.deletion_jobs.get(job.id)
+        await store.close()
+        return early, done, resweep_at
+
+    early, done, resweep_at = asyncio.run(run())
+    assert early == "swept"
+    assert done["status"] == "completed" and done["completed_at"] >= resweep_at
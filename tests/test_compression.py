@@ -0,0 +1,55 @@
+import asyncio
+import gzip
+
+from compression import CompressionMiddleware, strip_encoding_suffix
+
+
+def run(app, accept_encoding="gzip, deflate"):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+    asyncio.run(CompressionMiddleware(app, minimum_size=100)(scope, None, send))
+    return dict((k.decode(), v.decode()) for k, v in sent[0]["headers"]), b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def json_app(body, etag=None, more_body=False):
+    async def app(scope, receive, send):
+        headers = [(b"content-type", b"application/json")]
+        if etag:
+            headers.append((b"etag", etag.encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": body, "more_body": more_body})
+        if more_body:
+            await send({"type": "http.response.body", "body": b""})
+    return app
+
+
+def test_large_json_is_gzipped_with_encoding_specific_etag():
+    body = b'{"long_backstory": "' + b"a" * 1000 + b'"}'
+
+    headers, sent = run(json_app(body, etag='"companions-v3"'))
+
+    assert headers["content-encoding"] == "gzip"
+    assert gzip.decompress(sent) == body
+    assert headers["etag"] == '"companions-v3-gzip"'
+    assert strip_encoding_suffix(headers["etag"]) == '"companions-v3"'
+
+
+def test_small_and_unaccepted_bodies_pass_through():
+    headers, sent = run(json_app(b"{}"))
+    assert "content-encoding" not in headers and sent == b"{}"
+
+    body = b"[" + b"1," * 200 + b"1]"
+    headers, sent = run(json_app(body), accept_encoding="gzip;q=0")
+    assert "content-encoding" not in headers and sent == body
+
+
+def test_streamed_responses_are_not_buffered():
+    body = b"x" * 500
+
+    headers, sent = run(json_app(body, more_body=True))
+
+    assert "content-encoding" not in headers and sent == body
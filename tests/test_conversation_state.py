@@ -0,0 +1,41 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import conversation_state
+
+
+class RecordingCollection:
+    def __init__(self):
+        self.updates = []
+
+    async def update_one(self, filter, update, upsert=False):
+        self.updates.append((filter, update, upsert))
+
+
+def message(i, is_user, at):
+    return {
+        "id": str(i),
+        "companion_id": "c1",
+        "session_id": "s1",
+        "message": f"message {i}",
+        "is_user": is_user,
+        "timestamp": at,
+    }
+
+
+def test_record_turn_is_a_single_bounded_upsert():
+    collection = RecordingCollection()
+    start = datetime(2025, 1, 1)
+    turn = [message(1, True, start), message(2, False, start + timedelta(seconds=1))]
+
+    asyncio.run(conversation_state.record_turn(collection, turn, max_turns=6))
+
+    [(filter, update, upsert)] = collection.updates
+    assert filter == {"companion_id": "c1", "session_id": "s1"}
+    assert upsert is True
+    assert update["$push"]["recent_turns"]["$slice"] == -6
+    assert [t["id"] for t in update["$push"]["recent_turns"]["$each"]] == ["1", "2"]
+    assert "companion_id" not in update["$push"]["recent_turns"]["$each"][0]
+    assert update["$inc"] == {"message_count": 2, "user_message_count": 1, "companion_message_count": 1}
+    assert update["$max"] == {"last_activity": start + timedelta(seconds=1)}
+    assert update["$setOnInsert"] == {"started_at": start, "summary": None}
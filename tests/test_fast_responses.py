@@ -0,0 +1,46 @@
+import json
+from datetime import datetime
+
+from bson import ObjectId
+
+import server
+import storage
+from fastapi.encoders import jsonable_encoder
+
+
+def stored_message(i, timestamp):
+    return {
+        "_id": ObjectId(),
+        "id": f"message-{i}",
+        "companion_id": "c1",
+        "session_id": "s1",
+        "message": f"héllo {i} \"quoted\"",
+        "is_user": i % 2 == 0,
+        "timestamp": timestamp,
+    }
+
+
+def test_fast_history_page_matches_standard_output(monkeypatch):
+    messages = [
+        stored_message(0, datetime(2025, 1, 1, 12, 0, 0)),
+        stored_message(1, datetime(2025, 1, 1, 12, 0, 0, 123000)),
+    ]
+
+    monkeypatch.setattr(server, "FAST_RESPONSES", False)
+    standard = jsonable_encoder(server.history_page_response(messages, True, None, None))
+    monkeypatch.setattr(server, "FAST_RESPONSES", True)
+    fast = json.loads(server.history_page_response(messages, True, None, None).body)
+
+    assert fast == standard
+    assert list(fast["messages"][0]) == list(server.ChatResponse.model_fields)
+
+
+def test_projection_only_fetches_response_fields():
+    assert storage.projection(storage.STATUS_CHECK_FIELDS) == {"_id": 0, "id": 1, "client_name": 1, "timestamp": 1}
+    assert storage.projection(storage.CHAT_RESPONSE_FIELDS, include_id=True)["_id"] == 1
+
+
+def test_storage_fields_match_response_models():
+    assert storage.CHAT_RESPONSE_FIELDS == list(server.ChatResponse.model_fields)
+    assert storage.STATUS_CHECK_FIELDS == list(server.StatusCheck.model_fields)
+    assert storage.STATUS_ROLLUP_FIELDS == list(server.StatusRollup.model_fields)
@@ -0,0 +1,53 @@
+import asyncio
+from types import SimpleNamespace
+
+from metrics import CommandTimer, MetricsMiddleware, MetricsRegistry
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    for seconds in (0.0004, 0.003, 0.003, 2.0):
+        registry.observe_request("GET", "/api/companions", 200, seconds)
+
+    text = registry.render()
+
+    assert 'throne_http_requests_total{method="GET",route="/api/companions",status="200"} 4' in text
+    assert 'throne_http_request_duration_seconds_bucket{method="GET",route="/api/companions",le="0.0005"} 1' in text
+    assert 'throne_http_request_duration_seconds_bucket{method="GET",route="/api/companions",le="0.005"} 3' in text
+    assert 'throne_http_request_duration_seconds_bucket{method="GET",route="/api/companions",le="+Inf"} 4' in text
+    assert 'throne_http_request_duration_seconds_count{method="GET",route="/api/companions"} 4' in text
+
+
+def test_middleware_labels_by_route_template():
+    registry = MetricsRegistry()
+
+    async def app(scope, receive, send):
+        scope["route"] = SimpleNamespace(path="/api/chat/{companion_id}")
+        await send({"type": "http.response.start", "status": 404})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        pass
+
+    middleware = MetricsMiddleware(app, registry)
+    asyncio.run(middleware({"type": "http", "method": "GET", "path": "/api/chat/abc"}, None, send))
+
+    assert registry.requests == {("GET", "/api/chat/{companion_id}", 404): 1}
+
+
+def test_command_timer_attributes_durations_to_collections():
+    registry = MetricsRegistry()
+    timer = CommandTimer(registry)
+
+    timer.started(SimpleNamespace(
+        command={"insert": "chat_messages", "documents": []}, command_name="insert", connection_id=("db", 1), request_id=7
+    ))
+    timer.succeeded(SimpleNamespace(command_name="insert", connection_id=("db", 1), request_id=7, duration_micros=1500))
+    timer.started(SimpleNamespace(
+        command={"find": "companions"}, command_name="find", connection_id=("db", 1), request_id=8
+    ))
+    timer.failed(SimpleNamespace(command_name="find", connection_id=("db", 1), request_id=8, duration_micros=250))
+
+    assert registry.mongo_latency[("chat_messages", "insert")].total == 0.0015
+    assert registry.mongo_failures == {("companions", "find"): 1}
+    assert timer._collections == {}
@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+import server
+from ndjson import import_lines, read_lines
+from sqlite_storage import SQLiteStorage
+from storage import BulkInsertError
+
+
+async def chunked(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def collect(iterator):
+    async def run():
+        return [item async for item in iterator]
+
+    return asyncio.run(run())
+
+
+def test_lines_are_split_across_chunk_boundaries():
+    lines = collect(read_lines(chunked(b'{"a": 1}\n{"b"', b': 2}\n\n  \n', b'{"c": 3}'), max_line_bytes=100))
+
+    assert lines == [(1, b'{"a": 1}'), (2, b'{"b": 2}'), (5, b'{"c": 3}')]
+
+
+def test_oversized_lines_are_skipped_without_buffering_them():
+    lines = collect(read_lines(chunked(b"x" * 6, b"x" * 6, b"\nok\n", b"y" * 20), max_line_bytes=10))
+
+    assert lines == [(1, None), (2, b"ok"), (3, None)]
+
+
+def test_import_reports_rejected_lines_and_write_errors():
+    batches = []
+
+    async def parse(line):
+        if "id" not in line:
+            raise ValueError("id: Field required")
+        return line
+
+    async def insert_many(documents):
+        batches.append([d["id"] for d in documents])
+        if "dup" in batches[-1]:
+            raise BulkInsertError("1 duplicate", len(documents) - 1,
+                                  [{"index": batches[-1].index("dup"), "errmsg": "duplicate id dup"}])
+
+    body = b'{"id": "a"}\n{"id": "dup"}\nnot json\n{"name": "x"}\n{"id": "b"}\n'
+    report = asyncio.run(import_lines(chunked(body), parse, insert_many, batch_size=2, max_errors=2))
+
+    assert batches == [["a", "dup"], ["b"]]
+    assert report.summary() == {
+        "received": 5,
+        "inserted": 2,
+        "failed": 3,
+        "errors": [{"line": 2, "error": "duplicate id dup"}, {"line": 3, "error": report.errors[1]["error"]}],
+        "errors_truncated": True,
+    }
+
+
+def test_bulk_endpoints_round_trip(tmp_path, monkeypatch):
+    store = SQLiteStorage(str(tmp_path / "bulk.db"), status_retention=86400, purge_interval=0)
+    asyncio.run(store.init())
+    monkeypatch.setattr(server, "storage", store)
+    monkeypatch.setattr(server, "BULK_BATCH_SIZE", 2)
+    client = TestClient(server.app)
+
+    companions = [
+        {"id": f"bulk-{i}", "name": f"C{i}", "short_bio": "b", "long_backstory": "l", "traits": [], "avatar_path": "/a.png"}
+        for i in range(3)
+    ]
+    body = "\n".join([*map(json.dumps, companions), json.dumps(companions[0]), '{"name": "missing fields"}'])
+    result = client.post("/api/companions/bulk", content=body.encode()).json()
+    assert (result["inserted"], result["failed"]) == (3, 2)
+    assert [e["line"] for e in result["errors"]] == [4, 5]
+
+    exported = client.get("/api/companions/bulk")
+    assert exported.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line)["id"] for line in exported.text.splitlines()] == ["bulk-0", "bulk-1", "bulk-2"]
+
+    messages = [
+        {"id": f"m{i}", "companion_id": "bulk-0", "session_id": "s1", "message": f"hello {i}",
+         "is_user": i % 2 == 0, "timestamp": f"2025-01-01T12:00:0{i}"}
+        for i in range(5)
+    ]
+    lines = [*map(json.dumps, messages), json.dumps({**messages[0], "id": "x", "companion_id": "nobody"})]
+    result = client.post("/api/chat/bulk", content="\n".join(lines).encode()).json()
+    assert (result["inserted"], result["failed"]) == (5, 1)
+    assert "nobody" in result["errors"][0]["error"]
+    # Duplicates are left out of conversation state along with the stored messages
+    again = [json.dumps(messages[4]), json.dumps({**messages[4], "id": "m5", "timestamp": "2025-01-01T12:00:05"})]
+    result = client.post("/api/chat/bulk", content="\n".join(again).encode()).json()
+    assert (result["inserted"], result["failed"]) == (1, 1)
+
+    exported = client.get("/api/chat/bulk", params={"companion_id": "bulk-0"})
+    assert [json.loads(line)["id"] for line in exported.text.splitlines()] == [f"m{i}" for i in range(6)]
+    assert client.get("/api/chat/bulk", params={"companion_id": "nobody"}).status_code == 404
+    state = asyncio.run(store.chats.load_state("bulk-0", "s1"))
+    assert state["message_count"] == 6
+    assert [turn["id"] for turn in state["recent_turns"]] == [f"m{i}" for i in range(6)]
+    asyncio.run(store.close())
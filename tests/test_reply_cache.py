@@ -0,0 +1,180 @@
+import asyncio
+
+import pytest
+
+import server
+from response_engine import EchoResponseEngine, ReplyCache, ResponseEngine, ResponseWorkerPool, normalise_message
+
+COMPANION = {"id": "c1", "name": "Sophia", "short_bio": "Wise and thoughtful."}
+
+
+class CountingEngine(ResponseEngine):
+    normalises_message = True
+
+    def __init__(self, uses_conversation):
+        self.uses_conversation = uses_conversation
+        self.calls = []
+
+    def generate(self, companion, message, conversation=None):
+        self.calls.append(message)
+        turns = len(conversation["recent_turns"]) if conversation else 0
+        return f"{companion['name']} reply {len(self.calls)} after {turns} turns"
+
+
+def test_normalise_message_folds_case_and_whitespace():
+    assert normalise_message("  Hello\tThere \n") == normalise_message("hello there") == "hello there"
+
+
+def test_reply_cache_keys_on_companion_version():
+    cache = ReplyCache(max_size=10, ttl=60)
+    key = cache.key(COMPANION, "Hi  there", normalise=True)
+    cache.put(key, "hello")
+
+    assert cache.get(cache.key(COMPANION, "hi there", normalise=True)) == "hello"
+    assert cache.get(cache.key(COMPANION, "Hi there")) is None
+    assert cache.get(cache.key({**COMPANION, "short_bio": "Grumpy."}, "hi there", normalise=True)) is None
+    assert cache.stats()["hit_rate"] == 1 / 3
+
+
+def test_reply_cache_evicts_least_recently_used_and_expired(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("response_engine.time.monotonic", lambda: now[0])
+    cache = ReplyCache(max_size=2, ttl=10)
+    for message in ("a", "b"):
+        cache.put(cache.key(COMPANION, message), message)
+    cache.get(cache.key(COMPANION, "a"))
+    cache.put(cache.key(COMPANION, "c"), "c")
+
+    assert cache.get(cache.key(COMPANION, "b")) is None
+    assert cache.get(cache.key(COMPANION, "a")) == "a"
+    now[0] = 11
+    assert cache.get(cache.key(COMPANION, "a")) is None
+    assert cache.stats()["size"] == 1
+
+
+def test_reply_cache_invalidates_one_companion():
+    cache = ReplyCache()
+    cache.put(cache.key(COMPANION, "hi"), "one")
+    cache.put(cache.key({**COMPANION, "id": "c2"}, "hi"), "two")
+    cache.invalidate("c1")
+
+    assert cache.get(cache.key(COMPANION, "hi")) is None
+    assert cache.get(cache.key({**COMPANION, "id": "c2"}, "hi")) == "two"
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    """process_chat_message against in-memory conversation states"""
+    states = {}
+
+    async def load_state(companion_id, session_id):
+        return states.get(session_id)
+
+    async def record_turn(messages):
+        state = states.setdefault(messages[0]["session_id"], {"recent_turns": []})
+        state["recent_turns"].extend(messages)
+
+    async def write(documents):
+        pass
+
+    monkeypatch.setattr(server.storage.chats, "load_state", load_state)
+    monkeypatch.setattr(server.storage.chats, "record_turn", record_turn)
+    monkeypatch.setattr(server.storage.analytics, "record", write)
+    monkeypatch.setattr(server.chat_writer, "write", write)
+    monkeypatch.setattr(server, "reply_cache", ReplyCache(max_size=100, ttl=60))
+    companion = server.Companion(id="c1", name="Ada", short_bio="", long_backstory="", traits=[], avatar_path="")
+
+    def use_engine(engine):
+        monkeypatch.setattr(server, "response_pool", ResponseWorkerPool(engine, max_workers=1))
+
+    async def send(session_id, message, use_cache=True, companion=companion):
+        reply = await server.process_chat_message(companion, session_id, message, use_cache)
+        return reply.message
+
+    return use_engine, send
+
+
+def test_context_free_replies_are_shared_between_sessions(chat):
+    use_engine, send = chat
+    engine = CountingEngine(uses_conversation=False)
+    use_engine(engine)
+
+    async def run():
+        return [
+            await send("s1", "Hello!"),
+            await send("s2", "  hello! "),
+            await send("s3", "hello!", use_cache=False),
+        ]
+
+    replies = asyncio.run(run())
+    assert replies[0] == replies[1]
+    assert replies[2] != replies[0]
+    assert engine.calls == ["Hello!", "hello!"]
+    assert server.reply_cache.stats()["hits"] == 1
+    assert server.reply_cache.stats()["bypassed"] == 1
+
+
+def test_context_aware_replies_are_only_cached_for_new_sessions(chat):
+    use_engine, send = chat
+    engine = CountingEngine(uses_conversation=True)
+    use_engine(engine)
+
+    async def run():
+        first = await send("s1", "hi")
+        # s1 now has history, so its reply must not come from (or go into) the cache
+        second = await send("s1", "hi")
+        fresh = await send("s2", "hi")
+        return first, second, fresh
+
+    first, second, fresh = asyncio.run(run())
+    assert fresh == first
+    assert second != first and second.endswith("after 2 turns")
+    assert len(engine.calls) == 2
+
+
+def test_updating_a_companion_drops_its_cached_replies(chat, monkeypatch):
+    use_engine, send = chat
+    engine = CountingEngine(uses_conversation=False)
+    use_engine(engine)
+    stored = {"id": "c1", "name": "Ada", "short_bio": "", "long_backstory": "", "traits": [], "avatar_path": ""}
+
+    async def update(companion_id, fields):
+        return {**stored, **fields}
+
+    async def bump_catalogue_version():
+        pass
+
+    monkeypatch.setattr(server.storage.companions, "update", update)
+    monkeypatch.setattr(server, "bump_catalogue_version", bump_catalogue_version)
+
+    async def run():
+        await send("s1", "hi")
+        assert server.reply_cache.stats()["size"] == 1
+        await server.update_companion("c1", server.CompanionUpdate(short_bio="New bio"))
+
+    asyncio.run(run())
+    assert server.reply_cache.stats()["size"] == 0
+
+
+def test_conversation_state_is_not_read_for_engines_that_ignore_it(chat, monkeypatch):
+    use_engine, send = chat
+    use_engine(CountingEngine(uses_conversation=False))
+
+    async def load_state(companion_id, session_id):
+        raise AssertionError("conversation state read")
+
+    monkeypatch.setattr(server.storage.chats, "load_state", load_state)
+    asyncio.run(send("s1", "hi"))
+
+
+def test_echoed_messages_are_only_shared_when_typed_the_same(chat):
+    use_engine, send = chat
+    use_engine(EchoResponseEngine())
+
+    async def run():
+        return await send("s1", "HELLO  "), await send("s2", "hello"), await send("s3", "hello")
+
+    shouted, first, second = asyncio.run(run())
+    assert "'HELLO  '" in shouted
+    assert "'hello'" in first and second == first
+    assert server.reply_cache.stats()["hits"] == 1
@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from response_engine import (
+    EchoResponseEngine,
+    ResponseEngine,
+    ResponseEngineBusy,
+    ResponseWorkerPool,
+)
+
+COMPANION = {"name": "Sophia", "short_bio": "Wise and thoughtful."}
+
+
+class BlockingEngine(ResponseEngine):
+    """Engine that holds its worker until released, like a slow model would"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def generate(self, companion, message, conversation=None):
+        self.release.wait(timeout=5)
+        return message
+
+
+class ChunkedEngine(ResponseEngine):
+    def stream(self, companion, message, conversation=None):
+        for word in ["one ", "two ", "three"]:
+            time.sleep(0.02)
+            yield word
+
+
+class TwoArgumentEngine(ResponseEngine):
+    """Written before engines were handed the conversation state"""
+
+    def generate(self, companion, message):
+        return f"{companion['name']}: {message}"
+
+
+def test_echo_engine_matches_legacy_reply():
+    reply = EchoResponseEngine().generate(COMPANION, "hi")
+    assert reply == "Hello! I'm Sophia. Wise and thoughtful. You said: 'hi'. How can I help you today?"
+
+
+def test_generation_runs_off_the_event_loop():
+    engine = BlockingEngine()
+    pool = ResponseWorkerPool(engine, max_workers=1, max_queue=0)
+
+    async def run():
+        task = asyncio.create_task(pool.generate(pool.admit(), COMPANION, "hi"))
+        # The loop stays responsive while the worker is blocked
+        await asyncio.sleep(0.02)
+        assert not task.done()
+        assert pool.stats()["busy"] == 1
+        engine.release.set()
+        return await task
+
+    try:
+        assert asyncio.run(run()) == "hi"
+        assert pool.stats()["busy"] == 0
+    finally:
+        pool.close()
+
+
+def test_admission_rejects_when_pool_and_queue_are_full():
+    engine = BlockingEngine()
+    pool = ResponseWorkerPool(engine, max_workers=1, max_queue=1, retry_after=3)
+
+    async def run():
+        running = asyncio.create_task(pool.generate(pool.admit(), COMPANION, "a"))
+        queued = asyncio.create_task(pool.generate(pool.admit(), COMPANION, "b"))
+        await asyncio.sleep(0.02)
+        stats = pool.stats()
+        with pytest.raises(ResponseEngineBusy) as excinfo:
+            pool.admit()
+        engine.release.set()
+        await asyncio.gather(running, queued)
+        return stats, excinfo.value
+
+    try:
+        stats, error = asyncio.run(run())
+    finally:
+        pool.close()
+
+    assert stats["queue_depth"] == 1 and stats["utilisation"] == 1.0
+    assert error.retry_after == 3
+    assert pool.stats()["rejected"] == 1
+    assert pool.in_flight == 0
+
+
+def test_stream_relays_chunks_as_they_are_produced():
+    pool = ResponseWorkerPool(ChunkedEngine(), max_workers=1)
+
+    async def run():
+        started = time.perf_counter()
+        arrivals = []
+        async for chunk in pool.stream(pool.admit(), COMPANION, "hi"):
+            arrivals.append((time.perf_counter() - started, chunk))
+        return arrivals
+
+    try:
+        arrivals = asyncio.run(run())
+    finally:
+        pool.close()
+
+    assert [chunk for _, chunk in arrivals] == ["one ", "two ", "three"]
+    assert arrivals[0][0] < arrivals[-1][0]
+    assert pool.in_flight == 0
+
+
+def test_engines_without_the_conversation_argument_still_work():
+    pool = ResponseWorkerPool(TwoArgumentEngine(), max_workers=1)
+
+    async def run():
+        reply = await pool.generate(pool.admit(), COMPANION, "hi", {"recent_turns": []})
+        chunks = [chunk async for chunk in pool.stream(pool.admit(), COMPANION, "hello there", None)]
+        return reply, chunks
+
+    try:
+        reply, chunks = asyncio.run(run())
+    finally:
+        pool.close()
+
+    assert reply == "Sophia: hi"
+    assert chunks == ["Sophia: ", "hello ", "there"]
+    assert not pool.uses_conversation
+    assert pool.in_flight == 0
@@ -0,0 +1,60 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+import server
+from sqlite_storage import SQLiteStorage
+
+
+def test_concurrent_workers_seed_companions_once(tmp_path, monkeypatch):
+    path = str(tmp_path / "seed.db")
+    # Two workers: separate connections to one database file
+    workers = [SQLiteStorage(path, status_retention=86400, purge_interval=0) for _ in range(2)]
+
+    async def run():
+        for store in workers:
+            await store.init()
+
+        async def seed(store):
+            monkeypatch.setattr(server, "storage", store)
+            await server.seed_companions()
+
+        await asyncio.gather(*(seed(store) for store in workers))
+        count = await workers[0].companions.count()
+        for store in workers:
+            await store.close()
+        return count
+
+    assert asyncio.run(run()) == 3
+
+
+def test_readiness_waits_for_storage(tmp_path, monkeypatch):
+    store = SQLiteStorage(str(tmp_path / "ready.db"), status_retention=86400, purge_interval=0)
+    monkeypatch.setattr(server, "storage", store)
+    monkeypatch.setattr(server, "startup_state", server.StartupState())
+    monkeypatch.setattr(server, "STARTUP_RETRY_DELAY", 0)
+    monkeypatch.setattr(server, "companion_deleter", server.CompanionDeleter(pause=0))
+    client = TestClient(server.app)
+    attempts = []
+    init = store.init
+
+    async def flaky_init():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("connection refused")
+        return await init()
+
+    monkeypatch.setattr(store, "init", flaky_init)
+    assert client.get("/api/health/live").json() == {"status": "ok"}
+    assert client.get("/api/health/ready").status_code == 503
+
+    async def prepare():
+        await server.prepare_storage()
+        await server.companion_deleter.close()
+
+    asyncio.run(prepare())
+    ready = client.get("/api/health/ready")
+    assert ready.status_code == 200
+    assert ready.json() == {"status": "ready", "storage": "sqlite"}
+    assert len(attempts) == 2
+    asyncio.run(store.close())
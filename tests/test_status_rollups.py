@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+import server
+
+
+def test_rollups_default_to_the_most_recent_window(monkeypatch):
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    # A month of old buckets, more than one page, ahead of the recent ones
+    buckets = [now - timedelta(days=30, minutes=i) for i in range(20)] + [now - timedelta(minutes=i) for i in (5, 0)]
+    queries = []
+
+    async def rollups(granularity, since, until, client_name, limit):
+        queries.append((since, until))
+        found = [b for b in buckets if (since is None or b >= since) and (until is None or b < until)]
+        return [{"client_name": "web", "granularity": granularity, "bucket": b, "count": 1}
+                for b in sorted(found)][:limit]
+
+    monkeypatch.setattr(server.storage.status, "rollups", rollups)
+    client = TestClient(server.app)
+
+    response = client.get("/api/status/rollups", params={"granularity": "minute", "limit": 10})
+    assert response.status_code == 200
+    assert [r["bucket"] for r in response.json()] == [(now - timedelta(minutes=5)).isoformat(), now.isoformat()]
+
+    until = now - timedelta(days=30)
+    response = client.get("/api/status/rollups", params={"granularity": "hour", "until": until.isoformat()})
+    assert queries[-1] == (until.replace(minute=0) - timedelta(hours=168), until)
+    assert len(response.json()) == 19
+
+    since = now - timedelta(days=31)
+    client.get("/api/status/rollups", params={"granularity": "minute", "since": since.isoformat()})
+    assert queries[-1] == (since, None)
@@ -0,0 +1,424 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import storage
+from sqlite_storage import SQLiteStorage
+
+START = datetime(2025, 1, 1, 12, 0, 0)
+
+
+def mongo_storage(monkeypatch, **options):
+    """A real mongod when TEST_MONGO_URL is set, otherwise mongomock"""
+    url = os.environ.get("TEST_MONGO_URL")
+    if not url:
+        from mongomock_motor import AsyncMongoMockClient
+        import motor.motor_asyncio
+
+        monkeypatch.setattr(motor.motor_asyncio, "AsyncIOMotorClient", AsyncMongoMockClient)
+        url = "mongodb://localhost:27017"
+    return storage.MongoStorage(url, f"test_storage_{os.getpid()}", status_retention=86400, **options)
+
+
+@pytest.fixture(params=["sqlite", "mongo", "mongo-buckets"])
+def make_storage(request, tmp_path, monkeypatch):
+    def make():
+        if request.param == "sqlite":
+            return SQLiteStorage(str(tmp_path / "test.db"), status_retention=86400)
+        pytest.importorskip("mongomock_motor")
+        # Tiny buckets so every test crosses bucket boundaries
+        options = {"chat_bucket_size": 4} if request.param == "mongo-buckets" else {}
+        return mongo_storage(monkeypatch, **options)
+
+    make.backend = request.param
+    return make
+
+
+def run(make_storage, scenario):
+    async def main():
+        store = make_storage()
+        await store.init()
+        try:
+            if isinstance(store, storage.MongoStorage):
+                await store.client.drop_database(store.db.name)
+                await store.init()
+            return await scenario(store)
+        finally:
+            await store.close()
+
+    return asyncio.run(main())
+
+
+def message(i, at, session_id="s1", is_user=None):
+    return {
+        "id": f"m{i}",
+        "companion_id": "c1",
+        "session_id": session_id,
+        "message": f"message {i}",
+        "is_user": i % 2 == 0 if is_user is None else is_user,
+        "timestamp": at,
+    }
+
+
+def test_init_is_idempotent(make_storage):
+    async def scenario(store):
+        if isinstance(store, storage.MongoStorage):
+            # run() already initialised the database once
+            assert await store.init() == 0
+            await store.db.status_checks.drop_indexes()
+            assert await store.init() == 3
+        else:
+            assert await store.init() is None
+        await store.ping()
+
+    run(make_storage, scenario)
+
+
+def test_leases_are_exclusive_until_released_or_lapsed(make_storage):
+    async def scenario(store):
+        assert await store.claim("seed", ttl=60) is True
+        assert await store.claim("seed", ttl=60) is False
+        assert await store.claim("other", ttl=60) is True
+        await store.release("seed")
+        assert await store.claim("seed", ttl=-1) is True
+        # Already lapsed, so the next claim takes it over
+        assert await store.claim("seed", ttl=60) is True
+
+    run(make_storage, scenario)
+
+
+def test_companion_crud_and_version(make_storage):
+    async def scenario(store):
+        companions = store.companions
+        assert await companions.get_version() == 0
+        await companions.insert_many([
+            {"id": "a", "name": "Ada", "traits": ["Calm"], "created_at": START},
+            {"id": "b", "name": "Bo", "traits": [], "created_at": START},
+        ])
+        assert await companions.count() == 2
+        assert await companions.bump_version() == 1
+        assert await companions.bump_version() == 2
+
+        updated = await companions.update("a", {"name": "Ada Lovelace"})
+        assert updated["name"] == "Ada Lovelace"
+        assert updated["created_at"] == START
+        assert await companions.update("missing", {"name": "x"}) is None
+        assert (await companions.get("a"))["traits"] == ["Calm"]
+        assert [c["id"] for c in await companions.list()] == ["a", "b"]
+
+        assert await companions.soft_delete("b") is True
+        assert await companions.soft_delete("b") is False
+        assert await companions.get("b") is None
+        assert await companions.update("b", {"name": "x"}) is None
+        assert [c["id"] for c in await companions.list()] == ["a"]
+        assert await companions.count() == 1
+        assert await companions.delete("b") is True
+        assert await companions.delete("b") is False
+        assert await companions.get_version() == 2
+
+    run(make_storage, scenario)
+
+
+def test_history_pages_break_timestamp_ties_by_insertion_order(make_storage):
+    async def scenario(store):
+        chats = store.chats
+        # Pairs of messages share a timestamp, as a user message and its reply can
+        await chats.insert_many([message(i, START + timedelta(seconds=i // 2)) for i in range(6)])
+        await chats.insert_many([message(99, START, session_id="other")])
+
+        newest = await chats.history("c1", "s1", 4)
+        assert [m["id"] for m in newest] == ["m5", "m4", "m3", "m2"]
+        assert set(newest[0]) == {"_id", *storage.CHAT_RESPONSE_FIELDS}
+
+        last = newest[-1]
+        older = await chats.history("c1", "s1", 4, before=(last["timestamp"], last["_id"]))
+        assert [m["id"] for m in older] == ["m1", "m0"]
+
+        first = older[-1]
+        newer = await chats.history("c1", "s1", 3, after=(first["timestamp"], first["_id"]))
+        assert [m["id"] for m in newer] == ["m1", "m2", "m3"]
+
+        # Cursors round-trip through their string form
+        assert chats.cursor_key(str(last["_id"])) == last["_id"]
+        with pytest.raises(ValueError):
+            chats.cursor_key("not-a-key")
+
+    run(make_storage, scenario)
+
+
+def test_duplicate_messages_do_not_block_the_rest_of_a_batch(make_storage):
+    if make_storage.backend == "mongo-buckets":
+        pytest.skip("buckets do not index message ids")
+
+    async def scenario(store):
+        await store.chats.insert_many([message(0, START)])
+        with pytest.raises(Exception) as error:
+            await store.chats.insert_many([message(0, START), message(1, START)])
+        assert error.value.details["nInserted"] == 1
+        assert [m["id"] for m in await store.chats.history("c1", "s1", 10)] == ["m1", "m0"]
+
+    run(make_storage, scenario)
+
+
+def test_companion_bulk_insert_reports_each_duplicate(make_storage):
+    async def scenario(store):
+        await store.companions.insert({"id": "a", "name": "Ada", "created_at": START})
+        with pytest.raises(Exception) as error:
+            await store.companions.insert_many([
+                {"id": "b", "name": "Bo", "created_at": START},
+                {"id": "a", "name": "Ada again", "created_at": START},
+                {"id": "c", "name": "Cy", "created_at": START},
+            ])
+        assert error.value.details["nInserted"] == 2
+        assert [e["index"] for e in error.value.details["writeErrors"]] == [1]
+        assert [c["id"] async for c in store.companions.export(batch_size=2)] == ["a", "b", "c"]
+
+    run(make_storage, scenario)
+
+
+def test_export_streams_messages_session_by_session(make_storage):
+    async def scenario(store):
+        chats = store.chats
+        await chats.insert_many([message(i, START + timedelta(seconds=i), session_id=f"s{i % 2}") for i in range(5)])
+        await chats.insert_many([{**message(9, START), "companion_id": "c2"}])
+
+        exported = [m async for m in chats.export("c1", batch_size=2)]
+        assert [m["id"] for m in exported] == ["m0", "m2", "m4", "m1", "m3"]
+        assert set(exported[0]) == set(storage.CHAT_RESPONSE_FIELDS)
+        assert [m["id"] async for m in chats.export("c1", "s1", batch_size=1)] == ["m1", "m3"]
+        assert sorted([m["id"] async for m in chats.export(batch_size=4)]) == ["m0", "m1", "m2", "m3", "m4", "m9"]
+
+    run(make_storage, scenario)
+
+
+def test_search_ranks_matches_within_one_session(make_storage):
+    if make_storage.backend != "sqlite" and not os.environ.get("TEST_MONGO_URL"):
+        pytest.skip("mongomock does not implement $text")
+
+    async def scenario(store):
+        chats = store.chats
+        texts = ["I love hiking", "hiking, hiking and more hiking", "the meaning of life", "hiking alone"]
+        await chats.insert_many([{**message(i, START + timedelta(seconds=i)), "message": text}
+                                 for i, text in enumerate(texts)])
+        await chats.insert_many([{**message(99, START, session_id="other"), "message": "hiking elsewhere"}])
+
+        hits = await chats.search("c1", "s1", storage.search_terms("Hiking!"), 10)
+        assert [hit["id"] for hit in hits][0] == "m1"
+        assert {hit["id"] for hit in hits} == {"m0", "m1", "m3"}
+        assert hits[0]["score"] >= hits[-1]["score"]
+        assert set(hits[0]) >= {"score", *storage.CHAT_RESPONSE_FIELDS}
+
+        page = await chats.search("c1", "s1", ["hiking"], 2, offset=2)
+        assert len(page) == 1
+        assert await chats.search("c1", "s1", ["meaning", "nothing"], 10) != []
+        assert await chats.search("c1", "s1", [], 10) == []
+
+    run(make_storage, scenario)
+
+
+def test_search_word_matching_per_backend(make_storage):
+    if make_storage.backend != "sqlite" and not os.environ.get("TEST_MONGO_URL"):
+        pytest.skip("mongomock does not implement $text")
+
+    async def scenario(store):
+        texts = ["hiking alone", "the meaning of life"]
+        await store.chats.insert_many([{**message(i, START + timedelta(seconds=i)), "message": text}
+                                       for i, text in enumerate(texts)])
+
+        async def found(query):
+            return [hit["id"] for hit in await store.chats.search("c1", "s1", storage.search_terms(query), 10)]
+
+        return {query: await found(query) for query in ("hiking", "hik", "hikes", "the")}
+
+    results = run(make_storage, scenario)
+    # Whole words match everywhere; prefixes, stems and stop words depend on the backend
+    if make_storage.backend == "sqlite":
+        assert results == {"hiking": ["m0"], "hik": ["m0"], "hikes": [], "the": ["m1"]}
+    elif make_storage.backend == "mongo":
+        assert results == {"hiking": ["m0"], "hik": [], "hikes": ["m0"], "the": []}
+    else:
+        assert results == {"hiking": ["m0"], "hik": [], "hikes": [], "the": []}
+
+
+def test_sqlite_migrates_once_and_backfills_the_search_index(tmp_path):
+    path = str(tmp_path / "old.db")
+
+    async def scenario(store):
+        await store.chats.insert_many([{**message(0, START), "message": "hiking alone"}])
+        # A database from before the search index, and before the migration marker
+        await store.run(lambda conn: conn.executescript("DELETE FROM chat_messages_fts; PRAGMA user_version = 0;"))
+
+    run(lambda: SQLiteStorage(path, status_retention=86400), scenario)
+
+    async def reopened(store):
+        version = (await store.fetchone("PRAGMA user_version"))[0]
+        return version, [hit["id"] for hit in await store.chats.search("c1", "s1", ["hiking"], 10)]
+
+    assert run(lambda: SQLiteStorage(path, status_retention=86400), reopened) == (1, ["m0"])
+
+
+def test_conversation_state_is_folded_and_rebuilt(make_storage):
+    async def scenario(store):
+        chats = store.chats
+        messages = [message(i, START + timedelta(seconds=i)) for i in range(5)]
+        await chats.insert_many(messages)
+        await chats.record_turn(messages[:2], max_turns=3)
+        await chats.record_turn(messages[2:], max_turns=3)
+
+        state = await chats.load_state("c1", "s1")
+        assert [t["id"] for t in state["recent_turns"]] == ["m2", "m3", "m4"]
+        assert state["message_count"] == 5
+        assert state["user_message_count"] == 3
+        assert state["companion_message_count"] == 2
+        assert state["started_at"] == START
+        assert state["last_activity"] == START + timedelta(seconds=4)
+        assert await chats.load_state("c1", "missing") is None
+
+        removed = [await chats.delete_batch("c1", 3) for _ in range(3)]
+        assert sum(removed) == 5
+        assert removed[-1] == 0
+        await chats.delete_states("c1")
+        assert await chats.load_state("c1", "s1") is None
+        assert await chats.history("c1", "s1", 10) == []
+
+        await chats.insert_many(messages)
+        assert await chats.rebuild_states(max_turns=2) == 1
+        rebuilt = await chats.load_state("c1", "s1")
+        assert [t["id"] for t in rebuilt["recent_turns"]] == ["m3", "m4"]
+        assert rebuilt["message_count"] == 5
+        assert rebuilt["summary"] is None
+
+    run(make_storage, scenario)
+
+
+def test_analytics_are_counted_per_day_and_rebuilt(make_storage):
+    day = timedelta(days=1)
+    turns = [
+        # (session, offset from START) of a user message and its reply
+        ("s1", timedelta(0)),
+        ("s1", timedelta(minutes=5)),
+        ("s2", timedelta(minutes=10)),
+        ("s1", day),
+        ("s3", day + timedelta(minutes=1)),
+    ]
+
+    async def scenario(store):
+        for i, (session_id, offset) in enumerate(turns):
+            turn = [
+                message(2 * i, START + offset, session_id, is_user=True),
+                message(2 * i + 1, START + offset + timedelta(seconds=1), session_id, is_user=False),
+            ]
+            await store.chats.insert_many(turn)
+            await store.analytics.record(turn)
+        await store.analytics.record([{**message(99, START, "s9"), "companion_id": "c2"}])
+
+        recorded = (
+            await store.analytics.companions(10),
+            await store.analytics.daily("c1", None, None, 10),
+        )
+        assert await store.analytics.rebuild("c1") == 1
+        rebuilt = (
+            await store.analytics.companions(10),
+            await store.analytics.daily("c1", None, None, 10),
+        )
+        return recorded, rebuilt, await store.analytics.daily("c1", START + day / 2, None, 10)
+
+    recorded, rebuilt, second_day = run(make_storage, scenario)
+    assert recorded == rebuilt
+    companions, daily = recorded
+    assert [c["companion_id"] for c in companions] == ["c1", "c2"]
+    assert companions[0] == {
+        "companion_id": "c1",
+        "message_count": 10,
+        "user_message_count": 5,
+        "companion_message_count": 5,
+        "session_count": 3,
+        "first_message_at": START,
+        "last_message_at": START + day + timedelta(minutes=1, seconds=1),
+    }
+    midnight = START.replace(hour=0)
+    assert [(d["day"], d["message_count"], d["active_sessions"]) for d in daily] == [
+        (midnight, 6, 2),
+        (midnight + day, 4, 2),
+    ]
+    assert second_day == daily[1:]
+
+
+def test_analytics_listing_leaves_out_soft_deleted_companions(make_storage):
+    async def scenario(store):
+        for companion_id in ("c1", "c2"):
+            await store.companions.insert({"id": companion_id, "name": companion_id, "created_at": START})
+            await store.analytics.record([{**message(0, START), "companion_id": companion_id}])
+        await store.companions.soft_delete("c1")
+        return await store.analytics.companions(10)
+
+    assert [c["companion_id"] for c in run(make_storage, scenario)] == ["c2"]
+
+
+def test_deletion_jobs_are_listed_until_completed(make_storage):
+    async def scenario(store):
+        jobs = store.deletion_jobs
+        for i in range(2):
+            await jobs.insert({"id": f"j{i}", "companion_id": "c1", "status": "pending",
+                               "deleted_messages": 0, "created_at": START + timedelta(seconds=i)})
+        await jobs.update("j0", {"status": "completed", "deleted_messages": 5})
+        assert (await jobs.get("j0"))["deleted_messages"] == 5
+        assert [job["id"] for job in await jobs.unfinished()] == ["j1"]
+        assert await jobs.get("missing") is None
+
+    run(make_storage, scenario)
+
+
+def test_status_checks_and_rollups(make_storage):
+    # Recent enough that neither TTL indexes nor the SQLite purge remove them
+    start = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+
+    async def scenario(store):
+        status = store.status
+        for i, client in enumerate(["web", "web", "ios"]):
+            await status.insert({"id": f"s{i}", "client_name": client, "timestamp": start + timedelta(minutes=i)})
+            bucket = (start + timedelta(minutes=i)).replace(minute=0)
+            await status.increment_rollup("hour", client, bucket, bucket + timedelta(days=1))
+
+        checks = await status.find(start + timedelta(minutes=1), None, None, 10)
+        assert [c["id"] for c in checks] == ["s2", "s1"]
+        assert set(checks[0]) == set(storage.STATUS_CHECK_FIELDS)
+        assert [c["id"] for c in await status.find(None, start + timedelta(minutes=1), "web", 10)] == ["s0"]
+
+        rollups = await status.rollups("hour", None, None, None, 10)
+        assert sorted((r["client_name"], r["count"]) for r in rollups) == [("ios", 1), ("web", 2)]
+        assert rollups[0]["bucket"] == start
+        assert await status.rollups("minute", None, None, None, 10) == []
+
+    run(make_storage, scenario)
+
+
+def test_sqlite_purges_expired_status_data(tmp_path):
+    async def scenario(store):
+        now = datetime.utcnow()
+        await store.status.insert({"id": "old", "client_name": "web", "timestamp": now - timedelta(days=2)})
+        await store.status.insert({"id": "new", "client_name": "web", "timestamp": now})
+        await store.status.increment_rollup("minute", "web", now, now - timedelta(seconds=1))
+        await store.status.purge_expired()
+        assert [c["id"] for c in await store.status.find(None, None, None, 10)] == ["new"]
+        assert await store.status.rollups("minute", None, None, None, 10) == []
+
+    run(lambda: SQLiteStorage(str(tmp_path / "purge.db"), status_retention=86400, purge_interval=0), scenario)
+
+
+def test_sqlite_uses_wal_and_history_index(tmp_path):
+    async def scenario(store):
+        journal_mode = await store.fetchone("PRAGMA journal_mode")
+        plan = await store.fetchall(
+            "EXPLAIN QUERY PLAN SELECT * FROM chat_messages WHERE companion_id = ? AND session_id = ? "
+            "AND (timestamp, seq) < (?, ?) ORDER BY timestamp DESC, seq DESC LIMIT 10",
+            ("c1", "s1", "2025", 1),
+        )
+        return journal_mode[0], " ".join(row[-1] for row in plan)
+
+    journal_mode, plan = run(lambda: SQLiteStorage(str(tmp_path / "wal.db"), status_retention=86400), scenario)
+    assert journal_mode == "wal"
+    assert "chat_messages_history" in plan
+    assert "TEMP B-TREE" not in plan